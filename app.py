@@ -1,9 +1,12 @@
 import streamlit as st
+import pandas as pd
 import logging
+from typing import Optional
 
 from src.config import setup_logging, STREAMLIT_PAGE_TITLE, STREAMLIT_LAYOUT
 from src.components.sidebar import render_sidebar, PAGES
 from src.components.filters import render_filters, apply_filters
+from src.components.sql_editor import render_sql_editor
 from src.pages.kpis import render_kpis_page
 from src.pages.trends import render_trends_page
 from src.pages.segmentation import render_segmentation_page
@@ -11,9 +14,50 @@ from src.pages.cohort import render_cohort_page
 from src.pages.funnel import render_funnel_page
 from src.pages.retention import render_retention_page
 from src.auth.authenticator import Authenticator
+from src.core.cache_manager import CacheManager, create_cache_manager
+from src.core.cache_metrics import set_current_page
+from src.core.cache_warmup import start_cache_warmup
+from src.core.client_pool import get_shared_client
+from src.core.job_tracker import begin_streamlit_rerun
+from src.core.query_budget import BYTES_BILLED_ATTR, QueryBudget
+from src.core.table_watcher import start_table_watcher
 
 logger: logging.Logger = setup_logging("painel_educacao")
 
+
+@st.cache_resource(show_spinner=False)
+def get_query_budget() -> QueryBudget:
+    """Orcamento de bytes unico por processo, somando as sessoes de cada usuario."""
+    return QueryBudget()
+
+
+@st.cache_resource(show_spinner=False)
+def get_query_cache() -> CacheManager:
+    """Cache de queries unico por processo, aquecido na subida e vigiado pelo TableWatcher."""
+    return create_cache_manager()
+
+
+def render_sql_editor_page() -> None:
+    client = get_shared_client()
+    if client is None:
+        render_sql_editor()
+        return
+    cache = get_query_cache()
+
+    def execute(query: str, maximum_bytes_billed: Optional[int] = None) -> Optional[pd.DataFrame]:
+        cached = cache.get(query)
+        if cached is not None:
+            result = cached.copy(deep=False)
+            result.attrs[BYTES_BILLED_ATTR] = 0
+            return result
+        result = client.execute_query(query, maximum_bytes_billed=maximum_bytes_billed)
+        if result is not None:
+            cache.set(query, result)
+        return result
+
+    render_sql_editor(execute, client.estimate, get_query_budget())
+
+
 PAGE_REGISTRY: dict[str, dict] = {
     "home": {"titulo": "Inicio", "render": None},
     "kpis": {"titulo": "KPIs", "render": render_kpis_page},
@@ -22,6 +66,7 @@ PAGE_REGISTRY: dict[str, dict] = {
     "cohort": {"titulo": "Analise de Coorte", "render": render_cohort_page},
     "funnel": {"titulo": "Funil Educacional", "render": render_funnel_page},
     "retention": {"titulo": "Retencao e Evasao", "render": render_retention_page},
+    "sql_editor": {"titulo": "Editor SQL", "render": render_sql_editor_page},
 }
 
 
@@ -72,6 +117,12 @@ def render_home() -> None:
 
 def main() -> None:
     configure_page()
+    begin_streamlit_rerun()
+
+    client = get_shared_client()
+    if client is not None:
+        start_cache_warmup(get_query_cache(), client.execute_query)
+        start_table_watcher(get_query_cache(), client.get_table_metadata)
 
     auth = Authenticator()
     if not auth.require_auth():
@@ -79,6 +130,7 @@ def main() -> None:
         return
 
     current_page: str = render_sidebar()
+    set_current_page(current_page)
 
     if current_page == "home":
         render_home()
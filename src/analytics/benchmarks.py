@@ -4,6 +4,9 @@ import plotly.graph_objects as go
 import logging
 from typing import Optional
 
+from src.components.metrics_cards import render_approximate_badge
+from src.core.approximate import approximate_error
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -74,6 +77,7 @@ def render_benchmarks_section(df: Optional[pd.DataFrame] = None) -> None:
         _render_demo_benchmarks()
         return
 
+    render_approximate_badge(approximate_error(df))
     cols = st.columns(len(NATIONAL_BENCHMARKS))
     for idx, (metric, benchmark) in enumerate(NATIONAL_BENCHMARKS.items()):
         if metric in df.columns:
@@ -4,6 +4,8 @@ from typing import Optional, Callable
 from dataclasses import dataclass, field
 from enum import Enum
 
+from src.core.query_budget import QueryBudget, billed_bytes, format_bytes
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -29,6 +31,8 @@ class ScheduledReport:
     next_run: Optional[datetime] = None
     enabled: bool = True
     created_at: datetime = field(default_factory=datetime.now)
+    owner: Optional[str] = None
+    last_estimate_bytes: Optional[int] = None
 
     def calculate_next_run(self) -> datetime:
         base = self.last_run or datetime.now()
@@ -52,8 +56,9 @@ class ScheduledReport:
 class ReportScheduler:
     """Agendador de relatorios automaticos."""
 
-    def __init__(self):
+    def __init__(self, budget: Optional[QueryBudget] = None):
         self.reports: list[ScheduledReport] = []
+        self.budget: Optional[QueryBudget] = budget
         self.logger: logging.Logger = logging.getLogger(__name__)
 
     def add_report(self, report: ScheduledReport) -> None:
@@ -78,12 +83,33 @@ class ReportScheduler:
         self,
         report: ScheduledReport,
         executor: Optional[Callable] = None,
+        estimator: Optional[Callable] = None,
     ) -> bool:
+        """Executa o relatorio agendado.
+
+        Com ``estimator`` (ex.: dry run da query do relatorio), o custo e
+        estimado antes e relatorios acima do orcamento de bytes sao recusados.
+        """
         try:
             self.logger.info("Executando relatorio: %s", report.name)
 
-            if executor:
-                executor(report)
+            user = report.owner or "agendador"
+            if estimator:
+                report.last_estimate_bytes = estimator(report)
+                self.logger.info(
+                    "Estimativa do relatorio %s: %s",
+                    report.name, format_bytes(report.last_estimate_bytes),
+                )
+                if self.budget is not None:
+                    allowed, message = self.budget.check(report.last_estimate_bytes, user)
+                    if not allowed:
+                        self.logger.warning("Relatorio %s recusado: %s", report.name, message)
+                        report.calculate_next_run()
+                        return False
+
+            result = executor(report) if executor else None
+            if self.budget is not None:
+                self.budget.record(user, billed_bytes(result, report.last_estimate_bytes))
 
             report.last_run = datetime.now()
             report.calculate_next_run()
@@ -96,11 +122,15 @@ class ReportScheduler:
             self.logger.error("Erro ao executar relatorio %s: %s", report.name, e)
             return False
 
-    def run_pending(self, executor: Optional[Callable] = None) -> int:
+    def run_pending(
+        self,
+        executor: Optional[Callable] = None,
+        estimator: Optional[Callable] = None,
+    ) -> int:
         pending = self.get_pending_reports()
         executed = 0
         for report in pending:
-            if self.execute_report(report, executor):
+            if self.execute_report(report, executor, estimator):
                 executed += 1
         self.logger.info("Relatorios executados: %d de %d pendentes", executed, len(pending))
         return executed
@@ -113,6 +143,7 @@ class ReportScheduler:
                 "ultima_execucao": r.last_run.isoformat() if r.last_run else "Nunca",
                 "proxima_execucao": r.next_run.isoformat() if r.next_run else "Pendente",
                 "habilitado": r.enabled,
+                "estimativa": format_bytes(r.last_estimate_bytes),
             }
             for r in self.reports
         ]
@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
 import logging
-from typing import Optional
+from typing import Any, Optional
+
+from src.core.aggregate_spec import AggregateSpec
+from src.core.query_planner import QueryRequest
+from src.core.subset_cache import Predicate
 
 
 logger: logging.Logger = logging.getLogger(__name__)
@@ -51,6 +55,72 @@ class FilterState:
         }
 
 
+def selected_ufs(filters: FilterState) -> list[str]:
+    """UFs efetivamente selecionadas: estados explicitos ou os das regioes."""
+    if not filters.regioes:
+        return list(filters.estados)
+    region_ufs = [uf for r in filters.regioes for uf in REGIOES_BR.get(r, [])]
+    if filters.estados:
+        return [uf for uf in filters.estados if uf in region_ufs]
+    return sorted(region_ufs)
+
+
+def compile_filters(filters: FilterState) -> tuple[Optional[str], dict[str, Any]]:
+    """Traduz os filtros em um WHERE parametrizado para o BigQuery.
+
+    Retorna ``(where, params)``; listas viram ``IN UNNEST(@param)`` e o texto
+    da query so depende de quais filtros estao ativos, nao dos valores. As
+    listas sao ordenadas para que a ordem de selecao nao mude a chave do cache.
+    """
+    conditions: list[str] = []
+    params: dict[str, Any] = {}
+
+    if filters.estados or filters.regioes:
+        conditions.append("sigla_uf IN UNNEST(@estados)")
+        params["estados"] = sorted(selected_ufs(filters))
+    if filters.dependencias:
+        conditions.append("dependencia_administrativa IN UNNEST(@dependencias)")
+        params["dependencias"] = sorted(filters.dependencias)
+    if filters.etapas:
+        conditions.append("etapa_ensino IN UNNEST(@etapas)")
+        params["etapas"] = sorted(filters.etapas)
+    if filters.ano_inicio:
+        conditions.append("ano >= @ano_inicio")
+        params["ano_inicio"] = filters.ano_inicio
+    if filters.ano_fim:
+        conditions.append("ano <= @ano_fim")
+        params["ano_fim"] = filters.ano_fim
+
+    where = " AND ".join(conditions) if conditions else None
+    return where, params
+
+
+def filter_predicates(filters: FilterState) -> dict[str, Predicate]:
+    """Filtros como predicados por coluna, para recortes em memoria (cubo)."""
+    predicates: dict[str, Predicate] = {}
+    if filters.estados or filters.regioes:
+        predicates["sigla_uf"] = Predicate(values=frozenset(selected_ufs(filters)))
+    if filters.dependencias:
+        predicates["dependencia_administrativa"] = Predicate(values=frozenset(filters.dependencias))
+    if filters.etapas:
+        predicates["etapa_ensino"] = Predicate(values=frozenset(filters.etapas))
+    if filters.ano_inicio or filters.ano_fim:
+        predicates["ano"] = Predicate(low=filters.ano_inicio or None, high=filters.ano_fim or None)
+    return predicates
+
+
+def filter_request(table: str, spec: AggregateSpec, filters: FilterState) -> QueryRequest:
+    """Pedido para o ``QueryPlanner`` com os filtros nas duas formas."""
+    where, params = compile_filters(filters)
+    return QueryRequest(
+        table=table,
+        spec=spec,
+        predicates=filter_predicates(filters),
+        where=where,
+        params=params,
+    )
+
+
 def render_filters(available_years: Optional[list[int]] = None) -> FilterState:
     state = FilterState()
 
@@ -96,8 +166,8 @@ def render_filters(available_years: Optional[list[int]] = None) -> FilterState:
 def apply_filters(df: pd.DataFrame, filters: FilterState) -> pd.DataFrame:
     filtered = df.copy()
 
-    if filters.estados and "sigla_uf" in filtered.columns:
-        filtered = filtered[filtered["sigla_uf"].isin(filters.estados)]
+    if (filters.estados or filters.regioes) and "sigla_uf" in filtered.columns:
+        filtered = filtered[filtered["sigla_uf"].isin(selected_ufs(filters))]
 
     if filters.dependencias and "dependencia_administrativa" in filtered.columns:
         filtered = filtered[
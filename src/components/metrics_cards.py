@@ -1,7 +1,10 @@
 import streamlit as st
+import pandas as pd
 import logging
 from typing import Optional
 
+from src.core.cache_manager import STALE_RESULT_ATTR
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -38,6 +41,27 @@ def render_metric_card(col: st.delta_generator.DeltaGenerator, card: MetricCard)
     )
 
 
+def approximate_badge_text(error_pct: float) -> str:
+    return f"aproximado \u00b1{error_pct:.1f}%"
+
+
+def render_approximate_badge(error_pct: Optional[float]) -> None:
+    """Aviso de que os numeros vieram do modo aproximado, com o erro estimado."""
+    if error_pct is None:
+        return
+    st.caption(
+        f":orange[{approximate_badge_text(error_pct)}]",
+        help="Calculado com agregacoes aproximadas/amostragem; intervalo de confianca de 95%.",
+    )
+
+
+def render_stale_notice(df: Optional[pd.DataFrame]) -> None:
+    """Aviso de que o BigQuery esta indisponivel e os dados sao de cache expirado."""
+    if df is None or not df.attrs.get(STALE_RESULT_ATTR):
+        return
+    st.warning("BigQuery indisponivel no momento; exibindo os ultimos dados em cache.")
+
+
 def render_metric_row(cards: list[MetricCard]) -> None:
     if not cards:
         return
@@ -5,6 +5,8 @@ import re
 from typing import Optional
 from datetime import datetime
 
+from src.core.query_budget import QueryBudget, billed_bytes, format_bytes
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -58,8 +60,52 @@ def validate_query(query: str) -> tuple[bool, str]:
     return True, "Query valida"
 
 
+def check_query_cost(
+    query: str,
+    estimate_callback: Optional[callable] = None,
+    budget: Optional[QueryBudget] = None,
+    user: Optional[str] = None,
+) -> tuple[bool, str, Optional[int]]:
+    """Estima a query (dry run) e confere contra o orcamento de bytes.
+
+    Retorna ``(permitida, mensagem, bytes_estimados)``.
+    """
+    if estimate_callback is None:
+        return True, "Estimativa indisponivel", None
+    estimated = estimate_callback(query)
+    if budget is None:
+        if estimated is None:
+            return True, "Estimativa indisponivel", None
+        return True, f"Estimativa: {format_bytes(estimated)} processados", estimated
+    allowed, message = budget.check(estimated, user)
+    return allowed, message, estimated
+
+
+def execute_within_budget(
+    query: str,
+    execute_callback: callable,
+    budget: Optional[QueryBudget] = None,
+    user: Optional[str] = None,
+    estimated: Optional[int] = None,
+) -> Optional[pd.DataFrame]:
+    """Executa a query com o teto de bytes restante do usuario e debita a cota.
+
+    O teto de ``budget.maximum_bytes_billed`` vai para o BigQuery como
+    ``maximum_bytes_billed``; a cota e debitada com os bytes faturados pelo
+    job, e so na falta deles com a estimativa do dry run.
+    """
+    if budget is None:
+        return execute_callback(query)
+    result = execute_callback(query, maximum_bytes_billed=budget.maximum_bytes_billed(user))
+    if result is not None:
+        budget.record(user, billed_bytes(result, estimated))
+    return result
+
+
 def render_sql_editor(
     execute_callback: Optional[callable] = None,
+    estimate_callback: Optional[callable] = None,
+    budget: Optional[QueryBudget] = None,
 ) -> Optional[pd.DataFrame]:
     st.subheader("Editor SQL")
     st.markdown("Execute queries personalizadas no Data Lake educacional.")
@@ -82,10 +128,12 @@ def render_sql_editor(
         help="Apenas queries SELECT sao permitidas",
     )
 
-    col1, col2 = st.columns([1, 4])
+    col1, col2, col3 = st.columns([1, 1, 3])
     with col1:
         execute = st.button("Executar", key="sql_execute", type="primary")
     with col2:
+        estimate = st.button("Estimar custo", key="sql_estimate")
+    with col3:
         limit: int = st.number_input(
             "Limite de linhas",
             min_value=10,
@@ -94,7 +142,7 @@ def render_sql_editor(
             key="sql_limit",
         )
 
-    if execute and query:
+    if (execute or estimate) and query:
         is_valid, message = validate_query(query)
 
         if not is_valid:
@@ -103,9 +151,22 @@ def render_sql_editor(
 
         limited_query = f"{query.rstrip().rstrip(';')}\nLIMIT {limit}"
 
+        user = st.session_state.get("username")
+        allowed, cost_message, estimated = check_query_cost(
+            limited_query, estimate_callback, budget, user
+        )
+        if not allowed:
+            st.error(f"Query recusada: {cost_message}")
+            return None
+        st.caption(cost_message)
+        if not execute:
+            return None
+
         if execute_callback:
             with st.spinner("Executando query..."):
-                result = execute_callback(limited_query)
+                result = execute_within_budget(
+                    limited_query, execute_callback, budget, user, estimated
+                )
                 if result is not None:
                     st.success(f"Query executada: {len(result)} linhas retornadas")
                     st.dataframe(result, use_container_width=True)
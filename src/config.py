@@ -13,8 +13,53 @@ BIGQUERY_SCOPES: list[str] = [
 ]
 
 DEFAULT_QUERY_TIMEOUT: int = 300
+MAX_BYTES_BILLED_PER_QUERY: int = 10 * 1024 ** 3
+MAX_BYTES_BILLED_PER_USER: int = 100 * 1024 ** 3
+BYTES_BUDGET_WINDOW_SECONDS: int = 24 * 3600
+RETRY_MAX_ATTEMPTS: int = 4
+RETRY_INITIAL_DELAY_SECONDS: float = 1.0
+RETRY_MAX_DELAY_SECONDS: float = 30.0
+CIRCUIT_FAILURE_THRESHOLD: int = 5
+CIRCUIT_RESET_SECONDS: int = 60
+JOB_DEDUP_WINDOW_SECONDS: int = 60
+HEALTH_CHECK_INTERVAL_SECONDS: int = 300
+HEALTH_CHECK_FAILURE_THRESHOLD: int = 3
 CACHE_TTL_SECONDS: int = 3600
+CACHE_HARD_TTL_SECONDS: int = 24 * 3600
+TABLE_WATCH_INTERVAL_SECONDS: int = 300
 MAX_CACHE_ENTRIES: int = 100
+MAX_CACHE_BYTES: int = 512 * 1024 * 1024
+CACHE_COMPRESSION: str = "zstd"
+CACHE_HOT_ENTRIES: int = 8
+DISK_CACHE_DIR: Path = PROJECT_ROOT / "data" / "cache"
+DISK_CACHE_MAX_BYTES: int = 5 * 1024 * 1024 * 1024
+SHARED_CACHE_PATH: Path = PROJECT_ROOT / "data" / "shared" / "cache.sqlite"
+SHARED_CACHE_MAX_BYTES: int = 5 * 1024 * 1024 * 1024
+
+QUERY_HISTORY_PATH: Path = PROJECT_ROOT / "data" / "query_history.json"
+WARMUP_TOP_N: int = 20
+WARMUP_MAX_WORKERS: int = 4
+WARMUP_TIME_BUDGET_SECONDS: int = 300
+WARMUP_BYTES_BUDGET: int = 256 * 1024 * 1024
+
+LOCAL_EXTRACT_DIR: Path = PROJECT_ROOT / "data" / "extracts"
+
+CUBE_PATH: Path = PROJECT_ROOT / "data" / "cube" / "educacao.parquet"
+CUBE_DIMENSIONS: list[str] = [
+    "ano", "regiao", "sigla_uf", "dependencia_administrativa", "localizacao", "etapa_ensino",
+]
+CUBE_MEASURES: list[str] = [
+    "taxa_aprovacao", "taxa_reprovacao", "taxa_abandono", "ideb", "total_matriculas",
+]
+
+PLANNER_METADATA_TTL: int = 300
+PLANNER_CACHE_COST_MS: float = 1.0
+PLANNER_CUBE_LATENCY_MS: float = 5.0
+PLANNER_CUBE_ROWS_PER_MS: float = 50_000.0
+PLANNER_LOCAL_LATENCY_MS: float = 50.0
+PLANNER_LOCAL_BYTES_PER_MS: float = 200_000.0
+PLANNER_BIGQUERY_LATENCY_MS: float = 1500.0
+PLANNER_BIGQUERY_BYTES_PER_MS: float = 1_000_000.0
 
 STREAMLIT_PAGE_TITLE: str = "Painel Educação Básica"
 STREAMLIT_LAYOUT: str = "wide"
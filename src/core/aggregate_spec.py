@@ -0,0 +1,105 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+import pandas as pd
+
+from src.core.approximate import (
+    APPROX_QUANTILE_BUCKETS,
+    SAMPLE_ROWS_COLUMN,
+    ApproximateMode,
+    finalize_approximate,
+)
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SQL_AGGREGATES: dict[str, str] = {
+    "sum": "SUM({col})",
+    "mean": "AVG({col})",
+    "median": f"APPROX_QUANTILES({{col}}, {APPROX_QUANTILE_BUCKETS})"
+              f"[OFFSET({APPROX_QUANTILE_BUCKETS // 2})]",
+    "std": "STDDEV({col})",
+    "min": "MIN({col})",
+    "max": "MAX({col})",
+    "count": "COUNT({col})",
+    "count_distinct": "COUNT(DISTINCT {col})",
+}
+APPROX_SQL_AGGREGATES: dict[str, str] = {
+    "count_distinct": "APPROX_COUNT_DISTINCT({col})",
+}
+SCALED_STATS: frozenset[str] = frozenset({"sum", "count"})
+PANDAS_AGGREGATES: dict[str, str] = {"count_distinct": "nunique"}
+
+
+@dataclass(frozen=True)
+class Measure:
+    """Estatistica calculada sobre uma coluna, com o nome da coluna de saida."""
+
+    column: str
+    stat: str
+    alias: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        if self.stat not in SQL_AGGREGATES:
+            raise ValueError(f"Estatistica de agregacao invalida: {self.stat}")
+
+    @property
+    def name(self) -> str:
+        return self.alias or f"{self.stat}_{self.column}"
+
+    def sql(self, approximate: Optional[ApproximateMode] = None) -> str:
+        template = SQL_AGGREGATES[self.stat]
+        if approximate is not None:
+            template = APPROX_SQL_AGGREGATES.get(self.stat, template)
+        expr = template.format(col=self.column)
+        if approximate is not None and approximate.is_sampled and self.stat in SCALED_STATS:
+            expr = f"{expr} * {approximate.scale_factor:g}"
+        return f"{expr} AS {self.name}"
+
+
+@dataclass
+class AggregateSpec:
+    """Agregacao declarada por uma pagina: chaves de grupo e medidas.
+
+    A mesma especificacao gera as expressoes para
+    ``QueryBuilder.build_aggregation`` (o BigQuery devolve so a tabela
+    agregada) e calcula o resultado equivalente em pandas quando os dados
+    ja estao em memoria no nivel de linha.
+    """
+
+    group_by: list[str] = field(default_factory=list)
+    measures: list[Measure] = field(default_factory=list)
+
+    def metric_expressions(self, approximate: Optional[ApproximateMode] = None) -> list[str]:
+        metrics = [m.sql(approximate) for m in self.measures]
+        if approximate is not None:
+            metrics.append(f"COUNT(*) AS {SAMPLE_ROWS_COLUMN}")
+        return metrics
+
+    def finalize_approximate(self, df: pd.DataFrame, approximate: ApproximateMode) -> pd.DataFrame:
+        return finalize_approximate(df, [m.stat for m in self.measures], approximate)
+
+    @property
+    def output_columns(self) -> list[str]:
+        return self.group_by + [m.name for m in self.measures]
+
+    def is_aggregated(self, df: pd.DataFrame) -> bool:
+        """``True`` se ``df`` ja e o resultado desta agregacao."""
+        if not set(self.output_columns) <= set(df.columns):
+            return False
+        if not self.group_by:
+            return len(df) == 1
+        return not df.duplicated(self.group_by).any()
+
+    def aggregate(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.is_aggregated(df):
+            return df[self.output_columns].reset_index(drop=True)
+        named = {
+            m.name: (m.column, PANDAS_AGGREGATES.get(m.stat, m.stat)) for m in self.measures
+        }
+        if self.group_by:
+            return df.groupby(self.group_by).agg(**named).reset_index()
+        return pd.DataFrame({
+            name: [df[column].agg(stat)] for name, (column, stat) in named.items()
+        })
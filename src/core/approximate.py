@@ -0,0 +1,93 @@
+import logging
+import math
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import pandas as pd
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+APPROX_QUANTILE_BUCKETS: int = 100
+HLL_PRECISION: int = 15
+Z_95: float = 1.96
+SAMPLE_ROWS_COLUMN: str = "linhas_amostra"
+APPROX_ERROR_ATTR: str = "erro_aproximado_pct"
+
+
+@dataclass(frozen=True)
+class ApproximateMode:
+    """Modo de agregacao aproximada para visoes exploratorias.
+
+    Troca contagens distintas por ``APPROX_COUNT_DISTINCT`` e, com
+    ``sample_percent``, le apenas uma amostra de blocos da tabela via
+    ``TABLESAMPLE SYSTEM``; somas e contagens sao extrapoladas pela fracao.
+    """
+
+    sample_percent: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        if self.sample_percent is not None and not 0 < self.sample_percent <= 100:
+            raise ValueError(f"Percentual de amostragem invalido: {self.sample_percent}")
+
+    @property
+    def is_sampled(self) -> bool:
+        return self.sample_percent is not None and self.sample_percent < 100
+
+    @property
+    def scale_factor(self) -> float:
+        return 100 / self.sample_percent if self.is_sampled else 1.0
+
+    def table_sample_clause(self) -> str:
+        if not self.is_sampled:
+            return ""
+        return f"TABLESAMPLE SYSTEM ({self.sample_percent:g} PERCENT)"
+
+
+def error_bound_pct(
+    stats: Iterable[str],
+    mode: ApproximateMode,
+    sample_rows: Optional[int] = None,
+) -> float:
+    """Erro relativo estimado (IC de 95%, em %) do resultado aproximado.
+
+    Considera o erro de posto de ``APPROX_QUANTILES``, o erro padrao do
+    HyperLogLog++ e, com amostragem, o erro amostral de medias e totais
+    (coeficiente de variacao 1, conservador para taxas). A amostragem por
+    blocos pode ter erro maior que o de linhas independentes.
+    """
+    stats = set(stats)
+    errors: list[float] = []
+    if "median" in stats:
+        errors.append(100 / APPROX_QUANTILE_BUCKETS)
+    if "count_distinct" in stats:
+        errors.append(100 * 1.04 / math.sqrt(2 ** HLL_PRECISION))
+    if mode.is_sampled:
+        if not sample_rows:
+            return 100.0
+        fraction = mode.sample_percent / 100
+        errors.append(100 * Z_95 * math.sqrt((1 - fraction) / sample_rows))
+    return round(max(errors, default=0.0), 2)
+
+
+def finalize_approximate(
+    df: pd.DataFrame,
+    stats: Iterable[str],
+    mode: ApproximateMode,
+) -> pd.DataFrame:
+    """Remove a contagem da amostra e anota o erro estimado em ``df.attrs``.
+
+    O erro reportado e o do grupo com menos linhas na amostra.
+    """
+    sample_rows = None
+    if SAMPLE_ROWS_COLUMN in df.columns:
+        sample_rows = int(df[SAMPLE_ROWS_COLUMN].min()) if not df.empty else 0
+        df = df.drop(columns=[SAMPLE_ROWS_COLUMN])
+    df.attrs[APPROX_ERROR_ATTR] = error_bound_pct(stats, mode, sample_rows)
+    return df
+
+
+def approximate_error(df: Optional[pd.DataFrame]) -> Optional[float]:
+    if df is None:
+        return None
+    return df.attrs.get(APPROX_ERROR_ATTR)
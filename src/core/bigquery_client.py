@@ -1,55 +1,473 @@
+from google.api_core import exceptions
 from google.cloud import bigquery
 from google.oauth2 import service_account
-from typing import Optional
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from typing import Any, Callable, Iterator, Optional, TypeVar
 import logging
+import time
 from pathlib import Path
 
 import pandas as pd
+import pyarrow as pa
+
+from src.config import MAX_BYTES_BILLED_PER_QUERY
+from src.core.job_tracker import (
+    JobSupersededError,
+    JobTracker,
+    get_current_rerun,
+    job_tracker,
+)
+from src.core.query_budget import BYTES_BILLED_ATTR
+from src.core.query_history import QueryHistory, QueryRecord
+from src.core.retry import CircuitBreaker, CircuitOpenError, RetryPolicy, deterministic_job_id
+from src.core.sql_normalizer import query_key
+
+
+T = TypeVar("T")
+
+
+class JobTimeoutError(RuntimeError):
+    """Job que nao terminou dentro do ``timeout`` pedido; nao e repetido."""
+
+
+class ResultTooLargeError(RuntimeError):
+    """Resultado acima de ``max_memory_bytes``; os lotes ja entregues estao incompletos."""
+
+
+_PARAM_TYPES: dict[type, str] = {
+    bool: "BOOL",
+    int: "INT64",
+    float: "FLOAT64",
+    str: "STRING",
+}
+
+
+_ARROW_TYPES: dict[str, pa.DataType] = {
+    "STRING": pa.string(),
+    "BYTES": pa.binary(),
+    "INTEGER": pa.int64(),
+    "INT64": pa.int64(),
+    "FLOAT": pa.float64(),
+    "FLOAT64": pa.float64(),
+    "NUMERIC": pa.decimal128(38, 9),
+    "BOOLEAN": pa.bool_(),
+    "BOOL": pa.bool_(),
+    "DATE": pa.date32(),
+    "DATETIME": pa.timestamp("us"),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+}
+
+
+def _empty_batch(schema: Optional[list[Any]]) -> pa.RecordBatch:
+    """Lote Arrow sem linhas com as colunas do schema do resultado do BigQuery.
+
+    Tipos sem equivalente direto (RECORD, GEOGRAPHY, ...) viram ``string``.
+    """
+    fields = []
+    for field in schema or []:
+        arrow_type = _ARROW_TYPES.get(field.field_type, pa.string())
+        if field.mode == "REPEATED":
+            arrow_type = pa.list_(arrow_type)
+        fields.append(pa.field(field.name, arrow_type))
+    return pa.RecordBatch.from_pylist([], schema=pa.schema(fields))
+
+
+def build_query_parameters(params: dict[str, Any]) -> list[Any]:
+    """Converte ``{"nome": valor}`` em parametros de query do BigQuery.
+
+    Listas, tuplas e conjuntos viram ``ArrayQueryParameter`` (usados com
+    ``IN UNNEST(@nome)``); o tipo e inferido do primeiro elemento.
+    """
+    query_params: list[Any] = []
+    for name, value in params.items():
+        if isinstance(value, (list, tuple, set, frozenset)):
+            values = sorted(value) if isinstance(value, (set, frozenset)) else list(value)
+            param_type = _PARAM_TYPES.get(type(values[0]), "STRING") if values else "STRING"
+            query_params.append(bigquery.ArrayQueryParameter(name, param_type, values))
+        else:
+            param_type = _PARAM_TYPES.get(type(value), "STRING")
+            query_params.append(bigquery.ScalarQueryParameter(name, param_type, value))
+    return query_params
 
 
 class BigQueryClient:
     """Cliente para conexao e execucao de queries no BigQuery."""
 
-    def __init__(self, credentials_path: str, project_id: str):
+    def __init__(
+        self,
+        credentials_path: str,
+        project_id: str,
+        use_storage_api: bool = False,
+        maximum_bytes_billed: Optional[int] = MAX_BYTES_BILLED_PER_QUERY,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        jobs: Optional[JobTracker] = None,
+        history: Optional[QueryHistory] = None,
+    ):
         self.credentials_path: Path = Path(credentials_path)
         self.project_id: str = project_id
+        self.use_storage_api: bool = use_storage_api
+        self.maximum_bytes_billed: Optional[int] = maximum_bytes_billed
+        self.retry_policy: RetryPolicy = retry_policy or RetryPolicy()
+        self.breaker: CircuitBreaker = breaker or CircuitBreaker()
+        self.jobs: JobTracker = jobs or job_tracker
+        self.history: Optional[QueryHistory] = history
         self.client: Optional[bigquery.Client] = None
+        self._credentials: Optional[service_account.Credentials] = None
+        self._storage_client: Optional[Any] = None
         self.logger: logging.Logger = logging.getLogger(__name__)
 
-    def connect(self) -> bool:
+    def connect(self, health_check: bool = True) -> bool:
         try:
             credentials = service_account.Credentials.from_service_account_file(
                 str(self.credentials_path),
                 scopes=["https://www.googleapis.com/auth/bigquery"],
             )
+            self._credentials = credentials
             self.client = bigquery.Client(
                 credentials=credentials,
                 project=self.project_id,
             )
-            test_query = "SELECT 1 AS health_check"
-            self.client.query(test_query).result()
+            if health_check:
+                test_query = "SELECT 1 AS health_check"
+                self.client.query(test_query).result()
             self.logger.info("Conexao BigQuery estabelecida: %s", self.project_id)
             return True
         except Exception as e:
             self.logger.error("Falha ao conectar no BigQuery: %s", e)
             return False
 
-    def execute_query(self, query: str, timeout: int = 300) -> Optional[pd.DataFrame]:
+    def health_check(self, timeout: int = 30) -> bool:
+        if not self.client:
+            return False
+        try:
+            self.client.query("SELECT 1 AS health_check").result(timeout=timeout)
+            return True
+        except Exception as e:
+            self.logger.warning("Health check do BigQuery falhou: %s", e)
+            return False
+
+    def _get_storage_client(self) -> Optional[Any]:
+        if not self.use_storage_api:
+            return None
+        if self._storage_client is not None:
+            return self._storage_client
+        try:
+            from google.cloud import bigquery_storage
+        except ImportError:
+            self.logger.warning(
+                "google-cloud-bigquery-storage nao instalado, usando API REST"
+            )
+            self.use_storage_api = False
+            return None
+        self._storage_client = bigquery_storage.BigQueryReadClient(
+            credentials=self._credentials,
+        )
+        return self._storage_client
+
+    def _job_config(
+        self,
+        params: Optional[dict[str, Any]] = None,
+        maximum_bytes_billed: Optional[int] = None,
+    ) -> bigquery.QueryJobConfig:
+        job_config = bigquery.QueryJobConfig(
+            use_query_cache=True,
+        )
+        if params:
+            job_config.query_parameters = build_query_parameters(params)
+        limits = [
+            limit for limit in (self.maximum_bytes_billed, maximum_bytes_billed)
+            if limit is not None
+        ]
+        if limits:
+            job_config.maximum_bytes_billed = min(limits)
+        return job_config
+
+    def estimate(
+        self,
+        query: str,
+        params: Optional[dict[str, Any]] = None,
+    ) -> Optional[int]:
+        """Bytes que a query processaria, via dry run (sem custo nem execucao)."""
         if not self.client:
             self.logger.error("Cliente BigQuery nao inicializado")
             return None
         try:
-            job_config = bigquery.QueryJobConfig(
-                use_query_cache=True,
+            job_config = self._job_config(params)
+            job_config.dry_run = True
+            job_config.use_query_cache = False
+            query_job = self.client.query(query, job_config=job_config)
+            estimated = int(query_job.total_bytes_processed or 0)
+            self.logger.info("Estimativa da query: %.1fMB processados", estimated / 1e6)
+            return estimated
+        except Exception as e:
+            self.logger.error("Erro ao estimar query: %s", e)
+            return None
+
+    def _run_job(
+        self,
+        query: str,
+        job_config: bigquery.QueryJobConfig,
+        timeout: int,
+        fetch: Callable[[Any], T],
+        params: Optional[dict[str, Any]] = None,
+    ) -> T:
+        """Submete o job com ``job_id`` deterministico, sob a politica de retry.
+
+        Se o job ja existe (resposta perdida de uma tentativa anterior ou
+        outra replica com a mesma query), o job existente e reaproveitado.
+        Um job que falhou ou foi cancelado nao pode ser reenviado com o mesmo
+        id, entao a tentativa seguinte recebe um sufixo; um job proprio cuja
+        leitura falhou e cancelado antes disso. Enquanto espera o resultado, o
+        job fica registrado em ``self.jobs`` para o rerun corrente.
+        """
+        base_id = deterministic_job_id(query, params)
+        key = query_key(query, params)
+        state = {"job_id": base_id, "retries": 0, "adopted": False}
+
+        def next_id() -> None:
+            state["retries"] += 1
+            state["job_id"] = f"{base_id}_r{state['retries']}"
+
+        def submit() -> Any:
+            state["adopted"] = False
+            while True:
+                try:
+                    return self.client.query(
+                        query, job_config=job_config, job_id=state["job_id"], timeout=timeout
+                    )
+                except exceptions.Conflict:
+                    existing = self.client.get_job(state["job_id"])
+                    if getattr(existing, "error_result", None) is None:
+                        self.logger.info(
+                            "Job %s ja existe; reaproveitando resultado", state["job_id"]
+                        )
+                        state["adopted"] = True
+                        return existing
+                    next_id()
+
+        def attempt() -> T:
+            if self.jobs.is_superseded(get_current_rerun()):
+                raise JobSupersededError(f"Rerun substituido; {base_id} nao submetido")
+            query_job = submit()
+            owner = self.jobs.register(
+                query_job, key=key, cancellable=not state["adopted"]
             )
-            query_job = self.client.query(query, job_config=job_config, timeout=timeout)
-            df = query_job.to_dataframe()
+            try:
+                return fetch(query_job)
+            except Exception:
+                if not state["adopted"]:
+                    self._cancel_job(query_job)
+                next_id()
+                raise
+            finally:
+                self.jobs.unregister(query_job, owner)
+
+        return self.retry_policy.call(attempt, breaker=self.breaker, description=base_id)
+
+    def _cancel_job(self, job: Any) -> None:
+        try:
+            job.cancel()
+        except Exception as e:
+            self.logger.debug("Falha ao cancelar job %s: %s", getattr(job, "job_id", "?"), e)
+
+    def _fetch_dataframe(self, job: Any) -> pd.DataFrame:
+        df = job.to_dataframe(bqstorage_client=self._get_storage_client())
+        billed = getattr(job, "total_bytes_billed", None)
+        if billed is not None:
+            df.attrs[BYTES_BILLED_ATTR] = int(billed)
+        return df
+
+    def _record_history(
+        self,
+        query: str,
+        params: Optional[dict[str, Any]],
+        start: float,
+        rows: int = 0,
+        error: Optional[Exception] = None,
+    ) -> None:
+        """Registra no historico as queries pedidas por um rerun do app.
+
+        Execucoes fora de um rerun (aquecimento, revalidacao em segundo
+        plano) ficam de fora para nao inflar a popularidade das queries.
+        """
+        if self.history is None or get_current_rerun() is None:
+            return
+        self.history.add(QueryRecord(
+            query=query,
+            execution_time_ms=(time.perf_counter() - start) * 1000,
+            rows_returned=rows,
+            status="success" if error is None else "error",
+            error_message=None if error is None else str(error),
+            params=params,
+        ))
+
+    def execute_query(
+        self,
+        query: str,
+        timeout: int = 300,
+        params: Optional[dict[str, Any]] = None,
+        maximum_bytes_billed: Optional[int] = None,
+    ) -> Optional[pd.DataFrame]:
+        if not self.client:
+            self.logger.error("Cliente BigQuery nao inicializado")
+            return None
+        start = time.perf_counter()
+        try:
+            job_config = self._job_config(params, maximum_bytes_billed)
+            df = self._run_job(query, job_config, timeout, self._fetch_dataframe, params=params)
             self.logger.info(
                 "Query executada com sucesso: %d linhas retornadas", len(df)
             )
+            self._record_history(query, params, start, rows=len(df))
+            return df
+        except CircuitOpenError as e:
+            self.logger.warning("Query nao executada: %s", e)
+            return None
+        except Exception as e:
+            if isinstance(e, JobSupersededError) or self.jobs.is_superseded(get_current_rerun()):
+                self.logger.info("Query cancelada: rerun substituido por outro mais novo")
+            else:
+                self.logger.error("Erro ao executar query: %s", e)
+                self._record_history(query, params, start, error=e)
+            return None
+
+    def stream_query(
+        self,
+        query: str,
+        timeout: int = 300,
+        as_dataframe: bool = False,
+        max_memory_bytes: Optional[int] = None,
+        params: Optional[dict[str, Any]] = None,
+        maximum_bytes_billed: Optional[int] = None,
+    ) -> Iterator[pa.RecordBatch | pd.DataFrame]:
+        """Le o resultado em lotes Arrow, sem materializar tudo de uma vez.
+
+        Com ``max_memory_bytes``, ``ResultTooLargeError`` e levantado assim
+        que o proximo lote ultrapassaria o limite; os lotes ja entregues nao
+        formam o resultado completo. Erros no meio da leitura tambem sao
+        propagados. Um resultado sem linhas produz um unico lote vazio com
+        as colunas do schema.
+        """
+        if not self.client:
+            self.logger.error("Cliente BigQuery nao inicializado")
+            return
+        try:
+            job_config = self._job_config(params, maximum_bytes_billed)
+            rows = self._run_job(
+                query, job_config, timeout, lambda job: job.result(timeout=timeout), params=params
+            )
+            batches = rows.to_arrow_iterable(bqstorage_client=self._get_storage_client())
+
+            total_bytes = 0
+            total_rows = 0
+            yielded = False
+            for batch in batches:
+                if max_memory_bytes is not None and total_bytes + batch.nbytes > max_memory_bytes:
+                    raise ResultTooLargeError(
+                        f"Limite de memoria atingido ({max_memory_bytes} bytes): streaming "
+                        f"interrompido apos {total_rows} linhas"
+                    )
+                total_bytes += batch.nbytes
+                total_rows += batch.num_rows
+                yielded = True
+                yield batch.to_pandas() if as_dataframe else batch
+            if not yielded:
+                batch = _empty_batch(getattr(rows, "schema", None))
+                yield batch.to_pandas() if as_dataframe else batch
+
+            self.logger.info(
+                "Streaming concluido: %d linhas, %.1fMB", total_rows, total_bytes / 1e6
+            )
+        except ResultTooLargeError as e:
+            self.logger.warning("%s", e)
+            raise
+        except Exception as e:
+            self.logger.error("Erro no streaming da query: %s", e)
+            raise
+
+    def execute_query_streaming(
+        self,
+        query: str,
+        timeout: int = 300,
+        max_memory_bytes: Optional[int] = None,
+        params: Optional[dict[str, Any]] = None,
+        maximum_bytes_billed: Optional[int] = None,
+    ) -> Optional[pd.DataFrame]:
+        """Materializa o resultado do streaming; ``None`` se falhar ou passar do limite.
+
+        Uma query sem linhas devolve um DataFrame vazio com as colunas do
+        resultado, nunca ``None``.
+        """
+        try:
+            batches = list(
+                self.stream_query(
+                    query, timeout=timeout, max_memory_bytes=max_memory_bytes, params=params,
+                    maximum_bytes_billed=maximum_bytes_billed,
+                )
+            )
+        except Exception:
+            return None
+        if not batches:
+            return None
+        table = pa.Table.from_batches(batches)
+        return table.to_pandas(self_destruct=True)
+
+    def execute_many(
+        self,
+        queries: dict[str, str],
+        max_workers: int = 4,
+        timeout: int = 300,
+        params: Optional[dict[str, dict[str, Any]]] = None,
+    ) -> Iterator[tuple[str, Optional[pd.DataFrame]]]:
+        """Executa as queries em paralelo e devolve os resultados conforme concluem.
+
+        Cada item e ``(nome, DataFrame)``; queries que falham ou excedem o
+        ``timeout`` produzem ``(nome, None)`` sem afetar as demais. Cada
+        query passa por ``_run_job`` (retry, circuit breaker, ``job_id``
+        deterministico e rastreamento do rerun corrente), com os parametros
+        de ``params[nome]``.
+        """
+        if not self.client:
+            self.logger.error("Cliente BigQuery nao inicializado")
+            return
+
+        params = params or {}
+        self.logger.info("Queries submetidas em paralelo: %d", len(queries))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(
+                    copy_context().run, self._collect_job,
+                    name, query, timeout, params.get(name),
+                ): name
+                for name, query in queries.items()
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _collect_job(
+        self,
+        name: str,
+        query: str,
+        timeout: int,
+        params: Optional[dict[str, Any]] = None,
+    ) -> Optional[pd.DataFrame]:
+        def fetch(job: Any) -> pd.DataFrame:
+            try:
+                job.result(timeout=timeout)
+            except (TimeoutError, concurrent.futures.TimeoutError) as e:
+                raise JobTimeoutError(f"Query '{name}' excedeu o timeout de {timeout}s") from e
+            return self._fetch_dataframe(job)
+
+        try:
+            job_config = self._job_config(params)
+            df = self._run_job(query, job_config, timeout, fetch, params=params)
+            self.logger.info("Query '%s' concluida: %d linhas", name, len(df))
             return df
         except Exception as e:
-            self.logger.error("Erro ao executar query: %s", e)
+            self.logger.error("Erro ao executar query '%s': %s", name, e)
             return None
 
     def get_table_metadata(self, table_ref: str) -> dict:
@@ -66,6 +484,9 @@ class BigQueryClient:
             return {}
 
     def close(self) -> None:
+        if self._storage_client is not None:
+            self._storage_client.transport.close()
+            self._storage_client = None
         if self.client:
             self.client.close()
             self.logger.info("Conexao BigQuery encerrada")
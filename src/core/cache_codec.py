@@ -0,0 +1,96 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.config import CACHE_COMPRESSION
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+CODEC_COMPRESSIONS: tuple[str, ...] = ("zstd", "lz4")
+
+
+@dataclass
+class CompressedValue:
+    """Resultado tabular guardado como buffer Arrow IPC comprimido."""
+
+    buffer: pa.Buffer
+    schema: pa.Schema
+    is_pandas: bool
+    raw_bytes: int
+
+    @property
+    def nbytes(self) -> int:
+        return self.buffer.size
+
+    @property
+    def ratio(self) -> float:
+        return self.raw_bytes / self.nbytes if self.nbytes else 0.0
+
+
+class ArrowCodec:
+    """Comprime DataFrames e tabelas Arrow para armazenamento no cache.
+
+    Colunas de texto com muitos valores repetidos (``sigla_uf``, ``regiao``,
+    ``etapa_ensino``) sao codificadas como dicionario antes da compressao
+    LZ4/ZSTD do formato IPC. Na decodificacao o schema original e
+    restaurado, entao o chamador recebe exatamente os mesmos tipos.
+    """
+
+    def __init__(
+        self,
+        compression: str = CACHE_COMPRESSION,
+        dictionary_max_ratio: float = 0.5,
+    ):
+        if compression not in CODEC_COMPRESSIONS:
+            raise ValueError(f"Compressao de cache invalida: {compression}")
+        if not pa.Codec.is_available(compression):
+            raise ValueError(f"Compressao {compression} indisponivel nesta build do pyarrow")
+        self.compression: str = compression
+        self.dictionary_max_ratio: float = dictionary_max_ratio
+        self._options: pa.ipc.IpcWriteOptions = pa.ipc.IpcWriteOptions(compression=compression)
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def _dictionary_encode(self, table: pa.Table) -> pa.Table:
+        for idx, column in enumerate(table.columns):
+            if not (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+                continue
+            if len(column) == 0:
+                continue
+            distinct = pc.count_distinct(column).as_py()
+            if distinct / len(column) <= self.dictionary_max_ratio:
+                table = table.set_column(idx, table.field(idx).name, pc.dictionary_encode(column))
+        return table
+
+    def encode(self, value: Any) -> Optional[CompressedValue]:
+        if not isinstance(value, (pd.DataFrame, pa.Table)):
+            return None
+
+        try:
+            if isinstance(value, pd.DataFrame):
+                table = pa.Table.from_pandas(value)
+                raw_bytes = int(value.memory_usage(deep=True).sum())
+            else:
+                table = value
+                raw_bytes = value.nbytes
+            encoded = self._dictionary_encode(table)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, encoded.schema, options=self._options) as writer:
+                writer.write_table(encoded)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            self.logger.warning("Valor nao comprimido no cache: %s", e)
+            return None
+        return CompressedValue(
+            buffer=sink.getvalue(),
+            schema=table.schema,
+            is_pandas=isinstance(value, pd.DataFrame),
+            raw_bytes=raw_bytes,
+        )
+
+    def decode(self, compressed: CompressedValue) -> Any:
+        table = pa.ipc.open_stream(compressed.buffer).read_all().cast(compressed.schema)
+        return table.to_pandas() if compressed.is_pandas else table
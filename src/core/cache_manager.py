@@ -1,50 +1,285 @@
-import hashlib
+import sys
 import time
 import logging
-from typing import Any, Optional
+from collections import OrderedDict
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional
 from threading import Lock
 
+import pandas as pd
+
+from src.config import (
+    CACHE_HARD_TTL_SECONDS,
+    CACHE_HOT_ENTRIES,
+    CACHE_TTL_SECONDS,
+    DISK_CACHE_DIR,
+    MAX_CACHE_BYTES,
+    MAX_CACHE_ENTRIES,
+    SHARED_CACHE_PATH,
+)
+from src.core.cache_codec import ArrowCodec, CompressedValue
+from src.core.cache_metrics import CacheMetrics, DEFAULT_NAMESPACE, get_current_page
+from src.core.disk_cache import DiskCache
+from src.core.job_tracker import job_tracker
+from src.core.shared_cache import SharedCache
+from src.core.single_flight import SingleFlight
+from src.core.sql_normalizer import extract_tables, query_key, sql_fingerprint
+
+
+STALE_RESULT_ATTR: str = "dados_obsoletos"
+
+
+def estimate_size(value: Any) -> int:
+    """Estima o tamanho em memoria de um valor armazenado no cache."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
 
 class CacheEntry:
-    """Entrada individual do cache com TTL."""
+    """Entrada individual do cache com TTL.
 
-    def __init__(self, value: Any, ttl: int):
+    ``ttl`` e o prazo de validade (soft TTL); ``hard_ttl`` e o limite ate o
+    qual o valor ainda pode ser servido como obsoleto enquanto e atualizado.
+    ``tables`` lista as tabelas lidas pela query, usadas na invalidacao.
+    ``namespace``, ``page``, ``fingerprint`` e ``compute_ms`` alimentam as
+    metricas de uso do cache.
+    """
+
+    def __init__(
+        self,
+        value: Any,
+        ttl: int,
+        size_bytes: Optional[int] = None,
+        hard_ttl: Optional[int] = None,
+        tables: frozenset[str] = frozenset(),
+        created_at: Optional[float] = None,
+        namespace: str = DEFAULT_NAMESPACE,
+        fingerprint: Optional[str] = None,
+        compute_ms: float = 0.0,
+    ):
         self.value: Any = value
-        self.created_at: float = time.time()
+        self.created_at: float = created_at or time.time()
+        self.tables: frozenset[str] = tables
+        self.namespace: str = namespace
+        self.page: str = get_current_page()
+        self.fingerprint: Optional[str] = fingerprint
+        self.compute_ms: float = compute_ms
         self.ttl: int = ttl
+        self.hard_ttl: int = max(hard_ttl or ttl, ttl)
+        self.size_bytes: int = size_bytes if size_bytes is not None else estimate_size(value)
+        self.hits: int = 0
 
     def is_expired(self) -> bool:
         return (time.time() - self.created_at) > self.ttl
 
+    def is_hard_expired(self) -> bool:
+        return (time.time() - self.created_at) > self.hard_ttl
+
+    def remaining_ttl(self) -> float:
+        return self.ttl - (time.time() - self.created_at)
+
 
 class CacheManager:
-    """Gerenciador de cache em memoria para queries BigQuery."""
+    """Gerenciador de cache em memoria para queries BigQuery.
 
-    def __init__(self, default_ttl: int = 3600, max_entries: int = 100):
+    A remocao segue a politica LRU: cada acesso move a entrada para o fim da
+    fila e, quando ``max_entries`` ou ``max_bytes`` seria ultrapassado, as
+    entradas usadas ha mais tempo saem primeiro.
+
+    Com ``disk_cache`` configurado, as entradas removidas da memoria e os
+    valores a partir de ``spill_threshold_bytes`` vao para o disco, e um
+    miss em memoria consulta o disco antes de devolver ``None``. Um
+    ``SharedCache`` no mesmo parametro troca o disco local por um cache
+    comum a todas as replicas: cada valor gravado e publicado na hora e o
+    ``get_or_compute`` coordena a execucao entre processos.
+
+    Com ``codec``, resultados tabulares ficam em memoria como buffers Arrow
+    comprimidos e sao descomprimidos no acesso; as ``hot_entries`` lidas
+    mais recentemente ficam tambem na forma descomprimida. Essas copias
+    contam para ``max_bytes`` e sao as primeiras a sair quando falta espaco.
+
+    Com ``default_hard_ttl`` maior que ``default_ttl``, ``get_or_compute``
+    passa a operar em stale-while-revalidate: entre o soft e o hard TTL o
+    valor antigo e devolvido na hora e atualizado em segundo plano. Se o
+    ``loader`` falhar, o ultimo valor conhecido e devolvido mesmo apos o hard
+    TTL, marcado em ``attrs[STALE_RESULT_ATTR]`` quando for um DataFrame.
+    """
+
+    def __init__(
+        self,
+        default_ttl: int = CACHE_TTL_SECONDS,
+        max_entries: int = MAX_CACHE_ENTRIES,
+        max_bytes: Optional[int] = MAX_CACHE_BYTES,
+        disk_cache: Optional[DiskCache | SharedCache] = None,
+        spill_threshold_bytes: Optional[int] = None,
+        default_hard_ttl: Optional[int] = None,
+        refresh_workers: int = 2,
+        codec: Optional[ArrowCodec] = None,
+        hot_entries: int = CACHE_HOT_ENTRIES,
+    ):
         self.default_ttl: int = default_ttl
+        self.default_hard_ttl: Optional[int] = default_hard_ttl
         self.max_entries: int = max_entries
-        self._cache: dict[str, CacheEntry] = {}
+        self.max_bytes: Optional[int] = max_bytes
+        self.disk_cache: Optional[DiskCache | SharedCache] = disk_cache
+        self.spill_threshold_bytes: Optional[int] = spill_threshold_bytes
+        self._cache: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.codec: Optional[ArrowCodec] = codec
+        self.hot_entries: int = hot_entries
+        self._hot: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._hot_bytes: int = 0
+        self._table_index: dict[str, set[str]] = {}
+        self._total_bytes: int = 0
+        self._evictions: int = 0
         self._lock: Lock = Lock()
+        self._flight: SingleFlight = SingleFlight()
+        self.metrics: CacheMetrics = CacheMetrics()
+        self._refresh_workers: int = refresh_workers
+        self._refresh_pool: Optional[ThreadPoolExecutor] = None
+        self._refreshing: set[str] = set()
         self.logger: logging.Logger = logging.getLogger(__name__)
 
     @staticmethod
     def _generate_key(query: str, params: Optional[dict] = None) -> str:
-        raw = query + str(sorted(params.items())) if params else query
-        return hashlib.sha256(raw.encode()).hexdigest()
+        return query_key(query, params)
 
-    def get(self, query: str, params: Optional[dict] = None) -> Optional[Any]:
-        key = self._generate_key(query, params)
+    def get(
+        self,
+        query: str,
+        params: Optional[dict] = None,
+        namespace: str = DEFAULT_NAMESPACE,
+        record_miss: bool = True,
+    ) -> Optional[Any]:
+        """Valor valido para a query; com ``record_miss=False`` a ausencia nao conta miss."""
+        value, _ = self._lookup(
+            self._generate_key(query, params),
+            allow_stale=False,
+            namespace=namespace,
+            fingerprint=sql_fingerprint(query),
+            record_miss=record_miss,
+        )
+        return value
+
+    def _lookup(
+        self,
+        key: str,
+        allow_stale: bool,
+        namespace: str = DEFAULT_NAMESPACE,
+        fingerprint: Optional[str] = None,
+        record_miss: bool = True,
+    ) -> tuple[Optional[Any], bool]:
         with self._lock:
             entry = self._cache.get(key)
-            if entry is None:
-                self.logger.debug("Cache miss: %s", key[:12])
-                return None
-            if entry.is_expired():
-                del self._cache[key]
+            if entry is not None and entry.is_hard_expired():
+                self._remove(key)
+                self.metrics.record_expiration(entry.namespace, entry.page, entry.fingerprint)
+                entry = None
                 self.logger.debug("Cache expirado: %s", key[:12])
+            if entry is not None and (allow_stale or not entry.is_expired()):
+                self._cache.move_to_end(key)
+                entry.hits += 1
+                stale = entry.is_expired()
+                self.metrics.record_hit(namespace, fingerprint=fingerprint,
+                                        saved_ms=entry.compute_ms)
+                self.logger.debug("Cache hit%s: %s", " (obsoleto)" if stale else "", key[:12])
+                stored = entry.value
+            else:
+                stored = None
+        if stored is not None:
+            return self._materialize(key, stored), stale
+
+        value = self._get_from_disk(key)
+        if value is None:
+            if record_miss:
+                self.metrics.record_miss(namespace, fingerprint=fingerprint)
+            self.logger.debug("Cache miss: %s", key[:12])
+        else:
+            self.metrics.record_hit(namespace, fingerprint=fingerprint)
+        return value, False
+
+    def contains(self, query: str, params: Optional[dict] = None) -> bool:
+        """``True`` se ha valor valido em memoria, sem contar hit ou miss."""
+        with self._lock:
+            entry = self._cache.get(self._generate_key(query, params))
+            return entry is not None and not entry.is_expired()
+
+    def peek(self, query: str, params: Optional[dict] = None) -> Optional[Any]:
+        """Valor valido em memoria, sem contar hit ou miss."""
+        return self._peek(self._generate_key(query, params))
+
+    def _peek(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry.is_expired():
                 return None
-            self.logger.debug("Cache hit: %s", key[:12])
-            return entry.value
+            stored = entry.value
+        return self._materialize(key, stored)
+
+    def _compress(self, value: Any) -> Any:
+        if self.codec is None:
+            return value
+        return self.codec.encode(value) or value
+
+    def _decompress(self, stored: Any) -> Any:
+        if isinstance(stored, CompressedValue):
+            return self.codec.decode(stored)
+        return stored
+
+    def _materialize(self, key: str, stored: Any) -> Any:
+        if not isinstance(stored, CompressedValue):
+            return stored
+        with self._lock:
+            if key in self._hot:
+                self._hot.move_to_end(key)
+                return self._hot[key][0]
+        value = self.codec.decode(stored)
+        size = estimate_size(value)
+        with self._lock:
+            if (
+                key in self._cache
+                and self.hot_entries > 0
+                and (self.max_bytes is None or size <= self.max_bytes)
+            ):
+                self._drop_hot(key)
+                self._hot[key] = (value, size)
+                self._hot_bytes += size
+                self._total_bytes += size
+                while self._hot and (
+                    len(self._hot) > self.hot_entries
+                    or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+                ):
+                    self._drop_hot(next(iter(self._hot)))
+        return value
+
+    def _drop_hot(self, key: str) -> None:
+        hot = self._hot.pop(key, None)
+        if hot is not None:
+            self._hot_bytes -= hot[1]
+            self._total_bytes -= hot[1]
+
+    def _get_from_disk(self, key: str) -> Optional[Any]:
+        if self.disk_cache is None:
+            return None
+        hit = self.disk_cache.get(key)
+        if hit is None:
+            return None
+        value, meta = hit
+        entry = CacheEntry(
+            self._compress(value),
+            max(1, int(meta["expires_at"] - meta["created_at"])),
+            tables=frozenset(meta.get("tables", [])),
+            created_at=meta["created_at"],
+        )
+        if self._fits_in_memory(entry):
+            self._store(key, entry)
+        return value
 
     def set(
         self,
@@ -52,43 +287,267 @@ class CacheManager:
         value: Any,
         params: Optional[dict] = None,
         ttl: Optional[int] = None,
+        hard_ttl: Optional[int] = None,
+        tables: Optional[Iterable[str]] = None,
+        namespace: str = DEFAULT_NAMESPACE,
+        compute_ms: float = 0.0,
     ) -> None:
         key = self._generate_key(query, params)
         effective_ttl = ttl or self.default_ttl
+        entry = CacheEntry(
+            self._compress(value),
+            effective_ttl,
+            hard_ttl=hard_ttl or self.default_hard_ttl,
+            tables=frozenset(tables) if tables is not None else extract_tables(query),
+            namespace=namespace,
+            fingerprint=sql_fingerprint(query),
+            compute_ms=compute_ms,
+        )
+        self.metrics.record_store(entry.size_bytes, namespace, entry.page, entry.fingerprint)
 
-        with self._lock:
-            if len(self._cache) >= self.max_entries:
-                self._evict_oldest()
-            self._cache[key] = CacheEntry(value, effective_ttl)
-            self.logger.debug("Cache set: %s (TTL: %ds)", key[:12], effective_ttl)
-
-    def _evict_oldest(self) -> None:
-        if not self._cache:
-            return
-        oldest_key = min(
-            self._cache, key=lambda k: self._cache[k].created_at
+        if self._write_through:
+            self.disk_cache.put(key, value, effective_ttl, tables=entry.tables,
+                                created_at=entry.created_at)
+        elif self.disk_cache is not None:
+            self.disk_cache.delete(key)
+
+        if not self._fits_in_memory(entry):
+            if self._write_through:
+                return
+            if self.disk_cache is not None and self.disk_cache.put(
+                key, value, effective_ttl, tables=entry.tables
+            ):
+                self.logger.debug(
+                    "Cache set em disco: %s (%d bytes)", key[:12], entry.size_bytes
+                )
+                return
+            if self.max_bytes is not None and entry.size_bytes > self.max_bytes:
+                self.logger.warning(
+                    "Valor maior que o limite do cache (%d > %d bytes), nao armazenado: %s",
+                    entry.size_bytes, self.max_bytes, key[:12],
+                )
+                return
+
+        self._store(key, entry)
+        self.logger.debug(
+            "Cache set: %s (TTL: %ds, %d bytes)", key[:12], effective_ttl, entry.size_bytes
         )
-        del self._cache[oldest_key]
-        self.logger.debug("Cache evicted: %s", oldest_key[:12])
+
+    @property
+    def _write_through(self) -> bool:
+        return getattr(self.disk_cache, "write_through", False)
+
+    def _fits_in_memory(self, entry: CacheEntry) -> bool:
+        if self.max_bytes is not None and entry.size_bytes > self.max_bytes:
+            return False
+        if (
+            self.spill_threshold_bytes is not None
+            and entry.size_bytes >= self.spill_threshold_bytes
+        ):
+            return False
+        return True
+
+    def _store(self, key: str, entry: CacheEntry) -> None:
+        evicted: list[tuple[str, CacheEntry]] = []
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+            while self._hot and (
+                self.max_bytes is not None
+                and self._total_bytes + entry.size_bytes > self.max_bytes
+            ):
+                self._drop_hot(next(iter(self._hot)))
+            while self._cache and (
+                len(self._cache) >= self.max_entries
+                or (
+                    self.max_bytes is not None
+                    and self._total_bytes + entry.size_bytes > self.max_bytes
+                )
+            ):
+                evicted.append(self._evict_lru())
+            self._cache[key] = entry
+            self._total_bytes += entry.size_bytes
+            for table in entry.tables:
+                self._table_index.setdefault(table, set()).add(key)
+
+        if self.disk_cache is not None and not self._write_through:
+            for evicted_key, evicted_entry in evicted:
+                if evicted_entry.remaining_ttl() > 0:
+                    self.disk_cache.put(
+                        evicted_key,
+                        self._decompress(evicted_entry.value),
+                        evicted_entry.ttl,
+                        tables=evicted_entry.tables,
+                        created_at=evicted_entry.created_at,
+                    )
+
+    def get_or_compute(
+        self,
+        query: str,
+        loader: Callable[[], Any],
+        params: Optional[dict] = None,
+        ttl: Optional[int] = None,
+        namespace: str = DEFAULT_NAMESPACE,
+    ) -> Optional[Any]:
+        """Busca no cache ou executa ``loader`` uma unica vez por chave em voo."""
+        key = self._generate_key(query, params)
+        fingerprint = sql_fingerprint(query)
+        with self._lock:
+            previous = self._cache.get(key)
+        cached, stale = self._lookup(key, True, namespace, fingerprint)
+        if cached is not None:
+            if stale:
+                self._schedule_refresh(key, query, loader, params, ttl, namespace)
+            return cached
+
+        def compute() -> Optional[Any]:
+            start = time.perf_counter()
+            value = loader()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.metrics.record_miss_latency(elapsed_ms, namespace, fingerprint=fingerprint)
+            if value is not None:
+                self.set(query, value, params=params, ttl=ttl,
+                         namespace=namespace, compute_ms=elapsed_ms)
+            return value
+
+        def load() -> Optional[Any]:
+            value = self._peek(key)
+            if value is not None:
+                return value
+            if isinstance(self.disk_cache, SharedCache):
+                return self.disk_cache.single_flight(key, compute)
+            return compute()
+
+        with job_tracker.waiting(key):
+            value = self._flight.do(key, load)
+        if value is None and previous is not None:
+            self.logger.warning(
+                "Origem indisponivel; servindo resultado expirado de %s", key[:12]
+            )
+            return self._mark_stale(self._decompress(previous.value))
+        return value
+
+    @staticmethod
+    def _mark_stale(value: Any) -> Any:
+        if isinstance(value, pd.DataFrame):
+            value = value.copy(deep=False)
+            value.attrs[STALE_RESULT_ATTR] = True
+        return value
+
+    def _schedule_refresh(
+        self,
+        key: str,
+        query: str,
+        loader: Callable[[], Any],
+        params: Optional[dict],
+        ttl: Optional[int],
+        namespace: str = DEFAULT_NAMESPACE,
+    ) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._refresh_pool is None:
+                self._refresh_pool = ThreadPoolExecutor(
+                    max_workers=self._refresh_workers,
+                    thread_name_prefix="cache-refresh",
+                )
+
+        def refresh() -> None:
+            try:
+                start = time.perf_counter()
+                value = loader()
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if value is not None:
+                    self.set(query, value, params=params, ttl=ttl,
+                             namespace=namespace, compute_ms=elapsed_ms)
+                    self.logger.debug("Cache revalidado em segundo plano: %s", key[:12])
+            except Exception as e:
+                self.logger.error("Erro ao revalidar cache %s: %s", key[:12], e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_pool.submit(refresh)
+
+    def _remove(self, key: str) -> CacheEntry:
+        entry = self._cache.pop(key)
+        self._drop_hot(key)
+        self._total_bytes -= entry.size_bytes
+        for table in entry.tables:
+            keys = self._table_index.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._table_index[table]
+        return entry
+
+    def _evict_lru(self) -> tuple[str, CacheEntry]:
+        lru_key = next(iter(self._cache))
+        entry = self._remove(lru_key)
+        self._evictions += 1
+        self.metrics.record_eviction(entry.namespace, entry.page, entry.fingerprint)
+        self.logger.debug("Cache evicted: %s", lru_key[:12])
+        return lru_key, entry
 
     def invalidate(self, query: str, params: Optional[dict] = None) -> None:
         key = self._generate_key(query, params)
         with self._lock:
             if key in self._cache:
-                del self._cache[key]
+                self._remove(key)
                 self.logger.debug("Cache invalidado: %s", key[:12])
+        if self.disk_cache is not None:
+            self.disk_cache.delete(key)
+
+    def invalidate_table(self, table: str, modified_after: Optional[float] = None) -> int:
+        """Remove as entradas que leem ``table``.
+
+        Com ``modified_after`` (timestamp da ultima alteracao da tabela), so
+        saem as entradas criadas antes dessa alteracao.
+        """
+        with self._lock:
+            keys = [
+                key for key in self._table_index.get(table, ())
+                if modified_after is None or self._cache[key].created_at < modified_after
+            ]
+            for key in keys:
+                self._remove(key)
+        removed = len(keys)
+        if self.disk_cache is not None:
+            removed += self.disk_cache.delete_by_table(table, modified_after)
+        if removed:
+            self.logger.info("Cache invalidado por alteracao em %s: %d entradas", table, removed)
+        return removed
+
+    def tracked_tables(self) -> frozenset[str]:
+        with self._lock:
+            tables = frozenset(self._table_index)
+        if self.disk_cache is not None:
+            tables |= self.disk_cache.tracked_tables()
+        return tables
 
     def clear(self) -> None:
         with self._lock:
             count = len(self._cache)
             self._cache.clear()
+            self._hot.clear()
+            self._hot_bytes = 0
+            self._table_index.clear()
+            self._total_bytes = 0
             self.logger.info("Cache limpo: %d entradas removidas", count)
+        if self.disk_cache is not None:
+            self.disk_cache.clear()
 
     @property
     def size(self) -> int:
         return len(self._cache)
 
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
     def stats(self) -> dict:
+        metrics = self.metrics.snapshot()
         with self._lock:
             expired = sum(1 for e in self._cache.values() if e.is_expired())
             return {
@@ -96,4 +555,56 @@ class CacheManager:
                 "expired_entries": expired,
                 "active_entries": len(self._cache) - expired,
                 "max_entries": self.max_entries,
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+                "hot_entries": len(self._hot),
+                "hot_bytes": self._hot_bytes,
+                "refreshing": len(self._refreshing),
+                "entries": [
+                    {
+                        "key": key[:12],
+                        "size_bytes": entry.size_bytes,
+                        "compressed": isinstance(entry.value, CompressedValue),
+                        "hits": entry.hits,
+                        "age_seconds": round(time.time() - entry.created_at, 1),
+                    }
+                    for key, entry in self._cache.items()
+                ],
+                "hit_ratio": metrics["total"]["hit_ratio"],
+                "metrics": metrics,
+                "single_flight": self._flight.stats(),
+                "disk": self.disk_cache.stats() if self.disk_cache is not None else None,
             }
+
+    def prometheus_metrics(self, prefix: str = "painel_cache") -> str:
+        """Exporta as metricas do cache no formato texto do Prometheus."""
+        gauges = [
+            (f"{prefix}_entries", "Entradas atualmente em memoria", len(self._cache)),
+            (f"{prefix}_bytes", "Bytes atualmente em memoria", self._total_bytes),
+        ]
+        lines: list[str] = []
+        for name, help_text, value in gauges:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"])
+        return "\n".join(lines) + "\n" + self.metrics.to_prometheus(prefix)
+
+
+def create_cache_manager(
+    shared_cache_path: Path = SHARED_CACHE_PATH,
+    disk_cache_dir: Path = DISK_CACHE_DIR,
+) -> CacheManager:
+    """Cache de queries do app, com os limites e TTLs do ``config``.
+
+    Com o volume compartilhado montado (diretorio de ``shared_cache_path``
+    existente), o segundo nivel e o ``SharedCache`` comum as replicas; sem
+    ele, o ``DiskCache`` local em ``disk_cache_dir``.
+    """
+    if shared_cache_path.parent.is_dir():
+        second_level: DiskCache | SharedCache = SharedCache(shared_cache_path)
+    else:
+        second_level = DiskCache(disk_cache_dir)
+    return CacheManager(
+        default_hard_ttl=CACHE_HARD_TTL_SECONDS,
+        disk_cache=second_level,
+        codec=ArrowCodec(),
+    )
@@ -0,0 +1,217 @@
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from threading import Lock
+from typing import Optional
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_NAMESPACE: str = "default"
+UNKNOWN_PAGE: str = "-"
+OTHER_FINGERPRINTS: str = "outros"
+
+_current_page: ContextVar[str] = ContextVar("cache_metrics_page", default=UNKNOWN_PAGE)
+
+
+def set_current_page(page: str) -> None:
+    """Define a pagina atribuida as operacoes de cache da execucao corrente."""
+    _current_page.set(page)
+
+
+def get_current_page() -> str:
+    return _current_page.get()
+
+
+@dataclass
+class CacheCounters:
+    """Contadores acumulados de uso do cache."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    bytes_stored: int = 0
+    miss_latency_ms: float = 0.0
+    time_saved_ms: float = 0.0
+
+    def merge(self, other: "CacheCounters") -> None:
+        self.hits += other.hits
+        self.misses += other.misses
+        self.evictions += other.evictions
+        self.expirations += other.expirations
+        self.bytes_stored += other.bytes_stored
+        self.miss_latency_ms += other.miss_latency_ms
+        self.time_saved_ms += other.time_saved_ms
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return round(self.hits / total, 4) if total else 0.0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["miss_latency_ms"] = round(self.miss_latency_ms, 1)
+        data["time_saved_ms"] = round(self.time_saved_ms, 1)
+        data["hit_ratio"] = self.hit_ratio
+        data["avg_miss_latency_ms"] = (
+            round(self.miss_latency_ms / self.misses, 1) if self.misses else 0.0
+        )
+        return data
+
+
+_PROMETHEUS_COUNTERS: list[tuple[str, str, str]] = [
+    ("hits", "hits_total", "Leituras atendidas pelo cache"),
+    ("misses", "misses_total", "Leituras nao atendidas pelo cache"),
+    ("evictions", "evictions_total", "Entradas removidas por falta de espaco"),
+    ("expirations", "expirations_total", "Entradas removidas por TTL"),
+    ("bytes_stored", "stored_bytes_total", "Bytes gravados no cache"),
+    ("miss_latency_ms", "miss_latency_ms_total", "Tempo gasto calculando misses"),
+    ("time_saved_ms", "time_saved_ms_total", "Tempo de query economizado por hits"),
+]
+
+
+class CacheMetrics:
+    """Contadores de hit/miss/eviction por namespace, pagina e fingerprint."""
+
+    def __init__(self, max_fingerprints: int = 500):
+        self.max_fingerprints: int = max_fingerprints
+        self._by_label: dict[tuple[str, str], CacheCounters] = {}
+        self._by_fingerprint: dict[str, CacheCounters] = {}
+        self._lock: Lock = Lock()
+
+    def _counters(
+        self,
+        namespace: str,
+        page: Optional[str],
+        fingerprint: Optional[str],
+    ) -> list[CacheCounters]:
+        label = (namespace, page or get_current_page())
+        counters = [self._by_label.setdefault(label, CacheCounters())]
+        if fingerprint:
+            fp = fingerprint[:16]
+            full = len(self._by_fingerprint) >= self.max_fingerprints
+            if fp not in self._by_fingerprint and full:
+                fp = OTHER_FINGERPRINTS
+            counters.append(self._by_fingerprint.setdefault(fp, CacheCounters()))
+        return counters
+
+    def record_hit(
+        self,
+        namespace: str = DEFAULT_NAMESPACE,
+        page: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+        saved_ms: float = 0.0,
+    ) -> None:
+        with self._lock:
+            for c in self._counters(namespace, page, fingerprint):
+                c.hits += 1
+                c.time_saved_ms += saved_ms
+
+    def record_miss(
+        self,
+        namespace: str = DEFAULT_NAMESPACE,
+        page: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+        latency_ms: float = 0.0,
+    ) -> None:
+        with self._lock:
+            for c in self._counters(namespace, page, fingerprint):
+                c.misses += 1
+                c.miss_latency_ms += latency_ms
+
+    def record_miss_latency(
+        self,
+        latency_ms: float,
+        namespace: str = DEFAULT_NAMESPACE,
+        page: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            for c in self._counters(namespace, page, fingerprint):
+                c.miss_latency_ms += latency_ms
+
+    def record_eviction(
+        self,
+        namespace: str = DEFAULT_NAMESPACE,
+        page: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            for c in self._counters(namespace, page, fingerprint):
+                c.evictions += 1
+
+    def record_expiration(
+        self,
+        namespace: str = DEFAULT_NAMESPACE,
+        page: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            for c in self._counters(namespace, page, fingerprint):
+                c.expirations += 1
+
+    def record_store(
+        self,
+        size_bytes: int,
+        namespace: str = DEFAULT_NAMESPACE,
+        page: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            for c in self._counters(namespace, page, fingerprint):
+                c.bytes_stored += size_bytes
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = CacheCounters()
+            by_namespace: dict[str, CacheCounters] = {}
+            by_page: dict[str, CacheCounters] = {}
+            for (namespace, page), counters in self._by_label.items():
+                total.merge(counters)
+                by_namespace.setdefault(namespace, CacheCounters()).merge(counters)
+                by_page.setdefault(page, CacheCounters()).merge(counters)
+            return {
+                "total": total.to_dict(),
+                "by_namespace": {k: v.to_dict() for k, v in by_namespace.items()},
+                "by_page": {k: v.to_dict() for k, v in by_page.items()},
+                "by_fingerprint": {k: v.to_dict() for k, v in self._by_fingerprint.items()},
+            }
+
+    def to_prometheus(self, prefix: str = "painel_cache") -> str:
+        with self._lock:
+            labels = list(self._by_label.items())
+            fingerprints = list(self._by_fingerprint.items())
+
+        lines: list[str] = []
+        for attr, suffix, help_text in _PROMETHEUS_COUNTERS:
+            name = f"{prefix}_{suffix}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (namespace, page), counters in labels:
+                lines.append(
+                    f'{name}{{namespace="{_escape(namespace)}",page="{_escape(page)}"}} '
+                    f"{_format_value(getattr(counters, attr))}"
+                )
+            query_name = f"{prefix}_query_{suffix}"
+            lines.append(f"# HELP {query_name} {help_text} (por fingerprint de query)")
+            lines.append(f"# TYPE {query_name} counter")
+            for fingerprint, counters in fingerprints:
+                lines.append(
+                    f'{query_name}{{fingerprint="{fingerprint}"}} '
+                    f"{_format_value(getattr(counters, attr))}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._by_label.clear()
+            self._by_fingerprint.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.3f}"
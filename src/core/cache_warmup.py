@@ -0,0 +1,193 @@
+import streamlit as st
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from threading import Lock, Thread
+from typing import Any, Callable, Optional
+
+from src.config import (
+    WARMUP_BYTES_BUDGET,
+    WARMUP_MAX_WORKERS,
+    WARMUP_TIME_BUDGET_SECONDS,
+    WARMUP_TOP_N,
+)
+from src.core.cache_manager import CacheManager, estimate_size
+from src.core.query_history import QueryHistory, query_history
+from src.core.saved_queries import SavedQueryManager
+from src.core.sql_normalizer import sql_fingerprint
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+WARMUP_NAMESPACE: str = "warmup"
+
+
+@dataclass
+class WarmupCandidate:
+    """Query candidata ao aquecimento, com a pontuacao de prioridade."""
+
+    fingerprint: str
+    query: str
+    executions: int = 0
+    avg_execution_ms: float = 0.0
+    params: Optional[dict[str, Any]] = None
+
+    @property
+    def score(self) -> float:
+        return self.executions * self.avg_execution_ms
+
+
+def rank_candidates(
+    history: QueryHistory,
+    saved_queries: Optional[SavedQueryManager] = None,
+    top_n: int = WARMUP_TOP_N,
+) -> list[WarmupCandidate]:
+    """Ordena os fingerprints por frequencia x latencia media.
+
+    Cada fingerprint e aquecido com o texto e os parametros da execucao mais
+    recente. Queries salvas que nunca rodaram entram no fim da fila, com
+    pontuacao zero.
+    """
+    candidates: dict[str, WarmupCandidate] = {}
+    for fingerprint, records in history.group_by_fingerprint().items():
+        successes = [r for r in records if r.is_success]
+        if not successes:
+            continue
+        latest = max(successes, key=lambda r: r.executed_at)
+        candidates[fingerprint] = WarmupCandidate(
+            fingerprint=fingerprint,
+            query=latest.query,
+            executions=len(successes),
+            avg_execution_ms=sum(r.execution_time_ms for r in successes) / len(successes),
+            params=latest.params,
+        )
+
+    if saved_queries is not None:
+        for saved in saved_queries.list_queries():
+            fingerprint = sql_fingerprint(saved.query)
+            candidates.setdefault(fingerprint, WarmupCandidate(fingerprint, saved.query))
+
+    ranked = sorted(candidates.values(), key=lambda c: c.score, reverse=True)
+    return ranked[:top_n]
+
+
+class CacheWarmer:
+    """Pre-executa as queries mais populares no ``CacheManager``.
+
+    As queries rodam em um pool de threads na ordem do ranking. Quando o
+    orcamento de tempo ou de bytes acaba, as restantes sao descartadas;
+    queries ja em execucao terminam, mas o resultado so entra no cache se
+    ainda couber no orcamento de bytes.
+    """
+
+    def __init__(
+        self,
+        cache: CacheManager,
+        executor: Callable[..., Any],
+        max_workers: int = WARMUP_MAX_WORKERS,
+        time_budget_seconds: float = WARMUP_TIME_BUDGET_SECONDS,
+        bytes_budget: int = WARMUP_BYTES_BUDGET,
+    ):
+        self.cache: CacheManager = cache
+        self.executor: Callable[..., Any] = executor
+        self.max_workers: int = max_workers
+        self.time_budget_seconds: float = time_budget_seconds
+        self.bytes_budget: int = bytes_budget
+        self._lock: Lock = Lock()
+        self._bytes_used: int = 0
+        self._deadline: float = 0.0
+        self._thread: Optional[Thread] = None
+        self.summary: dict = {}
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def _budget_left(self) -> bool:
+        return time.monotonic() < self._deadline and self._bytes_used < self.bytes_budget
+
+    def _warm_one(self, candidate: WarmupCandidate) -> str:
+        if not self._budget_left():
+            return "skipped"
+        cached = self.cache.get(candidate.query, candidate.params, namespace=WARMUP_NAMESPACE)
+        if cached is not None:
+            return "cached"
+
+        start = time.perf_counter()
+        value = self.executor(candidate.query, params=candidate.params)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if value is None:
+            return "failed"
+
+        size = estimate_size(value)
+        with self._lock:
+            if self._bytes_used + size > self.bytes_budget:
+                self.logger.debug(
+                    "Aquecimento sem orcamento de bytes: %s", candidate.fingerprint[:12]
+                )
+                return "skipped"
+            self._bytes_used += size
+        self.cache.set(
+            candidate.query, value, candidate.params,
+            namespace=WARMUP_NAMESPACE, compute_ms=elapsed_ms,
+        )
+        return "warmed"
+
+    def run(self, candidates: list[WarmupCandidate]) -> dict:
+        start = time.monotonic()
+        self._deadline = start + self.time_budget_seconds
+        self._bytes_used = 0
+        summary = {"warmed": 0, "cached": 0, "skipped": 0, "failed": 0}
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="cache-warmup")
+        pending = {pool.submit(self._warm_one, c) for c in candidates}
+        while pending:
+            remaining = self._deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    summary[future.result()] += 1
+                except Exception as e:
+                    summary["failed"] += 1
+                    self.logger.error("Erro ao aquecer query: %s", e)
+        summary["skipped"] += len(pending)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+        summary["bytes"] = self._bytes_used
+        summary["elapsed_seconds"] = round(time.monotonic() - start, 2)
+        self.summary = summary
+        self.logger.info(
+            "Aquecimento do cache: %d aquecidas, %d ja em cache, %d puladas, %d falhas (%.1fs)",
+            summary["warmed"], summary["cached"], summary["skipped"], summary["failed"],
+            summary["elapsed_seconds"],
+        )
+        return summary
+
+    def start(self, candidates: list[WarmupCandidate]) -> Thread:
+        """Roda o aquecimento em uma thread de fundo, sem bloquear o app."""
+        self._thread = Thread(
+            target=self.run, args=(candidates,), name="cache-warmup", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+@st.cache_resource(show_spinner=False)
+def start_cache_warmup(
+    _cache: CacheManager,
+    _executor: Callable[..., Any],
+    top_n: int = WARMUP_TOP_N,
+) -> CacheWarmer:
+    """Dispara o aquecimento uma unica vez por processo, na subida do app.
+
+    ``_executor`` recebe a query e ``params=``, como ``BigQueryClient.execute_query``.
+    """
+    candidates = rank_candidates(query_history, SavedQueryManager(), top_n=top_n)
+    warmer = CacheWarmer(_cache, _executor)
+    warmer.start(candidates)
+    logger.info("Aquecimento do cache iniciado: %d queries candidatas", len(candidates))
+    return warmer
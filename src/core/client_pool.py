@@ -0,0 +1,161 @@
+import streamlit as st
+import logging
+import time
+from threading import Event, Lock, Thread
+from typing import Callable, Optional
+
+from src.config import HEALTH_CHECK_FAILURE_THRESHOLD, HEALTH_CHECK_INTERVAL_SECONDS
+from src.core.bigquery_client import BigQueryClient
+from src.core.query_history import query_history
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class BigQueryClientPool:
+    """Cliente BigQuery unico por processo, compartilhado entre sessoes e reruns.
+
+    O cliente (e a sessao HTTP autenticada dele) e criado na primeira
+    requisicao, sem query de health check. As credenciais de service account
+    sao renovadas sob demanda pelo proprio cliente quando o token expira; o
+    health check roda apenas em uma thread de fundo, a cada
+    ``health_check_interval`` segundos.
+
+    So apos ``failure_threshold`` health checks seguidos com falha o cliente
+    e recriado. O novo cliente substitui o antigo de forma atomica; o antigo
+    nao e fechado, pois queries em andamento ainda o usam, e e descartado
+    quando a ultima referencia a ele sai de cena.
+    """
+
+    def __init__(
+        self,
+        credentials_path: str,
+        project_id: str,
+        health_check_interval: float = HEALTH_CHECK_INTERVAL_SECONDS,
+        failure_threshold: int = HEALTH_CHECK_FAILURE_THRESHOLD,
+        client_factory: Optional[Callable[[], Optional[BigQueryClient]]] = None,
+    ):
+        self.credentials_path: str = credentials_path
+        self.project_id: str = project_id
+        self.health_check_interval: float = health_check_interval
+        self.failure_threshold: int = max(1, failure_threshold)
+        self._client_factory: Callable[[], Optional[BigQueryClient]] = (
+            client_factory or self._create_client
+        )
+        self._client: Optional[BigQueryClient] = None
+        self._lock: Lock = Lock()
+        self._stop: Event = Event()
+        self._health_thread: Optional[Thread] = None
+        self.healthy: Optional[bool] = None
+        self.consecutive_failures: int = 0
+        self.last_health_check: Optional[float] = None
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def _create_client(self) -> Optional[BigQueryClient]:
+        client = BigQueryClient(self.credentials_path, self.project_id, history=query_history)
+        if not client.connect(health_check=False):
+            return None
+        return client
+
+    def get_client(self) -> Optional[BigQueryClient]:
+        if self._client is not None:
+            return self._client
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory()
+                if self._client is not None:
+                    self.logger.info("Cliente BigQuery compartilhado criado: %s", self.project_id)
+                    self._start_health_checks()
+        return self._client
+
+    def _start_health_checks(self) -> None:
+        if self.health_check_interval <= 0 or self._health_thread is not None:
+            return
+        self._health_thread = Thread(
+            target=self._health_check_loop,
+            name="bigquery-health-check",
+            daemon=True,
+        )
+        self._health_thread.start()
+
+    def _health_check_loop(self) -> None:
+        while not self._stop.wait(self.health_check_interval):
+            self.run_health_check()
+
+    def run_health_check(self) -> bool:
+        client = self._client
+        self.healthy = client.health_check() if client is not None else False
+        self.last_health_check = time.time()
+        if self.healthy:
+            self.consecutive_failures = 0
+            return True
+        self.consecutive_failures += 1
+        if self.consecutive_failures < self.failure_threshold:
+            self.logger.warning(
+                "Health check do cliente BigQuery falhou (%d de %d)",
+                self.consecutive_failures, self.failure_threshold,
+            )
+            return False
+        self.logger.warning(
+            "Cliente BigQuery compartilhado nao saudavel apos %d falhas, sera recriado",
+            self.consecutive_failures,
+        )
+        self._replace_client(client)
+        return False
+
+    def _replace_client(self, stale: Optional[BigQueryClient]) -> None:
+        replacement = self._client_factory()
+        if replacement is None:
+            self.logger.error("Falha ao recriar o cliente BigQuery; mantendo o atual")
+            return
+        with self._lock:
+            if self._client is not stale:
+                replacement.close()
+                return
+            self._client = replacement
+        self.consecutive_failures = 0
+        self.logger.info("Cliente BigQuery compartilhado recriado: %s", self.project_id)
+
+    def reset(self) -> None:
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.reset()
+        self.logger.info("Pool de clientes BigQuery encerrado")
+
+    def status(self) -> dict:
+        return {
+            "connected": self._client is not None,
+            "healthy": self.healthy,
+            "consecutive_failures": self.consecutive_failures,
+            "last_health_check": self.last_health_check,
+            "health_check_interval": self.health_check_interval,
+        }
+
+
+@st.cache_resource(show_spinner=False)
+def get_client_pool(credentials_path: str, project_id: str) -> BigQueryClientPool:
+    """Pool unico por processo, reaproveitado por todas as sessoes do Streamlit."""
+    return BigQueryClientPool(credentials_path, project_id)
+
+
+def get_shared_client() -> Optional[BigQueryClient]:
+    """Cliente do pool configurado na secao ``[bigquery]`` do secrets.toml.
+
+    A secao informa ``credentials_path`` e ``project_id``; sem ela o app
+    segue sem conexao com o BigQuery.
+    """
+    try:
+        settings = dict(st.secrets.get("bigquery", {}))
+    except Exception:
+        settings = {}
+    credentials_path = settings.get("credentials_path")
+    project_id = settings.get("project_id")
+    if not credentials_path or not project_id:
+        logger.debug("BigQuery nao configurado em secrets.toml")
+        return None
+    return get_client_pool(credentials_path, project_id).get_client()
@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.config import DISK_CACHE_MAX_BYTES
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DISK_FORMATS: tuple[str, ...] = ("arrow", "parquet")
+
+
+class DiskCache:
+    """Segundo nivel do cache: resultados em disco como Arrow IPC ou Parquet.
+
+    Cada entrada tem um arquivo de dados e um arquivo ``.json`` com TTL e
+    tamanho. Os dois sao gravados em arquivo temporario e renomeados com
+    ``os.replace``, de modo que uma queda no meio da escrita nunca deixa
+    uma entrada parcial visivel. A leitura usa memory map.
+    """
+
+    write_through: bool = False
+
+    def __init__(
+        self,
+        directory: str | Path,
+        max_bytes: int = DISK_CACHE_MAX_BYTES,
+        default_ttl: int = 3600,
+        file_format: str = "arrow",
+    ):
+        if file_format not in DISK_FORMATS:
+            raise ValueError(f"Formato de cache em disco invalido: {file_format}")
+        self.directory: Path = Path(directory)
+        self.max_bytes: int = max_bytes
+        self.default_ttl: int = default_ttl
+        self.file_format: str = file_format
+        self._lock: Lock = Lock()
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._cleanup_temp_files()
+
+    def _data_path(self, key: str) -> Path:
+        return self.directory / f"{key}.{self.file_format}"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _cleanup_temp_files(self) -> None:
+        for tmp in self.directory.glob("*.tmp"):
+            tmp.unlink(missing_ok=True)
+
+    def _atomic_write(self, path: Path, write_fn: Any) -> None:
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            write_fn(tmp_name)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def put(
+        self,
+        key: str,
+        value: Any,
+        ttl: Optional[int] = None,
+        tables: Optional[frozenset[str]] = None,
+        created_at: Optional[float] = None,
+    ) -> bool:
+        if isinstance(value, pd.DataFrame):
+            try:
+                table = pa.Table.from_pandas(value)
+            except (pa.ArrowException, TypeError, ValueError) as e:
+                self.logger.warning("Valor nao gravado no cache em disco %s: %s", key[:12], e)
+                return False
+        elif isinstance(value, pa.Table):
+            table = value
+        else:
+            return False
+
+        created_at = created_at or time.time()
+        expires_at = created_at + (ttl or self.default_ttl)
+
+        def write_data(tmp: str) -> None:
+            if self.file_format == "parquet":
+                pq.write_table(table, tmp)
+            else:
+                with pa.OSFile(tmp, "wb") as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+
+        try:
+            with self._lock:
+                self._atomic_write(self._data_path(key), write_data)
+                size = self._data_path(key).stat().st_size
+                meta = {
+                    "created_at": created_at,
+                    "expires_at": expires_at,
+                    "tables": sorted(tables or []),
+                    "size_bytes": size,
+                    "format": self.file_format,
+                    "pandas": isinstance(value, pd.DataFrame),
+                }
+                self._atomic_write(
+                    self._meta_path(key),
+                    lambda tmp: Path(tmp).write_text(json.dumps(meta), encoding="utf-8"),
+                )
+                self._enforce_size_limit()
+            self.logger.debug("Cache em disco gravado: %s (%d bytes)", key[:12], size)
+            return True
+        except Exception as e:
+            self.logger.error("Erro ao gravar cache em disco %s: %s", key[:12], e)
+            return False
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self._meta_path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str) -> Optional[tuple[Any, dict]]:
+        """Retorna ``(valor, metadados)`` ou ``None`` em caso de miss."""
+        meta = self._read_meta(key)
+        data_path = self._data_path(key)
+        if meta is None or not data_path.exists():
+            return None
+
+        remaining = meta["expires_at"] - time.time()
+        if remaining <= 0:
+            self.delete(key)
+            self.logger.debug("Cache em disco expirado: %s", key[:12])
+            return None
+
+        try:
+            if self.file_format == "parquet":
+                table = pq.read_table(data_path, memory_map=True)
+            else:
+                with pa.memory_map(str(data_path), "r") as source:
+                    table = pa.ipc.open_file(source).read_all()
+            os.utime(data_path)
+            value = table.to_pandas() if meta.get("pandas", True) else table
+            self.logger.debug("Cache em disco hit: %s", key[:12])
+            return value, meta
+        except Exception as e:
+            self.logger.error("Erro ao ler cache em disco %s: %s", key[:12], e)
+            self.delete(key)
+            return None
+
+    def delete(self, key: str) -> None:
+        self._meta_path(key).unlink(missing_ok=True)
+        self._data_path(key).unlink(missing_ok=True)
+
+    def delete_by_table(self, table: str, modified_after: Optional[float] = None) -> int:
+        """Remove entradas que leem ``table`` e foram gravadas antes da alteracao."""
+        removed = 0
+        for key, _ in self._entries():
+            meta = self._read_meta(key)
+            if meta is None or table not in meta.get("tables", []):
+                continue
+            if modified_after is not None and meta.get("created_at", 0) >= modified_after:
+                continue
+            self.delete(key)
+            removed += 1
+        return removed
+
+    def tracked_tables(self) -> set[str]:
+        tables: set[str] = set()
+        for key, _ in self._entries():
+            meta = self._read_meta(key)
+            if meta is not None:
+                tables.update(meta.get("tables", []))
+        return tables
+
+    def _entries(self) -> list[tuple[str, os.stat_result]]:
+        return [
+            (path.stem, path.stat())
+            for path in self.directory.glob(f"*.{self.file_format}")
+        ]
+
+    def _enforce_size_limit(self) -> None:
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+        total = sum(stat.st_size for _, stat in entries)
+        for key, stat in entries:
+            if total <= self.max_bytes:
+                break
+            self.delete(key)
+            total -= stat.st_size
+            self.logger.debug("Cache em disco evicted: %s", key[:12])
+
+    def clear(self) -> None:
+        with self._lock:
+            for key, _ in self._entries():
+                self.delete(key)
+            for meta in self.directory.glob("*.json"):
+                meta.unlink(missing_ok=True)
+        self.logger.info("Cache em disco limpo: %s", self.directory)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "directory": str(self.directory),
+            "format": self.file_format,
+            "entries": len(entries),
+            "total_bytes": sum(stat.st_size for _, stat in entries),
+            "max_bytes": self.max_bytes,
+        }
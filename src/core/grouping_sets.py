@@ -0,0 +1,62 @@
+import logging
+from typing import Any, Optional
+
+import pandas as pd
+
+from src.core.cache_manager import CacheManager
+from src.core.query_builder import QueryBuilder
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+GROUPING_PREFIX: str = "grouping__"
+
+
+def rollup_levels(hierarchy: list[str]) -> list[tuple[str, ...]]:
+    """Niveis gerados por ``ROLLUP``: do total geral ate o nivel mais fino."""
+    return [tuple(hierarchy[:i]) for i in range(len(hierarchy) + 1)]
+
+
+def split_grouping_sets(
+    df: pd.DataFrame,
+    levels: list[tuple[str, ...]],
+) -> dict[tuple[str, ...], pd.DataFrame]:
+    """Separa o resultado de ``build_grouping_sets`` em uma tabela por nivel.
+
+    As linhas de cada nivel sao identificadas pelas colunas ``grouping__``;
+    assim um grupo com valor ``NULL`` de verdade nao se confunde com a linha
+    de subtotal. As colunas de dimensoes fora do nivel sao descartadas.
+    """
+    flag_cols = [c for c in df.columns if c.startswith(GROUPING_PREFIX)]
+    dimensions = [c[len(GROUPING_PREFIX):] for c in flag_cols]
+    metrics = [c for c in df.columns if c not in flag_cols and c not in dimensions]
+
+    result: dict[tuple[str, ...], pd.DataFrame] = {}
+    for level in levels:
+        mask = pd.Series(True, index=df.index)
+        for dim in dimensions:
+            mask &= df[f"{GROUPING_PREFIX}{dim}"] == (0 if dim in level else 1)
+        result[level] = df.loc[mask, list(level) + metrics].reset_index(drop=True)
+    return result
+
+
+def file_levels_in_cache(
+    cache: CacheManager,
+    qb: QueryBuilder,
+    table: str,
+    metrics: list[str],
+    levels: dict[tuple[str, ...], pd.DataFrame],
+    where: Optional[str] = None,
+    params: Optional[dict[str, Any]] = None,
+    ttl: Optional[int] = None,
+) -> int:
+    """Grava cada nivel no cache sob a chave da query ``GROUP BY`` equivalente.
+
+    Uma pagina que depois pedir o nivel isolado com ``build_aggregation``
+    (mesmas metricas e filtros) encontra o resultado sem um novo job.
+    """
+    for level, frame in levels.items():
+        query = qb.build_aggregation(table, metrics, list(level), where=where)
+        cache.set(query, frame, params=params, ttl=ttl)
+    logger.info("Niveis de agregacao gravados no cache: %d (%s)", len(levels), table)
+    return len(levels)
@@ -0,0 +1,214 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Callable, Iterator, Optional
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+Owner = tuple[str, int]
+
+_current_rerun: ContextVar[Optional[Owner]] = ContextVar("job_tracker_rerun", default=None)
+
+
+class JobSupersededError(RuntimeError):
+    """Job pedido por um rerun que ja foi substituido por outro mais novo."""
+
+
+def set_current_rerun(session_id: str, generation: int) -> None:
+    """Define a sessao e a geracao de rerun donas dos jobs desta execucao."""
+    _current_rerun.set((session_id, generation))
+
+
+def get_current_rerun() -> Optional[Owner]:
+    return _current_rerun.get()
+
+
+@dataclass
+class TrackedJob:
+    job: Any
+    key: Optional[str] = None
+    cancellable: bool = True
+    owners: set[Owner] = field(default_factory=set)
+
+
+def _job_key(job: Any) -> str:
+    return getattr(job, "job_id", None) or str(id(job))
+
+
+class JobTracker:
+    """Jobs do BigQuery em voo por sessao e geracao de rerun.
+
+    Cada rerun do Streamlit chama ``begin_rerun`` e recebe uma geracao
+    nova; jobs das geracoes anteriores da mesma sessao perdem o dono e sao
+    cancelados com ``job.cancel()``.
+
+    Quem submete o job e dono dele; chamadas agrupadas por single-flight
+    entram como espera pela chave da query (``waiting``), e um job com
+    espera de execucao viva (ou de thread sem rerun) nao e cancelado. Jobs
+    reaproveitados de outra replica via ``job_id`` deterministico nunca
+    sao cancelados, pois este processo nao sabe quem mais espera por eles.
+    Jobs submetidos fora de um rerun (warm-up, revalidacao em segundo plano)
+    nao sao rastreados.
+    """
+
+    def __init__(self):
+        self._jobs: dict[str, TrackedJob] = {}
+        self._waiters: dict[str, list[Optional[Owner]]] = {}
+        self._generations: dict[str, int] = {}
+        self._lock: Lock = Lock()
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def begin_rerun(self, session_id: str) -> int:
+        with self._lock:
+            generation = self._generations.get(session_id, 0) + 1
+            self._generations[session_id] = generation
+            orphaned = self._release(lambda owner: owner[0] == session_id and owner[1] < generation)
+        cancelled = self._cancel(orphaned)
+        if cancelled:
+            self.logger.info(
+                "Rerun %d da sessao %s: %d jobs anteriores cancelados",
+                generation, session_id[:8], cancelled,
+            )
+        return generation
+
+    def _is_live(self, owner: Optional[Owner]) -> bool:
+        if owner is None:
+            return True
+        current = self._generations.get(owner[0])
+        return current is not None and owner[1] >= current
+
+    def is_superseded(self, owner: Optional[Owner]) -> bool:
+        if owner is None:
+            return False
+        with self._lock:
+            return not self._is_live(owner)
+
+    @contextmanager
+    def waiting(self, key: str) -> Iterator[None]:
+        """Marca a execucao corrente como esperando o resultado da query ``key``."""
+        owner = get_current_rerun()
+        with self._lock:
+            self._waiters.setdefault(key, []).append(owner)
+        try:
+            yield
+        finally:
+            with self._lock:
+                waiters = self._waiters[key]
+                waiters.remove(owner)
+                if not waiters:
+                    del self._waiters[key]
+
+    def register(
+        self,
+        job: Any,
+        owner: Optional[Owner] = None,
+        key: Optional[str] = None,
+        cancellable: bool = True,
+    ) -> Optional[Owner]:
+        """Associa o job a execucao corrente; devolve o dono para ``unregister``.
+
+        ``key`` e a chave da query (``query_key``), usada para achar as
+        chamadas agrupadas que esperam o mesmo resultado.
+        """
+        owner = owner or get_current_rerun()
+        if owner is None:
+            return None
+        if self.is_superseded(owner):
+            if cancellable:
+                self._cancel([job])
+            raise JobSupersededError(f"Rerun {owner[1]} da sessao {owner[0][:8]} ja substituido")
+        with self._lock:
+            tracked = self._jobs.setdefault(_job_key(job), TrackedJob(job, key, cancellable))
+            tracked.owners.add(owner)
+        return owner
+
+    def unregister(self, job: Any, owner: Optional[Owner]) -> None:
+        if owner is None:
+            return
+        with self._lock:
+            key = _job_key(job)
+            tracked = self._jobs.get(key)
+            if tracked is None:
+                return
+            tracked.owners.discard(owner)
+            if not tracked.owners:
+                del self._jobs[key]
+
+    def end_session(self, session_id: str) -> int:
+        with self._lock:
+            self._generations.pop(session_id, None)
+            orphaned = self._release(lambda owner: owner[0] == session_id)
+        cancelled = self._cancel(orphaned)
+        if cancelled:
+            self.logger.info("Sessao %s encerrada: %d jobs cancelados", session_id[:8], cancelled)
+        return cancelled
+
+    def sweep(self, is_active: Callable[[str], bool]) -> int:
+        """Encerra as sessoes que ``is_active`` nao reconhece mais."""
+        with self._lock:
+            ended = [sid for sid in self._generations if not is_active(sid)]
+        return sum(self.end_session(sid) for sid in ended)
+
+    def in_flight(self, session_id: Optional[str] = None) -> int:
+        """Jobs em voo; com ``session_id``, os que a sessao submeteu ou espera."""
+        with self._lock:
+            return sum(
+                1 for tracked in self._jobs.values()
+                if session_id is None or any(
+                    o is not None and o[0] == session_id
+                    for o in tracked.owners | set(self._waiters.get(tracked.key, []))
+                )
+            )
+
+    def _release(self, predicate: Callable[[Owner], bool]) -> list[Any]:
+        orphaned: list[Any] = []
+        for job_key, tracked in list(self._jobs.items()):
+            tracked.owners = {o for o in tracked.owners if not predicate(o)}
+            if tracked.owners:
+                continue
+            if tracked.key is not None and any(
+                self._is_live(o) for o in self._waiters.get(tracked.key, [])
+            ):
+                continue
+            del self._jobs[job_key]
+            if tracked.cancellable:
+                orphaned.append(tracked.job)
+        return orphaned
+
+    def _cancel(self, jobs: list[Any]) -> int:
+        cancelled = 0
+        for job in jobs:
+            try:
+                job.cancel()
+                cancelled += 1
+                self.logger.debug("Job cancelado: %s", _job_key(job))
+            except Exception as e:
+                self.logger.warning("Falha ao cancelar job %s: %s", _job_key(job), e)
+        return cancelled
+
+
+job_tracker: JobTracker = JobTracker()
+
+
+def begin_streamlit_rerun(tracker: JobTracker = job_tracker) -> Optional[int]:
+    """Abre uma nova geracao para a sessao Streamlit corrente.
+
+    Chamado no inicio de cada execucao do script. Tambem encerra as sessoes
+    que o runtime ja nao considera ativas, cancelando os jobs delas.
+    """
+    try:
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None
+    generation = tracker.begin_rerun(ctx.session_id)
+    set_current_rerun(ctx.session_id, generation)
+    if Runtime.exists():
+        tracker.sweep(Runtime.instance().is_active_session)
+    return generation
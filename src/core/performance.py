@@ -5,9 +5,16 @@ import time
 from typing import Any, Callable, Optional
 from functools import wraps
 
+from src.core.cache_manager import CacheManager
+from src.core.job_tracker import job_tracker
+from src.core.single_flight import SingleFlight
+from src.core.sql_normalizer import sql_fingerprint
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+query_flight: SingleFlight = SingleFlight()
+
 
 def timed_execution(func: Callable) -> Callable:
     """Decorador para medir tempo de execucao de funcoes."""
@@ -25,20 +32,41 @@ def timed_execution(func: Callable) -> Callable:
     return wrapper
 
 
-@st.cache_data(ttl=3600, show_spinner=False)
-def cached_query(query: str, _client: Any) -> Optional[pd.DataFrame]:
-    """Executa query com cache do Streamlit."""
+def cached_query(
+    query: str,
+    _client: Any,
+    params: Optional[dict[str, Any]] = None,
+) -> Optional[pd.DataFrame]:
+    """Executa query com cache do Streamlit, chaveado pela forma canonica do SQL.
+
+    Falhas nao ficam no cache: a proxima execucao tenta de novo, e o
+    retry/circuit breaker do cliente evita tempestades de tentativas.
+    """
     try:
-        start = time.perf_counter()
-        df = _client.execute_query(query)
-        elapsed = (time.perf_counter() - start) * 1000
-        logger.info("Query cached executada em %.1fms", elapsed)
-        return df
+        return _cached_query_by_fingerprint(sql_fingerprint(query), query, _client, params)
     except Exception as e:
         logger.error("Erro em cached_query: %s", e)
         return None
 
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_query_by_fingerprint(
+    fingerprint: str,
+    _query: str,
+    _client: Any,
+    params: Optional[dict[str, Any]] = None,
+) -> Optional[pd.DataFrame]:
+    start = time.perf_counter()
+    key = CacheManager._generate_key(_query, params)
+    with job_tracker.waiting(key):
+        df = query_flight.do(key, lambda: _client.execute_query(_query, params=params))
+    if df is None:
+        raise RuntimeError("query sem resultado")
+    elapsed = (time.perf_counter() - start) * 1000
+    logger.info("Query cached executada em %.1fms", elapsed)
+    return df
+
+
 @st.cache_data(ttl=7200, show_spinner=False)
 def cached_dataframe_transform(
     df_hash: str,
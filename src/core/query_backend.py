@@ -0,0 +1,122 @@
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional, Protocol, runtime_checkable
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.config import LOCAL_EXTRACT_DIR
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@runtime_checkable
+class QueryBackend(Protocol):
+    """Interface comum dos motores de execucao de queries."""
+
+    def execute_query(
+        self,
+        query: str,
+        timeout: int = 300,
+        params: Optional[dict[str, Any]] = None,
+    ) -> Optional[pd.DataFrame]:
+        ...
+
+    def get_table_metadata(self, table_ref: str) -> dict:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class LocalParquetBackend:
+    """Backend local que executa SQL sobre extracoes Parquet via DuckDB."""
+
+    def __init__(self, extract_dir: str | Path = LOCAL_EXTRACT_DIR):
+        self.extract_dir: Path = Path(extract_dir)
+        self._conn: Optional[Any] = None
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def table_paths(self) -> dict[str, Path]:
+        """Mapeia nome da tabela para o arquivo (ou diretorio particionado) Parquet."""
+        if not self.extract_dir.exists():
+            return {}
+        paths: dict[str, Path] = {}
+        for path in sorted(self.extract_dir.iterdir()):
+            if path.is_file() and path.suffix == ".parquet":
+                paths[path.stem] = path
+            elif path.is_dir() and any(path.rglob("*.parquet")):
+                paths[path.name] = path
+        return paths
+
+    @staticmethod
+    def parquet_source(path: Path) -> str:
+        pattern = path / "**" / "*.parquet" if path.is_dir() else path
+        return f"read_parquet('{pattern.as_posix()}')"
+
+    def connect(self) -> bool:
+        try:
+            import duckdb
+        except ImportError:
+            self.logger.error("duckdb nao instalado. Execute: pip install duckdb")
+            return False
+        try:
+            self._conn = duckdb.connect(database=":memory:")
+            for table, path in self.table_paths().items():
+                self._conn.execute(
+                    f'CREATE VIEW "{table}" AS SELECT * FROM {self.parquet_source(path)}'
+                )
+            self.logger.info(
+                "Backend local inicializado: %s (%d tabelas)",
+                self.extract_dir, len(self.table_paths()),
+            )
+            return True
+        except Exception as e:
+            self.logger.error("Falha ao inicializar backend local: %s", e)
+            self._conn = None
+            return False
+
+    def execute_query(
+        self,
+        query: str,
+        timeout: int = 300,
+        params: Optional[dict[str, Any]] = None,
+    ) -> Optional[pd.DataFrame]:
+        """Executa no DuckDB; ``params`` usa a sintaxe ``$nome`` do DuckDB."""
+        if self._conn is None:
+            self.logger.error("Backend local nao inicializado")
+            return None
+        try:
+            df = self._conn.cursor().execute(query, params or None).df()
+            self.logger.info("Query local executada: %d linhas retornadas", len(df))
+            return df
+        except Exception as e:
+            self.logger.error("Erro ao executar query local: %s", e)
+            return None
+
+    def get_table_metadata(self, table_ref: str) -> dict:
+        table = table_ref.strip("`").split(".")[-1]
+        path = self.table_paths().get(table)
+        if path is None:
+            self.logger.error("Extracao local nao encontrada: %s", table_ref)
+            return {}
+        try:
+            files = sorted(path.rglob("*.parquet")) if path.is_dir() else [path]
+            stats = [f.stat() for f in files]
+            return {
+                "num_rows": sum(pq.ParquetFile(f).metadata.num_rows for f in files),
+                "num_bytes": sum(s.st_size for s in stats),
+                "modified": datetime.fromtimestamp(max(s.st_mtime for s in stats)).isoformat(),
+                "created": datetime.fromtimestamp(min(s.st_ctime for s in stats)).isoformat(),
+            }
+        except Exception as e:
+            self.logger.error("Erro ao ler metadados locais de %s: %s", table_ref, e)
+            return {}
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self.logger.info("Backend local encerrado")
@@ -0,0 +1,104 @@
+import logging
+import time
+from threading import Lock
+from typing import Any, Optional
+
+from src.config import (
+    BYTES_BUDGET_WINDOW_SECONDS,
+    MAX_BYTES_BILLED_PER_QUERY,
+    MAX_BYTES_BILLED_PER_USER,
+)
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+BYTES_BILLED_ATTR: str = "bytes_faturados"
+
+
+def format_bytes(num_bytes: Optional[int]) -> str:
+    if num_bytes is None:
+        return "desconhecido"
+    value = float(num_bytes)
+    if value < 1024:
+        return f"{value:.0f} B"
+    for unit in ("KB", "MB", "GB"):
+        value /= 1024
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+    return f"{value / 1024:.1f} TB"
+
+
+def billed_bytes(result: Any, estimated: Optional[int] = None) -> Optional[int]:
+    """Bytes faturados anotados no resultado pelo cliente, ou a estimativa na falta deles."""
+    attrs = getattr(result, "attrs", None) or {}
+    billed = attrs.get(BYTES_BILLED_ATTR)
+    return estimated if billed is None else billed
+
+
+class QueryBudget:
+    """Limites de bytes processados por query e por usuario.
+
+    O limite por usuario vale para a soma das queries na janela
+    ``window_seconds``; ``maximum_bytes_billed`` devolve o teto a ser
+    repassado ao BigQuery para a proxima query do usuario.
+    """
+
+    def __init__(
+        self,
+        max_bytes_per_query: Optional[int] = MAX_BYTES_BILLED_PER_QUERY,
+        max_bytes_per_user: Optional[int] = MAX_BYTES_BILLED_PER_USER,
+        window_seconds: int = BYTES_BUDGET_WINDOW_SECONDS,
+    ):
+        self.max_bytes_per_query: Optional[int] = max_bytes_per_query
+        self.max_bytes_per_user: Optional[int] = max_bytes_per_user
+        self.window_seconds: int = window_seconds
+        self._usage: dict[str, list[tuple[float, int]]] = {}
+        self._lock: Lock = Lock()
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def used(self, user: str) -> int:
+        cutoff = time.time() - self.window_seconds
+        with self._lock:
+            usage = [(ts, n) for ts, n in self._usage.get(user, []) if ts >= cutoff]
+            self._usage[user] = usage
+            return sum(n for _, n in usage)
+
+    def remaining(self, user: Optional[str]) -> Optional[int]:
+        if user is None or self.max_bytes_per_user is None:
+            return None
+        return max(0, self.max_bytes_per_user - self.used(user))
+
+    def maximum_bytes_billed(self, user: Optional[str] = None) -> Optional[int]:
+        limits = [
+            limit for limit in (self.max_bytes_per_query, self.remaining(user))
+            if limit is not None
+        ]
+        return min(limits) if limits else None
+
+    def check(self, estimated_bytes: Optional[int], user: Optional[str] = None) -> tuple[bool, str]:
+        """Valida a estimativa contra os limites, no formato de ``validate_query``."""
+        if estimated_bytes is None:
+            return False, "Nao foi possivel estimar o custo da query"
+        if self.max_bytes_per_query is not None and estimated_bytes > self.max_bytes_per_query:
+            message = (
+                f"Query processaria {format_bytes(estimated_bytes)}, acima do limite "
+                f"por query de {format_bytes(self.max_bytes_per_query)}"
+            )
+            self.logger.warning("Query recusada (%s): %s", user or "anonimo", message)
+            return False, message
+        remaining = self.remaining(user)
+        if remaining is not None and estimated_bytes > remaining:
+            message = (
+                f"Query processaria {format_bytes(estimated_bytes)}, mas restam "
+                f"{format_bytes(remaining)} na cota do usuario"
+            )
+            self.logger.warning("Query recusada (%s): %s", user, message)
+            return False, message
+        return True, f"Estimativa: {format_bytes(estimated_bytes)} processados"
+
+    def record(self, user: Optional[str], bytes_processed: Optional[int]) -> None:
+        if user is None or not bytes_processed:
+            return
+        with self._lock:
+            self._usage.setdefault(user, []).append((time.time(), int(bytes_processed)))
+        self.logger.debug("Cota de %s: +%s", user, format_bytes(bytes_processed))
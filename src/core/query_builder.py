@@ -1,17 +1,40 @@
+from pathlib import Path
 from typing import Optional
 import logging
 
+from src.core.aggregate_spec import AggregateSpec
+from src.core.approximate import ApproximateMode
+from src.core.query_backend import LocalParquetBackend
+
 
 class QueryBuilder:
     """Construtor de queries SQL para o BigQuery."""
 
-    def __init__(self, dataset: str, project_id: str):
+    def __init__(
+        self,
+        dataset: str,
+        project_id: str,
+        local_tables: Optional[dict[str, Path]] = None,
+    ):
         self.dataset: str = dataset
         self.project_id: str = project_id
+        self.local_tables: dict[str, Path] = local_tables or {}
         self.logger: logging.Logger = logging.getLogger(__name__)
 
+    def table_ref(self, table: str) -> str:
+        """Referencia completa da tabela, no formato usado nas tags do cache."""
+        return f"{self.project_id}.{self.dataset}.{table}"
+
     def _full_table(self, table: str) -> str:
-        return f"`{self.project_id}.{self.dataset}.{table}`"
+        if table in self.local_tables:
+            return LocalParquetBackend.parquet_source(self.local_tables[table])
+        return f"`{self.table_ref(table)}`"
+
+    def _from_clause(self, table: str, approximate: Optional[ApproximateMode] = None) -> str:
+        source = self._full_table(table)
+        if approximate is not None and approximate.is_sampled and table not in self.local_tables:
+            source += f" {approximate.table_sample_clause()}"
+        return source
 
     def build_select(
         self,
@@ -41,21 +64,75 @@ class QueryBuilder:
         group_by: list[str],
         where: Optional[str] = None,
         having: Optional[str] = None,
+        approximate: Optional[ApproximateMode] = None,
     ) -> str:
         select_cols = group_by + metrics
         cols = ", ".join(select_cols)
         groups = ", ".join(group_by)
 
-        query = f"SELECT {cols} FROM {self._full_table(table)}"
+        query = f"SELECT {cols} FROM {self._from_clause(table, approximate)}"
         if where:
             query += f" WHERE {where}"
-        query += f" GROUP BY {groups}"
+        if groups:
+            query += f" GROUP BY {groups}"
         if having:
             query += f" HAVING {having}"
 
         self.logger.debug("Query de agregacao construida: %s", query)
         return query
 
+    def build_grouping_sets(
+        self,
+        table: str,
+        metrics: list[str],
+        grouping_sets: list[list[str]],
+        where: Optional[str] = None,
+        rollup: bool = False,
+        approximate: Optional[ApproximateMode] = None,
+    ) -> str:
+        """Todos os niveis de agregacao em uma unica leitura da tabela.
+
+        Com ``rollup=True``, ``grouping_sets`` deve ter um unico conjunto com
+        a hierarquia (ex.: regiao, sigla_uf, municipio), gerando ``ROLLUP``.
+        Cada dimensao ganha a coluna ``grouping__{dim}`` (1 quando agregada),
+        usada por ``split_grouping_sets`` para separar os niveis.
+        """
+        dimensions = list(dict.fromkeys(dim for gs in grouping_sets for dim in gs))
+        flags = [f"GROUPING({dim}) AS grouping__{dim}" for dim in dimensions]
+        cols = ", ".join(dimensions + metrics + flags)
+
+        query = f"SELECT {cols} FROM {self._from_clause(table, approximate)}"
+        if where:
+            query += f" WHERE {where}"
+        if rollup:
+            query += f" GROUP BY ROLLUP ({', '.join(dimensions)})"
+        else:
+            sets = ", ".join(f"({', '.join(gs)})" for gs in grouping_sets)
+            query += f" GROUP BY GROUPING SETS ({sets})"
+
+        self.logger.debug("Query de grouping sets construida: %s", query)
+        return query
+
+    def build_aggregate_query(
+        self,
+        table: str,
+        spec: AggregateSpec,
+        where: Optional[str] = None,
+        approximate: Optional[ApproximateMode] = None,
+    ) -> str:
+        """Query que devolve apenas a tabela agregada declarada pela pagina.
+
+        Com ``approximate``, o resultado deve passar por
+        ``spec.finalize_approximate`` para anotar o erro estimado.
+        """
+        return self.build_aggregation(
+            table,
+            spec.metric_expressions(approximate),
+            list(spec.group_by),
+            where=where,
+            approximate=approximate,
+        )
+
     def build_date_range_filter(
         self,
         date_column: str,
@@ -83,6 +160,31 @@ class QueryBuilder:
         where = " AND ".join(conditions) if conditions else None
         return self.build_select(table, where=where, order_by="ano DESC")
 
+    def build_kpi_batch_query(
+        self,
+        table: str,
+        metric_columns: list[str],
+        periods: list[int],
+        aggregation: str = "AVG",
+        period_column: str = "ano",
+        where: Optional[str] = None,
+    ) -> str:
+        """Todos os KPIs de todos os periodos em uma unica leitura da tabela.
+
+        Cada par metrica/periodo vira uma agregacao condicional com alias
+        ``{metrica}__{periodo}``; o resultado e uma unica linha.
+        """
+        metrics = [
+            f"{aggregation}(IF({period_column} = {period}, {column}, NULL)) "
+            f"AS {column}__{period}"
+            for column in metric_columns
+            for period in periods
+        ]
+        conditions = [f"{period_column} IN ({', '.join(str(p) for p in periods)})"]
+        if where:
+            conditions.append(where)
+        return self.build_aggregation(table, metrics, [], where=" AND ".join(conditions))
+
     def build_kpi_query(
         self,
         table: str,
@@ -1,7 +1,13 @@
+import json
 import logging
 from datetime import datetime
-from typing import Optional
-from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Any, Optional
+from dataclasses import dataclass, field, asdict
+
+from src.config import QUERY_HISTORY_PATH
+from src.core.sql_normalizer import sql_fingerprint
 
 
 logger: logging.Logger = logging.getLogger(__name__)
@@ -18,6 +24,11 @@ class QueryRecord:
     status: str = "success"
     error_message: Optional[str] = None
     user: Optional[str] = None
+    params: Optional[dict[str, Any]] = None
+    fingerprint: str = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.fingerprint = sql_fingerprint(self.query)
 
     @property
     def is_success(self) -> bool:
@@ -25,21 +36,67 @@ class QueryRecord:
 
 
 class QueryHistory:
-    """Historico de queries executadas no sistema."""
+    """Historico de queries executadas no sistema.
 
-    def __init__(self, max_entries: int = 500):
+    Com ``storage_path``, o historico e carregado na criacao e regravado em
+    JSON a cada ``add``, sobrevivendo a deploys (usado no aquecimento do
+    cache). Os ``params`` de cada query sao gravados junto para que queries
+    parametrizadas possam ser reexecutadas.
+    """
+
+    def __init__(self, max_entries: int = 500, storage_path: Optional[Path] = None):
         self.max_entries: int = max_entries
+        self.storage_path: Optional[Path] = storage_path
         self._history: list[QueryRecord] = []
+        self._lock: Lock = Lock()
         self.logger: logging.Logger = logging.getLogger(__name__)
+        self._load()
+
+    def _load(self) -> None:
+        if self.storage_path is None or not self.storage_path.exists():
+            return
+        try:
+            with open(self.storage_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for entry in data[-self.max_entries:]:
+                entry.pop("fingerprint", None)
+                entry["executed_at"] = datetime.fromisoformat(entry["executed_at"])
+                self._history.append(QueryRecord(**entry))
+            self.logger.info("Historico carregado: %d registros", len(self._history))
+        except Exception as e:
+            self.logger.error("Erro ao carregar historico de queries: %s", e)
+
+    def save(self) -> bool:
+        if self.storage_path is None:
+            return False
+        try:
+            with self._lock:
+                data = [
+                    {**asdict(r), "executed_at": r.executed_at.isoformat()}
+                    for r in self._history
+                ]
+                self.storage_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.storage_path.with_suffix(".tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+                tmp_path.replace(self.storage_path)
+            self.logger.debug("Historico salvo em disco")
+            return True
+        except Exception as e:
+            self.logger.error("Erro ao salvar historico de queries: %s", e)
+            return False
 
     def add(self, record: QueryRecord) -> None:
-        self._history.append(record)
-        if len(self._history) > self.max_entries:
-            self._history = self._history[-self.max_entries:]
+        with self._lock:
+            self._history.append(record)
+            if len(self._history) > self.max_entries:
+                self._history = self._history[-self.max_entries:]
         self.logger.debug(
             "Query registrada: %s (%dms, %d linhas)",
             record.query[:50], record.execution_time_ms, record.rows_returned,
         )
+        if self.storage_path is not None:
+            self.save()
 
     def get_recent(self, count: int = 20) -> list[QueryRecord]:
         return list(reversed(self._history[-count:]))
@@ -50,6 +107,15 @@ class QueryHistory:
     def get_failed(self) -> list[QueryRecord]:
         return [r for r in self._history if not r.is_success]
 
+    def get_by_fingerprint(self, fingerprint: str) -> list[QueryRecord]:
+        return [r for r in self._history if r.fingerprint == fingerprint]
+
+    def group_by_fingerprint(self) -> dict[str, list[QueryRecord]]:
+        groups: dict[str, list[QueryRecord]] = {}
+        for record in self._history:
+            groups.setdefault(record.fingerprint, []).append(record)
+        return groups
+
     def search(self, term: str) -> list[QueryRecord]:
         term_lower = term.lower()
         return [r for r in self._history if term_lower in r.query.lower()]
@@ -82,3 +148,6 @@ class QueryHistory:
     @property
     def size(self) -> int:
         return len(self._history)
+
+
+query_history: QueryHistory = QueryHistory(storage_path=QUERY_HISTORY_PATH)
@@ -0,0 +1,277 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Optional
+
+import pandas as pd
+
+from src.config import (
+    PLANNER_BIGQUERY_BYTES_PER_MS,
+    PLANNER_BIGQUERY_LATENCY_MS,
+    PLANNER_CACHE_COST_MS,
+    PLANNER_CUBE_LATENCY_MS,
+    PLANNER_CUBE_ROWS_PER_MS,
+    PLANNER_LOCAL_BYTES_PER_MS,
+    PLANNER_LOCAL_LATENCY_MS,
+    PLANNER_METADATA_TTL,
+)
+from src.core.aggregate_spec import AggregateSpec
+from src.core.cache_manager import CacheManager
+from src.core.query_backend import LocalParquetBackend, QueryBackend
+from src.core.query_builder import QueryBuilder
+from src.core.rollup_cube import RollupCube
+from src.core.subset_cache import Predicate, predicates_to_params, predicates_to_sql
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SOURCE_CACHE: str = "cache"
+SOURCE_CUBE: str = "cubo"
+SOURCE_LOCAL: str = "local"
+SOURCE_BIGQUERY: str = "bigquery"
+LOCAL_UNSUPPORTED_STATS: frozenset[str] = frozenset({"median"})
+
+
+@dataclass
+class QueryRequest:
+    """Agregacao pedida por uma pagina, independente de onde sera executada.
+
+    ``predicates`` descreve os filtros por coluna; ``where`` e ``params``,
+    quando informados, sao a forma parametrizada equivalente usada no
+    BigQuery. Sem ``predicates``, um ``where`` proprio so pode ser
+    respondido pelo cache ou pelo BigQuery.
+    """
+
+    table: str
+    spec: AggregateSpec
+    predicates: dict[str, Predicate] = field(default_factory=dict)
+    where: Optional[str] = None
+    params: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def filters_known(self) -> bool:
+        return self.where is None or bool(self.predicates)
+
+    def bigquery_filter(self) -> tuple[Optional[str], dict[str, Any]]:
+        """``(where, params)`` enviados ao BigQuery; predicados viram parametros."""
+        if self.where is not None:
+            return self.where, self.params
+        return predicates_to_params(self.predicates)
+
+
+@dataclass
+class PlanCandidate:
+    """Origem capaz de responder o pedido, com custo estimado em ms."""
+
+    source: str
+    cost_ms: float
+    reason: str
+    query: Optional[str] = None
+
+
+@dataclass
+class QueryPlan:
+    request: QueryRequest
+    cache_query: str
+    params: Optional[dict[str, Any]]
+    candidates: list[PlanCandidate] = field(default_factory=list)
+    rejected: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def chosen(self) -> Optional[PlanCandidate]:
+        return self.candidates[0] if self.candidates else None
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class QueryPlanner:
+    """Escolhe a origem mais barata para cada agregacao pedida pelas paginas.
+
+    As origens sao, em ordem tipica de custo: cache em memoria, cubo
+    pre-agregado, extracao Parquet local (DuckDB) e BigQuery. O custo vem
+    dos metadados das tabelas (linhas e bytes) e da cobertura de cada
+    origem; cubo e extracao mais antigos que a ultima alteracao da tabela
+    no BigQuery sao descartados. Toda decisao e registrada no log com o
+    motivo, e ``execute`` tenta a proxima origem se a escolhida falhar.
+    """
+
+    def __init__(
+        self,
+        qb: QueryBuilder,
+        client: Optional[QueryBackend] = None,
+        cache: Optional[CacheManager] = None,
+        local: Optional[LocalParquetBackend] = None,
+        cubes: Optional[dict[str, RollupCube]] = None,
+        metadata_ttl: int = PLANNER_METADATA_TTL,
+    ):
+        self.qb: QueryBuilder = qb
+        self.client: Optional[QueryBackend] = client
+        self.cache: Optional[CacheManager] = cache
+        self.local: Optional[LocalParquetBackend] = local
+        self.cubes: dict[str, RollupCube] = cubes or {}
+        self.metadata_ttl: int = metadata_ttl
+        self._metadata: dict[tuple[str, str], tuple[float, dict]] = {}
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def _table_metadata(self, source: str, backend: Any, table: str) -> dict:
+        key = (source, table)
+        cached = self._metadata.get(key)
+        if cached is not None and time.time() - cached[0] < self.metadata_ttl:
+            return cached[1]
+        metadata = backend.get_table_metadata(self.qb.table_ref(table)) or {}
+        self._metadata[key] = (time.time(), metadata)
+        return metadata
+
+    def plan(self, request: QueryRequest) -> QueryPlan:
+        where, params = request.bigquery_filter()
+        plan = QueryPlan(
+            request=request,
+            cache_query=self.qb.build_aggregate_query(request.table, request.spec, where=where),
+            params=params or None,
+        )
+        remote = (
+            self._table_metadata(SOURCE_BIGQUERY, self.client, request.table)
+            if self.client is not None else {}
+        )
+        modified = _timestamp(remote.get("modified"))
+
+        for source, check in (
+            (SOURCE_CACHE, self._cache_candidate),
+            (SOURCE_CUBE, self._cube_candidate),
+            (SOURCE_LOCAL, self._local_candidate),
+            (SOURCE_BIGQUERY, self._bigquery_candidate),
+        ):
+            candidate, reason = check(request, plan, remote, modified)
+            if candidate is not None:
+                plan.candidates.append(candidate)
+            else:
+                plan.rejected[source] = reason
+        plan.candidates.sort(key=lambda c: c.cost_ms)
+
+        chosen = plan.chosen
+        if chosen is None:
+            self.logger.error(
+                "Nenhuma origem pode responder %s: %s", request.table, plan.rejected
+            )
+        else:
+            self.logger.info(
+                "Plano para %s %s: %s (%.1fms estimados) - %s; descartadas: %s",
+                request.table, request.spec.group_by or "total",
+                chosen.source, chosen.cost_ms, chosen.reason, plan.rejected,
+            )
+        return plan
+
+    def _cache_candidate(
+        self, request: QueryRequest, plan: QueryPlan, remote: dict, modified: Optional[float]
+    ) -> tuple[Optional[PlanCandidate], str]:
+        if self.cache is None:
+            return None, "cache nao configurado"
+        if not self.cache.contains(plan.cache_query, plan.params):
+            return None, "resultado fora do cache"
+        return PlanCandidate(SOURCE_CACHE, PLANNER_CACHE_COST_MS, "resultado ja esta no cache"), ""
+
+    def _cube_candidate(
+        self, request: QueryRequest, plan: QueryPlan, remote: dict, modified: Optional[float]
+    ) -> tuple[Optional[PlanCandidate], str]:
+        cube = self.cubes.get(request.table)
+        if cube is None:
+            return None, "sem cubo para a tabela"
+        if not request.filters_known:
+            return None, "filtro sem predicados por coluna"
+        if not cube.can_answer(request.spec, request.predicates):
+            return None, "cubo nao cobre dimensoes, filtros ou medidas"
+        if modified is not None and cube.built_at is not None and cube.built_at < modified:
+            return None, "cubo anterior a ultima alteracao da tabela"
+        cost = PLANNER_CUBE_LATENCY_MS + cube.size / PLANNER_CUBE_ROWS_PER_MS
+        return PlanCandidate(SOURCE_CUBE, cost, f"cubo com {cube.size} celulas cobre o recorte"), ""
+
+    def _local_candidate(
+        self, request: QueryRequest, plan: QueryPlan, remote: dict, modified: Optional[float]
+    ) -> tuple[Optional[PlanCandidate], str]:
+        if self.local is None:
+            return None, "backend local nao configurado"
+        paths = self.local.table_paths()
+        if request.table not in paths:
+            return None, "tabela sem extracao local"
+        if not request.filters_known:
+            return None, "filtro sem predicados por coluna"
+        unsupported = {m.stat for m in request.spec.measures} & LOCAL_UNSUPPORTED_STATS
+        if unsupported:
+            return None, f"medidas sem equivalente no DuckDB: {sorted(unsupported)}"
+        metadata = self._table_metadata(SOURCE_LOCAL, self.local, request.table)
+        extracted = _timestamp(metadata.get("modified"))
+        if modified is not None and extracted is not None and extracted < modified:
+            return None, "extracao anterior a ultima alteracao da tabela"
+
+        num_bytes = metadata.get("num_bytes") or 0
+        local_qb = QueryBuilder(self.qb.dataset, self.qb.project_id, local_tables=paths)
+        query = local_qb.build_aggregate_query(
+            request.table, request.spec, where=predicates_to_sql(request.predicates)
+        )
+        cost = PLANNER_LOCAL_LATENCY_MS + num_bytes / PLANNER_LOCAL_BYTES_PER_MS
+        return PlanCandidate(
+            SOURCE_LOCAL, cost,
+            f"extracao local com {metadata.get('num_rows', '?')} linhas / {num_bytes} bytes",
+            query,
+        ), ""
+
+    def _bigquery_candidate(
+        self, request: QueryRequest, plan: QueryPlan, remote: dict, modified: Optional[float]
+    ) -> tuple[Optional[PlanCandidate], str]:
+        if self.client is None:
+            return None, "cliente BigQuery nao configurado"
+        num_bytes = remote.get("num_bytes")
+        if num_bytes is None:
+            reason = "sem metadados da tabela; custo minimo estimado"
+            num_bytes = 0
+        else:
+            reason = f"varredura de ate {num_bytes} bytes ({remote.get('num_rows', '?')} linhas)"
+        cost = PLANNER_BIGQUERY_LATENCY_MS + num_bytes / PLANNER_BIGQUERY_BYTES_PER_MS
+        return PlanCandidate(SOURCE_BIGQUERY, cost, reason, plan.cache_query), ""
+
+    def execute(self, request: QueryRequest) -> Optional[pd.DataFrame]:
+        """Executa o pedido na origem mais barata, caindo para a seguinte em caso de falha."""
+        plan = self.plan(request)
+        for candidate in plan.candidates:
+            start = time.perf_counter()
+            result = self._run(plan, candidate)
+            if result is not None:
+                self.logger.info(
+                    "Pedido %s respondido por %s em %.1fms",
+                    request.table, candidate.source, (time.perf_counter() - start) * 1000,
+                )
+                return result
+            self.logger.warning(
+                "Origem %s falhou para %s; tentando a proxima", candidate.source, request.table
+            )
+        return None
+
+    def _run(self, plan: QueryPlan, candidate: PlanCandidate) -> Optional[pd.DataFrame]:
+        request = plan.request
+        try:
+            if candidate.source == SOURCE_CACHE:
+                return self.cache.get(plan.cache_query, plan.params)
+            if candidate.source == SOURCE_CUBE:
+                return self.cubes[request.table].answer(request.spec, request.predicates)
+
+            if candidate.source == SOURCE_LOCAL:
+                def loader() -> Optional[pd.DataFrame]:
+                    return self.local.execute_query(candidate.query)
+            else:
+                def loader() -> Optional[pd.DataFrame]:
+                    return self.client.execute_query(candidate.query, params=plan.params)
+
+            if self.cache is None:
+                return loader()
+            return self.cache.get_or_compute(plan.cache_query, loader, params=plan.params)
+        except Exception as e:
+            self.logger.error("Erro ao executar pedido em %s: %s", candidate.source, e)
+            return None
@@ -0,0 +1,215 @@
+import logging
+import random
+import time
+from threading import Lock
+from typing import Any, Callable, Optional, TypeVar
+
+from google.api_core import exceptions
+
+from src.config import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_SECONDS,
+    JOB_DEDUP_WINDOW_SECONDS,
+    RETRY_INITIAL_DELAY_SECONDS,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY_SECONDS,
+)
+from src.core.sql_normalizer import query_key
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_REASONS: frozenset[str] = frozenset({
+    "rateLimitExceeded", "jobRateLimitExceeded", "backendError", "internalError",
+})
+_RETRYABLE_ERRORS: tuple[type[Exception], ...] = (
+    exceptions.TooManyRequests,
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Chamada recusada porque o circuito esta aberto."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Erros transitorios: limite de taxa, 5xx e falhas de rede.
+
+    O BigQuery devolve ``rateLimitExceeded`` como 403, entao o motivo em
+    ``errors`` tambem e considerado.
+    """
+    if isinstance(error, _RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, exceptions.GoogleAPICallError):
+        reasons = {e.get("reason") for e in (error.errors or []) if isinstance(e, dict)}
+        return bool(reasons & RETRYABLE_REASONS)
+    return False
+
+
+def deterministic_job_id(
+    query: str,
+    params: Optional[dict[str, Any]] = None,
+    window_seconds: int = JOB_DEDUP_WINDOW_SECONDS,
+    now: Optional[float] = None,
+    prefix: str = "painel",
+) -> str:
+    """``job_id`` igual para a mesma query e parametros dentro da janela.
+
+    Tentativas repetidas (e replicas disparando a mesma query) colidem no
+    mesmo job em vez de cobrar a varredura de novo.
+    """
+    digest = query_key(query, params)[:32]
+    bucket = int((now if now is not None else time.time()) // window_seconds)
+    return f"{prefix}_{digest}_{bucket}"
+
+
+class CircuitBreaker:
+    """Disjuntor para falhas sustentadas do BigQuery.
+
+    Apos ``failure_threshold`` falhas transitorias seguidas o circuito abre
+    e as chamadas falham na hora; passados ``reset_timeout`` segundos uma
+    unica chamada de teste e liberada (meio-aberto) e o resultado dela
+    fecha ou reabre o circuito.
+    """
+
+    CLOSED: str = "closed"
+    OPEN: str = "open"
+    HALF_OPEN: str = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self._clock: Callable[[], float] = clock
+        self._state: str = self.CLOSED
+        self._failures: int = 0
+        self._opened_at: float = 0.0
+        self._trial_in_flight: bool = False
+        self._lock: Lock = Lock()
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                self.logger.info("Circuito do BigQuery fechado")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Libera a chamada de teste sem registrar resultado (ex.: erro local)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.logger.warning(
+                        "Circuito do BigQuery aberto apos %d falhas; novas tentativas em %.0fs",
+                        self._failures, self.reset_timeout,
+                    )
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+
+class RetryPolicy:
+    """Novas tentativas com backoff exponencial e jitter completo.
+
+    A espera antes da tentativa ``n`` e sorteada entre zero e
+    ``min(max_delay, initial_delay * multiplier ** n)``, o que espalha as
+    tentativas de varios clientes. So erros de ``is_retryable`` sao
+    repetidos; os demais sobem na hora.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        initial_delay: float = RETRY_INITIAL_DELAY_SECONDS,
+        max_delay: float = RETRY_MAX_DELAY_SECONDS,
+        multiplier: float = 2.0,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.max_attempts: int = max(1, max_attempts)
+        self.initial_delay: float = initial_delay
+        self.max_delay: float = max_delay
+        self.multiplier: float = multiplier
+        self._sleep: Callable[[float], None] = sleep
+        self._rng: Callable[[], float] = rng
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def delay(self, attempt: int) -> float:
+        cap = min(self.max_delay, self.initial_delay * self.multiplier ** attempt)
+        return cap * self._rng()
+
+    def call(
+        self,
+        func: Callable[[], T],
+        breaker: Optional[CircuitBreaker] = None,
+        description: str = "query",
+    ) -> T:
+        for attempt in range(self.max_attempts):
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(f"Circuito aberto; {description} nao executada")
+            try:
+                result = func()
+            except Exception as e:
+                if not is_retryable(e):
+                    # Erro definitivo da API (ex.: SQL invalido) prova que o
+                    # BigQuery respondeu: conta como teste bem-sucedido.
+                    if breaker is not None and isinstance(e, exceptions.GoogleAPICallError):
+                        breaker.record_success()
+                    raise
+                if breaker is not None:
+                    breaker.record_failure()
+                if attempt == self.max_attempts - 1:
+                    raise
+                wait = self.delay(attempt)
+                self.logger.warning(
+                    "Erro transitorio em %s (tentativa %d de %d), nova tentativa em %.1fs: %s",
+                    description, attempt + 1, self.max_attempts, wait, e,
+                )
+                self._sleep(wait)
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+            finally:
+                if breaker is not None:
+                    breaker.release_trial()
+        raise RuntimeError("RetryPolicy sem tentativas")
@@ -0,0 +1,195 @@
+import logging
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.config import CUBE_DIMENSIONS, CUBE_MEASURES, CUBE_PATH
+from src.core.aggregate_spec import AggregateSpec
+from src.core.query_builder import QueryBuilder
+from src.core.subset_cache import Predicate
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+CUBE_STATS: frozenset[str] = frozenset({"sum", "count", "mean", "std", "min", "max"})
+_PARTIALS: dict[str, tuple[str, str]] = {
+    "sum": ("SUM({col})", "sum"),
+    "count": ("COUNT({col})", "sum"),
+    "sumsq": ("SUM({col} * {col})", "sum"),
+    "min": ("MIN({col})", "min"),
+    "max": ("MAX({col})", "max"),
+}
+
+
+class RollupCube:
+    """Cubo pre-agregado no grao mais fino das dimensoes do painel.
+
+    Para cada combinacao de ``dimensions`` guarda medidas aditivas (soma,
+    contagem, soma dos quadrados, minimo e maximo) de cada coluna em
+    ``measures``. Qualquer recorte mais grosso e recalculado em memoria:
+    media = soma / contagem e desvio padrao amostral a partir da soma dos
+    quadrados. Medidas nao aditivas (mediana) nao sao respondidas pelo cubo.
+    """
+
+    def __init__(
+        self,
+        dimensions: Optional[list[str]] = None,
+        measures: Optional[list[str]] = None,
+    ):
+        self.dimensions: list[str] = list(dimensions or CUBE_DIMENSIONS)
+        self.measures: list[str] = list(measures or CUBE_MEASURES)
+        self.built_at: Optional[float] = None
+        self._data: Optional[pd.DataFrame] = None
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _partial_name(column: str, partial: str) -> str:
+        return f"{column}__{partial}"
+
+    def build_query(self, qb: QueryBuilder, table: str, where: Optional[str] = None) -> str:
+        """Query que materializa o cubo no BigQuery em uma unica leitura."""
+        metrics = [
+            f"{expr.format(col=column)} AS {self._partial_name(column, partial)}"
+            for column in self.measures
+            for partial, (expr, _) in _PARTIALS.items()
+        ]
+        return qb.build_aggregation(table, metrics, list(self.dimensions), where=where)
+
+    def load(self, aggregates: pd.DataFrame) -> None:
+        """Carrega o resultado de ``build_query`` como conteudo do cubo."""
+        data = aggregates.copy()
+        for dim in self.dimensions:
+            if data[dim].dtype == object or pd.api.types.is_string_dtype(data[dim]):
+                data[dim] = data[dim].astype("category")
+        self._data = data
+        self.built_at = time.time()
+        self.logger.info(
+            "Cubo carregado: %d celulas, %d dimensoes, %d medidas",
+            len(data), len(self.dimensions), len(self.measures),
+        )
+
+    def load_rows(self, df: pd.DataFrame) -> None:
+        """Monta o cubo a partir de dados no nivel de linha ja em memoria."""
+        grouped = df.groupby(self.dimensions, dropna=False, observed=True)
+        parts = {}
+        for column in self.measures:
+            values = df[column]
+            parts[self._partial_name(column, "sum")] = grouped[column].sum()
+            parts[self._partial_name(column, "count")] = grouped[column].count()
+            parts[self._partial_name(column, "sumsq")] = (values * values).groupby(
+                [df[d] for d in self.dimensions], dropna=False, observed=True
+            ).sum()
+            parts[self._partial_name(column, "min")] = grouped[column].min()
+            parts[self._partial_name(column, "max")] = grouped[column].max()
+        self.load(pd.DataFrame(parts).reset_index())
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._data is not None
+
+    @property
+    def size(self) -> int:
+        return 0 if self._data is None else len(self._data)
+
+    def save(self, path: Path = CUBE_PATH) -> bool:
+        if self._data is None:
+            return False
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pandas(self._data, preserve_index=False)
+            metadata = {**(table.schema.metadata or {}), b"built_at": str(self.built_at).encode()}
+            pq.write_table(table.replace_schema_metadata(metadata), path)
+            self.logger.info("Cubo salvo em %s", path)
+            return True
+        except Exception as e:
+            self.logger.error("Erro ao salvar cubo: %s", e)
+            return False
+
+    def load_file(self, path: Path = CUBE_PATH) -> bool:
+        if not path.exists():
+            return False
+        try:
+            table = pq.read_table(path)
+            self.load(table.to_pandas())
+            built_at = (table.schema.metadata or {}).get(b"built_at")
+            if built_at:
+                self.built_at = float(built_at.decode())
+            return True
+        except Exception as e:
+            self.logger.error("Erro ao carregar cubo de %s: %s", path, e)
+            return False
+
+    def can_answer(
+        self,
+        spec: AggregateSpec,
+        predicates: Optional[dict[str, Predicate]] = None,
+    ) -> bool:
+        if self._data is None:
+            return False
+        if not set(spec.group_by) <= set(self.dimensions):
+            return False
+        if not set(predicates or {}) <= set(self.dimensions):
+            return False
+        return all(m.stat in CUBE_STATS and m.column in self.measures for m in spec.measures)
+
+    def answer(
+        self,
+        spec: AggregateSpec,
+        predicates: Optional[dict[str, Predicate]] = None,
+    ) -> Optional[pd.DataFrame]:
+        """Resultado de ``spec`` recalculado a partir do cubo, ou ``None``."""
+        if not self.can_answer(spec, predicates):
+            return None
+
+        start = time.perf_counter()
+        data = self._data
+        for column, predicate in (predicates or {}).items():
+            data = data[predicate.mask(data[column]).to_numpy()]
+
+        partial_aggs = {
+            self._partial_name(m.column, partial): how
+            for m in spec.measures
+            for partial, (_, how) in _PARTIALS.items()
+        }
+        if spec.group_by:
+            rolled = (
+                data.groupby(spec.group_by, dropna=False, observed=True)
+                .agg(partial_aggs)
+                .reset_index()
+            )
+        else:
+            rolled = data[list(partial_aggs)].agg(partial_aggs).to_frame().T
+
+        result = rolled[list(spec.group_by)].copy()
+        for dim in spec.group_by:
+            if isinstance(result[dim].dtype, pd.CategoricalDtype):
+                result[dim] = result[dim].astype(result[dim].cat.categories.dtype)
+        for measure in spec.measures:
+            result[measure.name] = self._finalize(rolled, measure.column, measure.stat)
+
+        self.logger.debug(
+            "Cubo respondeu %s em %.1fms",
+            spec.group_by or "total", (time.perf_counter() - start) * 1000,
+        )
+        return result.reset_index(drop=True)
+
+    def _finalize(self, rolled: pd.DataFrame, column: str, stat: str) -> pd.Series:
+        total = rolled[self._partial_name(column, "sum")].astype(float)
+        count = rolled[self._partial_name(column, "count")].astype(float)
+        if stat == "sum":
+            return total
+        if stat == "count":
+            return count.astype(int)
+        if stat in ("min", "max"):
+            return rolled[self._partial_name(column, stat)]
+        mean = total / count.where(count > 0)
+        if stat == "mean":
+            return mean
+        sumsq = rolled[self._partial_name(column, "sumsq")].astype(float)
+        variance = (sumsq - total * mean) / (count - 1).where(count > 1)
+        return np.sqrt(variance.clip(lower=0))
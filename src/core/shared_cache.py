@@ -0,0 +1,299 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from src.config import SHARED_CACHE_MAX_BYTES
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+_SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    tables TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def _serialize(value: Any) -> Optional[tuple[str, bytes]]:
+    if isinstance(value, (pd.DataFrame, pa.Table)):
+        try:
+            table = pa.Table.from_pandas(value) if isinstance(value, pd.DataFrame) else value
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            logger.warning("Valor nao serializavel para o cache compartilhado: %s", e)
+            return None
+        kind = "pandas" if isinstance(value, pd.DataFrame) else "arrow"
+        return kind, sink.getvalue().to_pybytes()
+    try:
+        return "json", json.dumps(value).encode("utf-8")
+    except (TypeError, ValueError):
+        return None
+
+
+def _deserialize(kind: str, blob: bytes) -> Any:
+    if kind == "json":
+        return json.loads(blob.decode("utf-8"))
+    table = pa.ipc.open_stream(pa.py_buffer(blob)).read_all()
+    return table.to_pandas() if kind == "pandas" else table
+
+
+class SharedCache:
+    """Cache compartilhado entre processos/replicas via SQLite em modo WAL.
+
+    Tabelas e DataFrames sao gravados como blobs Arrow IPC. Serve como
+    segundo nivel do ``CacheManager`` com escrita imediata (``write_through``):
+    todo valor calculado em uma replica fica visivel para as demais. A
+    tabela ``leases`` implementa o single-flight entre processos: so o dono
+    do lease executa a query, os outros aguardam o resultado no banco.
+    Enquanto a query roda, o dono renova o lease a cada terco de
+    ``lease_seconds``; se a replica cair, o lease expira e outra assume.
+    """
+
+    write_through: bool = True
+
+    def __init__(
+        self,
+        db_path: str | Path,
+        max_bytes: int = SHARED_CACHE_MAX_BYTES,
+        default_ttl: int = 3600,
+        lease_seconds: float = 120.0,
+        poll_interval: float = 0.2,
+    ):
+        self.db_path: Path = Path(db_path)
+        self.max_bytes: int = max_bytes
+        self.default_ttl: int = default_ttl
+        self.lease_seconds: float = lease_seconds
+        self.poll_interval: float = poll_interval
+        self.owner_id: str = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local: threading.local = threading.local()
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(
+        self,
+        key: str,
+        value: Any,
+        ttl: Optional[int] = None,
+        tables: Optional[frozenset[str]] = None,
+        created_at: Optional[float] = None,
+    ) -> bool:
+        serialized = _serialize(value)
+        if serialized is None:
+            return False
+        kind, blob = serialized
+        created_at = created_at or time.time()
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries "
+                    "(key, kind, value, created_at, expires_at, accessed_at, size_bytes, tables) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key, kind, blob, created_at,
+                        created_at + (ttl or self.default_ttl), time.time(),
+                        len(blob), json.dumps(sorted(tables or [])),
+                    ),
+                )
+                self._enforce_size_limit(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.logger.debug("Cache compartilhado gravado: %s (%d bytes)", key[:12], len(blob))
+            return True
+        except Exception as e:
+            self.logger.error("Erro ao gravar cache compartilhado %s: %s", key[:12], e)
+            return False
+
+    def _enforce_size_limit(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT key, size_bytes FROM entries ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def get(self, key: str) -> Optional[tuple[Any, dict]]:
+        """Retorna ``(valor, metadados)`` ou ``None`` em caso de miss."""
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT kind, value, created_at, expires_at, tables FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            kind, blob, created_at, expires_at, tables = row
+            now = time.time()
+            if expires_at <= now:
+                conn.execute("DELETE FROM entries WHERE key = ? AND expires_at <= ?", (key, now))
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            meta = {
+                "created_at": created_at,
+                "expires_at": expires_at,
+                "tables": json.loads(tables),
+            }
+            return _deserialize(kind, blob), meta
+        except Exception as e:
+            self.logger.error("Erro ao ler cache compartilhado %s: %s", key[:12], e)
+            return None
+
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_by_table(self, table: str, modified_after: Optional[float] = None) -> int:
+        conn = self._connection()
+        rows = conn.execute("SELECT key, created_at, tables FROM entries").fetchall()
+        keys = [
+            key for key, created_at, tables in rows
+            if table in json.loads(tables)
+            and (modified_after is None or created_at < modified_after)
+        ]
+        conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in keys])
+        return len(keys)
+
+    def tracked_tables(self) -> set[str]:
+        tables: set[str] = set()
+        for (raw,) in self._connection().execute("SELECT tables FROM entries"):
+            tables.update(json.loads(raw))
+        return tables
+
+    def acquire_lease(self, key: str) -> bool:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+            conn.execute(
+                "INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self.owner_id, now + self.lease_seconds),
+            )
+            owner = conn.execute("SELECT owner FROM leases WHERE key = ?", (key,)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return owner is not None and owner[0] == self.owner_id
+
+    def renew_lease(self, key: str) -> bool:
+        cursor = self._connection().execute(
+            "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?",
+            (time.time() + self.lease_seconds, key, self.owner_id),
+        )
+        return cursor.rowcount > 0
+
+    def _keep_lease(self, key: str, done: threading.Event) -> None:
+        try:
+            while not done.wait(self.lease_seconds / 3):
+                if not self.renew_lease(key):
+                    self.logger.warning("Lease perdido durante a execucao: %s", key[:12])
+                    return
+        except sqlite3.Error as e:
+            self.logger.warning("Falha ao renovar lease %s: %s", key[:12], e)
+        finally:
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+
+    def release_lease(self, key: str) -> None:
+        self._connection().execute(
+            "DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner_id)
+        )
+
+    def single_flight(self, key: str, compute: Callable[[], Any]) -> Optional[Any]:
+        """Executa ``compute`` em apenas uma replica por vez para a mesma chave.
+
+        As demais aguardam o valor aparecer no banco; se o lease expirar sem
+        resultado (replica caiu, query falhou), uma delas assume a execucao.
+        O lease e renovado em segundo plano enquanto ``compute`` roda, entao
+        queries mais longas que ``lease_seconds`` nao sao duplicadas.
+        """
+        while True:
+            if self.acquire_lease(key):
+                done = threading.Event()
+                heartbeat = threading.Thread(
+                    target=self._keep_lease, args=(key, done),
+                    name="shared-cache-lease", daemon=True,
+                )
+                heartbeat.start()
+                try:
+                    return compute()
+                finally:
+                    done.set()
+                    heartbeat.join()
+                    self.release_lease(key)
+            self.logger.debug("Aguardando query em outra replica: %s", key[:12])
+            while True:
+                hit = self.get(key)
+                if hit is not None:
+                    return hit[0]
+                lease = self._connection().execute(
+                    "SELECT expires_at FROM leases WHERE key = ?", (key,)
+                ).fetchone()
+                if lease is None or lease[0] <= time.time():
+                    break
+                time.sleep(self.poll_interval)
+
+    def clear(self) -> None:
+        conn = self._connection()
+        conn.execute("DELETE FROM entries")
+        conn.execute("DELETE FROM leases")
+        self.logger.info("Cache compartilhado limpo: %s", self.db_path)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._connection().execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM entries"
+        ).fetchone()[0]
+
+    def stats(self) -> dict:
+        count, total = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM entries"
+        ).fetchone()
+        return {
+            "path": str(self.db_path),
+            "entries": count,
+            "total_bytes": total,
+            "max_bytes": self.max_bytes,
+        }
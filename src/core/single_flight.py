@@ -0,0 +1,65 @@
+import logging
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Callable
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Agrupa chamadas concorrentes com a mesma chave em uma unica execucao.
+
+    A primeira chamada para uma chave executa a funcao; as chamadas que chegam
+    enquanto ela esta em andamento aguardam o mesmo ``Future`` e recebem o
+    mesmo resultado (ou a mesma excecao).
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, Future] = {}
+        self._lock: Lock = Lock()
+        self._calls: int = 0
+        self._executions: int = 0
+        self._coalesced: int = 0
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._calls += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self._executions += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            self.logger.debug("Chamada agrupada em execucao em andamento: %s", key[:12])
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "executions": self._executions,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._inflight),
+            }
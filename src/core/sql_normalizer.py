@@ -0,0 +1,147 @@
+import hashlib
+import re
+from functools import lru_cache
+from typing import Optional
+
+
+SQL_KEYWORDS: frozenset[str] = frozenset({
+    "ALL", "AND", "ANY", "ARRAY", "AS", "ASC", "BETWEEN", "BY", "CASE", "CAST",
+    "CROSS", "CURRENT", "DATE", "DESC", "DISTINCT", "ELSE", "END", "EXCEPT",
+    "EXISTS", "FALSE", "FOLLOWING", "FOR", "FROM", "FULL", "GROUP", "GROUPING",
+    "HAVING", "IF", "IN", "INNER", "INTERSECT", "INTERVAL", "IS", "JOIN", "LEFT",
+    "LIKE", "LIMIT", "NOT", "NULL", "NULLS", "OFFSET", "ON", "OR", "ORDER",
+    "OUTER", "OVER", "PARTITION", "PRECEDING", "QUALIFY", "RANGE", "RIGHT",
+    "ROLLUP", "ROWS", "SAFE_CAST", "SELECT", "SETS", "STRUCT", "TABLESAMPLE",
+    "THEN", "TIMESTAMP", "TRUE", "UNBOUNDED", "UNION", "UNNEST", "USING", "WHEN",
+    "WHERE", "WINDOW", "WITH",
+    "AVG", "COUNT", "MAX", "MIN", "SUM", "STDDEV", "APPROX_QUANTILES",
+    "APPROX_COUNT_DISTINCT", "COUNTIF", "ROUND", "COALESCE", "IFNULL",
+})
+
+_TOKEN_RE: re.Pattern = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<quoted>`[^`]*`)
+    | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    | (?P<param>@\w+)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<space>\s+)
+    | (?P<op><>|!=|<=|>=|\|\||\S)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_LITERAL_KINDS: frozenset[str] = frozenset({"string", "number"})
+
+
+def tokenize_sql(query: str) -> list[tuple[str, str]]:
+    """Quebra a query em tokens ``(tipo, texto)``, sem espacos e comentarios."""
+    tokens: list[tuple[str, str]] = []
+    for match in _TOKEN_RE.finditer(query):
+        kind = match.lastgroup
+        if kind in ("space", "comment"):
+            continue
+        text = match.group()
+        if kind == "word" and text.upper() in SQL_KEYWORDS:
+            text = text.upper()
+        tokens.append((kind, text))
+    return tokens
+
+
+def _sort_in_lists(tokens: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    result: list[tuple[str, str]] = []
+    i = 0
+    while i < len(tokens):
+        result.append(tokens[i])
+        if tokens[i][1] == "IN" and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+            end = i + 2
+            items: list[tuple[str, str]] = []
+            expect_item = True
+            while end < len(tokens) and tokens[end][1] != ")":
+                kind, text = tokens[end]
+                if expect_item and kind in _LITERAL_KINDS:
+                    items.append(tokens[end])
+                elif not expect_item and text == ",":
+                    pass
+                else:
+                    items = []
+                    break
+                expect_item = not expect_item
+                end += 1
+            if items and end < len(tokens) and not expect_item:
+                unique = sorted(set(items), key=lambda t: t[1])
+                result.append(tokens[i + 1])
+                for idx, item in enumerate(unique):
+                    if idx:
+                        result.append(("op", ","))
+                    result.append(item)
+                result.append(tokens[end])
+                i = end + 1
+                continue
+        i += 1
+    return result
+
+
+@lru_cache(maxsize=1024)
+def canonicalize_sql(query: str) -> str:
+    """Forma canonica da query para comparacao e chave de cache.
+
+    Remove comentarios, normaliza espacos e a caixa das palavras-chave,
+    ordena listas ``IN`` de literais e descarta o ``;`` final. Literais de
+    texto e identificadores mantem a caixa original.
+    """
+    tokens = _sort_in_lists(tokenize_sql(query))
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    return " ".join(text for _, text in tokens)
+
+
+def sql_fingerprint(query: str) -> str:
+    return hashlib.sha256(canonicalize_sql(query).encode()).hexdigest()
+
+
+def query_key(query: str, params: Optional[dict] = None) -> str:
+    """Chave de uma execucao: forma canonica do SQL mais os parametros."""
+    canonical = canonicalize_sql(query)
+    raw = canonical + str(sorted(params.items())) if params else canonical
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def extract_tables(query: str) -> frozenset[str]:
+    """Tabelas lidas pela query (apos FROM/JOIN), sem crases e sem CTEs."""
+    tokens = tokenize_sql(query)
+    cte_names = {
+        tokens[i][1]
+        for i in range(len(tokens) - 2)
+        if tokens[i][0] in ("word", "quoted")
+        and tokens[i + 1][1] == "AS"
+        and tokens[i + 2][1] == "("
+    }
+
+    tables: set[str] = set()
+    open_calls: list[str] = []
+    for i, (_, text) in enumerate(tokens):
+        if text == "(":
+            open_calls.append(tokens[i - 1][1].upper() if i else "")
+        elif text == ")" and open_calls:
+            open_calls.pop()
+        if text not in ("FROM", "JOIN") or (open_calls and open_calls[-1] == "EXTRACT"):
+            continue
+        parts: list[str] = []
+        j = i + 1
+        while j < len(tokens):
+            kind, part = tokens[j]
+            if kind not in ("word", "quoted") or part in SQL_KEYWORDS:
+                break
+            parts.append(part.strip("`"))
+            if j + 1 < len(tokens) and tokens[j + 1][1] == ".":
+                j += 2
+                continue
+            break
+        if j + 1 < len(tokens) and tokens[j + 1][1] == "(":
+            continue
+        name = ".".join(parts)
+        if name and name not in cte_names:
+            tables.add(name)
+    return frozenset(tables)
@@ -0,0 +1,468 @@
+import logging
+import re
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Callable, Optional
+
+import pandas as pd
+
+from src.core.cache_manager import CacheManager
+from src.core.cache_metrics import DEFAULT_NAMESPACE
+from src.core.sql_normalizer import sql_fingerprint, tokenize_sql
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+_COMPARISONS: frozenset[str] = frozenset({"=", ">", ">=", "<", "<="})
+_UNSUPPORTED: frozenset[str] = frozenset({
+    "DISTINCT", "GROUP", "HAVING", "JOIN", "LIMIT", "OFFSET", "OR", "NOT",
+    "QUALIFY", "UNION", "WINDOW", "WITH", "OVER", "IS", "LIKE",
+})
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """Restricao sobre uma coluna: conjunto de valores ou intervalo."""
+
+    values: Optional[frozenset] = None
+    low: Any = None
+    low_inclusive: bool = True
+    high: Any = None
+    high_inclusive: bool = True
+
+    def _in_range(self, value: Any) -> bool:
+        if self.low is not None and (
+            value < self.low or (value == self.low and not self.low_inclusive)
+        ):
+            return False
+        if self.high is not None and (
+            value > self.high or (value == self.high and not self.high_inclusive)
+        ):
+            return False
+        return True
+
+    def intersect(self, other: "Predicate") -> "Predicate":
+        if self.values is not None or other.values is not None:
+            if self.values is not None and other.values is not None:
+                return Predicate(values=self.values & other.values)
+            values, ranged = (
+                (self.values, other) if self.values is not None else (other.values, self)
+            )
+            return Predicate(values=frozenset(v for v in values if ranged._in_range(v)))
+
+        low, low_inclusive = self.low, self.low_inclusive
+        if other.low is not None and (
+            low is None or other.low > low or (other.low == low and not other.low_inclusive)
+        ):
+            low, low_inclusive = other.low, other.low_inclusive
+        high, high_inclusive = self.high, self.high_inclusive
+        if other.high is not None and (
+            high is None or other.high < high or (other.high == high and not other.high_inclusive)
+        ):
+            high, high_inclusive = other.high, other.high_inclusive
+        return Predicate(None, low, low_inclusive, high, high_inclusive)
+
+    def covers(self, other: "Predicate") -> bool:
+        """``True`` se toda linha aceita por ``other`` tambem e aceita aqui."""
+        try:
+            if self.values is not None:
+                return other.values is not None and other.values <= self.values
+            if other.values is not None:
+                return all(self._in_range(v) for v in other.values)
+            if self.low is not None and (
+                other.low is None
+                or other.low < self.low
+                or (other.low == self.low and other.low_inclusive and not self.low_inclusive)
+            ):
+                return False
+            if self.high is not None and (
+                other.high is None
+                or other.high > self.high
+                or (other.high == self.high and other.high_inclusive and not self.high_inclusive)
+            ):
+                return False
+            return True
+        except TypeError:
+            return False
+
+    def mask(self, series: pd.Series) -> pd.Series:
+        if self.values is not None:
+            return series.isin(list(self.values))
+        mask = pd.Series(True, index=series.index)
+        if self.low is not None:
+            mask &= series >= self.low if self.low_inclusive else series > self.low
+        if self.high is not None:
+            mask &= series <= self.high if self.high_inclusive else series < self.high
+        return mask
+
+    def to_sql(self, column: str) -> str:
+        """Condicao SQL com literais no dialeto do DuckDB (aspa escapada como ``''``).
+
+        O BigQuery escapa aspas com barra invertida; para ele use ``to_param_sql``.
+        """
+        if self.values is not None:
+            if not self.values:
+                return "FALSE"
+            values = ", ".join(_sql_literal(v) for v in sorted(self.values, key=str))
+            return f"{column} IN ({values})"
+        conditions: list[str] = []
+        if self.low is not None:
+            operator = ">=" if self.low_inclusive else ">"
+            conditions.append(f"{column} {operator} {_sql_literal(self.low)}")
+        if self.high is not None:
+            operator = "<=" if self.high_inclusive else "<"
+            conditions.append(f"{column} {operator} {_sql_literal(self.high)}")
+        return " AND ".join(conditions) or "TRUE"
+
+    def to_param_sql(self, column: str, params: dict[str, Any]) -> str:
+        """Condicao com parametros nomeados do BigQuery, acrescentados em ``params``."""
+        name = re.sub(r"\W", "_", column)
+        if self.values is not None:
+            if not self.values:
+                return "FALSE"
+            params[name] = sorted(self.values, key=str)
+            return f"{column} IN UNNEST(@{name})"
+        conditions: list[str] = []
+        if self.low is not None:
+            params[f"{name}_min"] = self.low
+            conditions.append(f"{column} {'>=' if self.low_inclusive else '>'} @{name}_min")
+        if self.high is not None:
+            params[f"{name}_max"] = self.high
+            conditions.append(f"{column} {'<=' if self.high_inclusive else '<'} @{name}_max")
+        return " AND ".join(conditions) or "TRUE"
+
+
+def _sql_literal(value: Any) -> str:
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return str(value)
+
+
+def predicates_to_sql(predicates: dict[str, Predicate]) -> Optional[str]:
+    if not predicates:
+        return None
+    return " AND ".join(predicates[column].to_sql(column) for column in sorted(predicates))
+
+
+def predicates_to_params(predicates: dict[str, Predicate]) -> tuple[Optional[str], dict[str, Any]]:
+    """Forma parametrizada de ``predicates_to_sql``, para enviar ao BigQuery."""
+    params: dict[str, Any] = {}
+    if not predicates:
+        return None, params
+    where = " AND ".join(
+        predicates[column].to_param_sql(column, params) for column in sorted(predicates)
+    )
+    return where, params
+
+
+@dataclass
+class QueryShape:
+    """Forma de um ``SELECT`` simples: tabela, colunas, filtros e ordenacao."""
+
+    table: str
+    columns: Optional[tuple[str, ...]]
+    predicates: dict[str, Predicate] = field(default_factory=dict)
+    order_by: list[tuple[str, bool]] = field(default_factory=list)
+
+
+def _literal(kind: str, text: str, params: Optional[dict] = None) -> Any:
+    if kind == "param":
+        value = _param(text, params)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            raise ValueError(text)
+        return value
+    if kind == "string":
+        return text[1:-1]
+    if kind == "number":
+        return float(text) if any(c in text for c in ".eE") else int(text)
+    raise ValueError(text)
+
+
+def _identifier(kind: str, text: str) -> str:
+    if kind not in ("word", "quoted"):
+        raise ValueError(text)
+    return text.strip("`")
+
+
+def _param(text: str, params: Optional[dict]) -> Any:
+    name = text[1:]
+    if not params or name not in params:
+        raise ValueError(text)
+    return params[name]
+
+
+def _parse_where(
+    tokens: list[tuple[str, str]], params: Optional[dict] = None
+) -> dict[str, Predicate]:
+    predicates: dict[str, Predicate] = {}
+    i = 0
+    while i < len(tokens):
+        column = _identifier(*tokens[i])
+        op = tokens[i + 1][1]
+        if op in _COMPARISONS:
+            value = _literal(*tokens[i + 2], params)
+            predicate = {
+                "=": Predicate(values=frozenset([value])),
+                ">": Predicate(low=value, low_inclusive=False),
+                ">=": Predicate(low=value),
+                "<": Predicate(high=value, high_inclusive=False),
+                "<=": Predicate(high=value),
+            }[op]
+            i += 3
+        elif op == "BETWEEN" and tokens[i + 3][1] == "AND":
+            predicate = Predicate(
+                low=_literal(*tokens[i + 2], params), high=_literal(*tokens[i + 4], params)
+            )
+            i += 5
+        elif op == "IN" and [t for _, t in tokens[i + 2:i + 4]] == ["UNNEST", "("]:
+            kind, text = tokens[i + 4]
+            values = _param(text, params) if kind == "param" else None
+            if tokens[i + 5][1] != ")" or not isinstance(values, (list, tuple, set, frozenset)):
+                raise ValueError(text)
+            predicate = Predicate(values=frozenset(values))
+            i += 6
+        elif op == "IN" and tokens[i + 2][1] == "(":
+            values: list[Any] = []
+            j = i + 3
+            while tokens[j][1] != ")":
+                values.append(_literal(*tokens[j], params))
+                if tokens[j + 1][1] == ",":
+                    j += 1
+                j += 1
+            predicate = Predicate(values=frozenset(values))
+            i = j + 1
+        else:
+            raise ValueError(op)
+
+        if column in predicates:
+            predicate = predicates[column].intersect(predicate)
+        predicates[column] = predicate
+        if i < len(tokens):
+            if tokens[i][1] != "AND":
+                raise ValueError(tokens[i][1])
+            i += 1
+    return predicates
+
+
+def parse_select(query: str, params: Optional[dict] = None) -> Optional[QueryShape]:
+    """Interpreta ``SELECT cols FROM tabela [WHERE ...] [ORDER BY ...]``.
+
+    So sao aceitos filtros em conjuncao (``AND``) de comparacoes, ``IN`` e
+    ``BETWEEN`` contra literais. Parametros ``@nome`` (e ``IN UNNEST(@nome)``
+    para listas) sao resolvidos com ``params``; parametro ausente, ou qualquer
+    outra construcao, devolve ``None``.
+    """
+    tokens = tokenize_sql(query)
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    texts = [text for _, text in tokens]
+    if not texts or texts[0] != "SELECT" or "FROM" not in texts or _UNSUPPORTED & set(texts):
+        return None
+    if texts.count("SELECT") > 1 or texts.count("FROM") > 1:
+        return None
+
+    try:
+        from_idx = texts.index("FROM")
+        where_idx = texts.index("WHERE") if "WHERE" in texts else None
+        order_idx = texts.index("ORDER") if "ORDER" in texts else None
+        table_end = where_idx or order_idx or len(tokens)
+
+        select = tokens[1:from_idx]
+        if [t for _, t in select] == ["*"]:
+            columns = None
+        else:
+            if any(select[k][1] != "," for k in range(1, len(select), 2)):
+                return None
+            columns = tuple(_identifier(*select[k]) for k in range(0, len(select), 2))
+
+        table = " ".join(texts[from_idx + 1:table_end])
+        if not table:
+            return None
+
+        predicates: dict[str, Predicate] = {}
+        if where_idx is not None:
+            predicates = _parse_where(tokens[where_idx + 1:order_idx or len(tokens)], params)
+
+        order_by: list[tuple[str, bool]] = []
+        if order_idx is not None:
+            if texts[order_idx + 1] != "BY":
+                return None
+            for item in " ".join(texts[order_idx + 2:]).split(","):
+                parts = item.split()
+                if not parts or len(parts) > 2:
+                    return None
+                if len(parts) == 2 and parts[1] not in ("ASC", "DESC"):
+                    return None
+                order_by.append((parts[0].strip("`"), len(parts) == 1 or parts[1] == "ASC"))
+    except (ValueError, IndexError):
+        return None
+
+    return QueryShape(table, columns, predicates, order_by)
+
+
+def _filters_to_apply(superset: QueryShape, subset: QueryShape) -> Optional[dict[str, Predicate]]:
+    if subset.table != superset.table:
+        return None
+    if subset.columns is None and superset.columns is not None:
+        return None
+    for column, predicate in superset.predicates.items():
+        if column not in subset.predicates or not predicate.covers(subset.predicates[column]):
+            return None
+    return {
+        column: predicate
+        for column, predicate in subset.predicates.items()
+        if superset.predicates.get(column) != predicate
+    }
+
+
+def is_restriction(superset: QueryShape, subset: QueryShape) -> bool:
+    """``True`` se ``subset`` pode ser respondida filtrando ``superset``."""
+    filters = _filters_to_apply(superset, subset)
+    if filters is None:
+        return False
+    if superset.columns is None:
+        return True
+    needed = set(filters) | set(subset.columns or ()) | {c for c, _ in subset.order_by}
+    return needed <= set(superset.columns)
+
+
+def derive_subset(
+    superset: QueryShape, subset: QueryShape, df: pd.DataFrame
+) -> Optional[pd.DataFrame]:
+    """Calcula o resultado de ``subset`` filtrando o resultado de ``superset``.
+
+    Devolve ``None`` quando ``subset`` nao e uma restricao de ``superset``
+    ou quando faltam colunas no resultado em cache para aplicar os filtros.
+    """
+    filters = _filters_to_apply(superset, subset)
+    if filters is None:
+        return None
+    needed = set(filters) | set(subset.columns or ()) | {c for c, _ in subset.order_by}
+    if not needed <= set(df.columns):
+        return None
+
+    mask = pd.Series(True, index=df.index)
+    for column, predicate in filters.items():
+        mask &= predicate.mask(df[column])
+    result = df[mask]
+    if subset.order_by and subset.order_by != superset.order_by:
+        result = result.sort_values(
+            [c for c, _ in subset.order_by],
+            ascending=[asc for _, asc in subset.order_by],
+            kind="mergesort",
+        )
+    if subset.columns is not None:
+        result = result[list(subset.columns)]
+    return result.reset_index(drop=True)
+
+
+class SubsetCache:
+    """Responde queries filtradas a partir de um superconjunto ja em cache.
+
+    Cada resultado tabular gravado por ``set`` tem a forma da query indexada.
+    Em um miss exato, ``get`` procura uma entrada cuja query seja menos
+    restritiva (por exemplo, todas as UFs de 2015 a 2023) e aplica os filtros
+    da nova query com mascaras vetorizadas do pandas, sem ir ao BigQuery.
+    Parametros ``@nome`` sao resolvidos antes da comparacao, entao queries
+    com o mesmo texto e valores diferentes tambem se aproveitam.
+    """
+
+    def __init__(self, cache: CacheManager):
+        self.cache: CacheManager = cache
+        self._shapes: dict[str, tuple[str, QueryShape, Optional[dict]]] = {}
+        self._lock: Lock = Lock()
+        self._derived: int = 0
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def set(
+        self,
+        query: str,
+        value: Any,
+        params: Optional[dict] = None,
+        ttl: Optional[int] = None,
+        namespace: str = DEFAULT_NAMESPACE,
+        compute_ms: float = 0.0,
+    ) -> None:
+        self.cache.set(query, value, params=params, ttl=ttl,
+                       namespace=namespace, compute_ms=compute_ms)
+        self._index(query, value, params)
+
+    def _index(self, query: str, value: Any, params: Optional[dict]) -> None:
+        shape = parse_select(query, params)
+        if shape is not None and isinstance(value, pd.DataFrame):
+            with self._lock:
+                self._shapes[CacheManager._generate_key(query, params)] = (query, shape, params)
+
+    def get(
+        self,
+        query: str,
+        params: Optional[dict] = None,
+        namespace: str = DEFAULT_NAMESPACE,
+    ) -> Optional[Any]:
+        """Consulta exata ou derivada; conta um unico hit ou miss por chamada."""
+        value = self._get(query, params, namespace)
+        if value is None:
+            self.cache.metrics.record_miss(namespace, fingerprint=sql_fingerprint(query))
+        return value
+
+    def _get(self, query: str, params: Optional[dict], namespace: str) -> Optional[Any]:
+        value = self.cache.get(query, params, namespace, record_miss=False)
+        if value is not None:
+            return value
+        shape = parse_select(query, params)
+        if shape is None:
+            return None
+        return self._from_superset(shape, namespace, sql_fingerprint(query))
+
+    def _from_superset(
+        self,
+        shape: QueryShape,
+        namespace: str,
+        fingerprint: str,
+    ) -> Optional[pd.DataFrame]:
+        with self._lock:
+            candidates = [
+                (key, query, superset, superset_params)
+                for key, (query, superset, superset_params) in self._shapes.items()
+                if superset.table == shape.table
+            ]
+        for key, query, superset, superset_params in candidates:
+            if not is_restriction(superset, shape):
+                continue
+            df = self.cache.peek(query, superset_params)
+            if df is None:
+                with self._lock:
+                    self._shapes.pop(key, None)
+                continue
+            result = derive_subset(superset, shape, df)
+            if result is not None:
+                self._derived += 1
+                self.cache.metrics.record_hit(namespace, fingerprint=fingerprint)
+                self.logger.debug(
+                    "Cache derivado de superconjunto: %s -> %s", key[:12], fingerprint[:12]
+                )
+                return result
+        return None
+
+    def get_or_compute(
+        self,
+        query: str,
+        loader: Callable[[], Any],
+        params: Optional[dict] = None,
+        ttl: Optional[int] = None,
+        namespace: str = DEFAULT_NAMESPACE,
+    ) -> Optional[Any]:
+        value = self._get(query, params, namespace)
+        if value is not None:
+            return value
+        value = self.cache.get_or_compute(
+            query, loader, params=params, ttl=ttl, namespace=namespace
+        )
+        self._index(query, value, params)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"indexed_queries": len(self._shapes), "derived_hits": self._derived}
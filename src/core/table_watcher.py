@@ -0,0 +1,91 @@
+import streamlit as st
+import logging
+from datetime import datetime
+from threading import Event, Thread
+from typing import Callable, Optional
+
+from src.config import TABLE_WATCH_INTERVAL_SECONDS
+from src.core.cache_manager import CacheManager
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def parse_modified(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class TableWatcher:
+    """Invalida entradas do cache quando as tabelas de origem sao reescritas.
+
+    A cada ``interval`` segundos consulta ``metadata_fn`` (normalmente
+    ``BigQueryClient.get_table_metadata``) para as tabelas referenciadas no
+    cache e, se o campo ``modified`` mudou, remove apenas as entradas
+    criadas antes da alteracao.
+    """
+
+    def __init__(
+        self,
+        cache: CacheManager,
+        metadata_fn: Callable[[str], dict],
+        interval: float = TABLE_WATCH_INTERVAL_SECONDS,
+    ):
+        self.cache: CacheManager = cache
+        self.metadata_fn: Callable[[str], dict] = metadata_fn
+        self.interval: float = interval
+        self._last_modified: dict[str, float] = {}
+        self._stop: Event = Event()
+        self._thread: Optional[Thread] = None
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def poll_once(self) -> int:
+        invalidated = 0
+        for table in sorted(self.cache.tracked_tables()):
+            modified = parse_modified(self.metadata_fn(table).get("modified"))
+            if modified is None or self._last_modified.get(table) == modified:
+                continue
+            self._last_modified[table] = modified
+            invalidated += self.cache.invalidate_table(table, modified_after=modified)
+        return invalidated
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.logger.error("Erro ao verificar alteracoes de tabelas: %s", e)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="table-watcher", daemon=True)
+        self._thread.start()
+        self.logger.info("Monitoramento de tabelas iniciado (intervalo: %ss)", self.interval)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+@st.cache_resource(show_spinner=False)
+def start_table_watcher(
+    _cache: CacheManager,
+    _metadata_fn: Callable[[str], dict],
+    interval: float = TABLE_WATCH_INTERVAL_SECONDS,
+) -> TableWatcher:
+    """Inicia o monitoramento de tabelas uma unica vez por processo.
+
+    ``_metadata_fn`` recebe a referencia da tabela, como
+    ``BigQueryClient.get_table_metadata``.
+    """
+    watcher = TableWatcher(_cache, _metadata_fn, interval=interval)
+    watcher.start()
+    return watcher
@@ -4,10 +4,23 @@ import numpy as np
 import logging
 from typing import Optional
 
+from src.core.aggregate_spec import AggregateSpec, Measure
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
+def cohort_spec(
+    cohort_col: str = "ano_ingresso",
+    period_col: str = "ano",
+    value_col: str = "total_matriculas",
+) -> AggregateSpec:
+    return AggregateSpec(
+        group_by=[cohort_col, period_col],
+        measures=[Measure(value_col, "sum", value_col)],
+    )
+
+
 def build_cohort_matrix(
     df: pd.DataFrame,
     cohort_col: str = "ano_ingresso",
@@ -17,7 +30,7 @@ def build_cohort_matrix(
     if cohort_col not in df.columns or period_col not in df.columns:
         return pd.DataFrame()
 
-    cohort_data = df.groupby([cohort_col, period_col])[value_col].sum().reset_index()
+    cohort_data = cohort_spec(cohort_col, period_col, value_col).aggregate(df)
     cohort_data["periodo_idx"] = cohort_data[period_col] - cohort_data[cohort_col]
 
     cohort_pivot = cohort_data.pivot_table(
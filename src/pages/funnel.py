@@ -4,6 +4,8 @@ import plotly.graph_objects as go
 import logging
 from typing import Optional
 
+from src.core.aggregate_spec import AggregateSpec, Measure
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -16,6 +18,21 @@ FUNNEL_STAGES: list[dict] = [
 ]
 
 
+def funnel_spec() -> AggregateSpec:
+    return AggregateSpec(
+        measures=[Measure(s["coluna"], "sum", s["coluna"]) for s in FUNNEL_STAGES],
+    )
+
+
+def funnel_values(df: pd.DataFrame) -> list[float]:
+    """Totais de cada etapa presente, a partir das linhas ou da linha agregada."""
+    return [
+        float(df[stage["coluna"]].sum())
+        for stage in FUNNEL_STAGES
+        if stage["coluna"] in df.columns
+    ]
+
+
 def calculate_funnel_rates(values: list[float]) -> list[dict]:
     rates = []
     for i, val in enumerate(values):
@@ -84,10 +101,7 @@ def render_funnel_page(df: Optional[pd.DataFrame] = None) -> None:
         return
 
     stages = [s["nome"] for s in FUNNEL_STAGES]
-    values = []
-    for stage in FUNNEL_STAGES:
-        if stage["coluna"] in df.columns:
-            values.append(float(df[stage["coluna"]].sum()))
+    values = funnel_values(df)
 
     if values:
         fig = create_funnel_chart(stages[:len(values)], values)
@@ -3,6 +3,9 @@ import pandas as pd
 import logging
 from typing import Optional
 
+from src.components.metrics_cards import render_stale_notice
+from src.core.query_builder import QueryBuilder
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -39,6 +42,36 @@ KPI_DEFINITIONS: list[dict] = [
 ]
 
 
+def build_kpis_query(
+    qb: QueryBuilder,
+    table: str,
+    ano: int,
+    where: Optional[str] = None,
+) -> str:
+    """Query unica com o ano atual e o anterior de todos os KPI_DEFINITIONS."""
+    return qb.build_kpi_batch_query(
+        table, [kpi["coluna"] for kpi in KPI_DEFINITIONS], [ano - 1, ano], where=where
+    )
+
+
+def reshape_kpi_batch(df: pd.DataFrame, period_column: str = "ano") -> pd.DataFrame:
+    """Converte a linha de ``build_kpi_batch_query`` em um periodo por linha.
+
+    O resultado tem uma coluna por metrica, ordenado por periodo, no formato
+    lido por ``render_kpis_page`` (ultimo periodo = atual, penultimo = anterior).
+    """
+    if df.empty:
+        return pd.DataFrame()
+    row = df.iloc[0]
+    records: dict[int, dict] = {}
+    for alias, value in row.items():
+        column, _, period = str(alias).rpartition("__")
+        if not column or not period.isdigit():
+            continue
+        records.setdefault(int(period), {period_column: int(period)})[column] = value
+    return pd.DataFrame([records[p] for p in sorted(records)])
+
+
 def calculate_delta(current: float, previous: float) -> Optional[float]:
     if previous == 0:
         return None
@@ -78,6 +111,7 @@ def render_kpis_page(df: Optional[pd.DataFrame] = None) -> None:
         _render_demo_kpis()
         return
 
+    render_stale_notice(df)
     cols = st.columns(len(KPI_DEFINITIONS))
     for idx, kpi in enumerate(KPI_DEFINITIONS):
         if kpi["coluna"] in df.columns:
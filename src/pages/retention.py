@@ -4,10 +4,39 @@ import plotly.express as px
 import logging
 from typing import Optional
 
+from src.core.aggregate_spec import AggregateSpec, Measure
+from src.core.query_builder import QueryBuilder
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
+def retention_spec(
+    year_col: str = "ano",
+    enrolled_col: str = "total_matriculas",
+    group_by: Optional[list[str]] = None,
+) -> AggregateSpec:
+    return AggregateSpec(
+        group_by=(group_by or []) + [year_col],
+        measures=[Measure(enrolled_col, "sum", enrolled_col)],
+    )
+
+
+RETENTION_LEVELS: list[tuple[str, ...]] = [("ano",), ("regiao", "ano")]
+
+
+def build_retention_levels_query(
+    qb: QueryBuilder,
+    table: str,
+    where: Optional[str] = None,
+) -> str:
+    """Serie nacional e serie por regiao (Comparativo Regional) em uma leitura."""
+    metrics = retention_spec().metric_expressions()
+    return qb.build_grouping_sets(
+        table, metrics, [list(level) for level in RETENTION_LEVELS], where=where
+    )
+
+
 def calculate_retention_rate(
     df: pd.DataFrame,
     year_col: str = "ano",
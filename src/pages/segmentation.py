@@ -3,6 +3,11 @@ import pandas as pd
 import logging
 from typing import Optional
 
+from src.components.metrics_cards import render_approximate_badge, render_stale_notice
+from src.core.aggregate_spec import AggregateSpec, Measure
+from src.core.approximate import ApproximateMode, approximate_error
+from src.core.query_builder import QueryBuilder
+
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -15,14 +20,61 @@ SEGMENTATION_DIMENSIONS: list[dict] = [
 ]
 
 
+SEGMENT_STATS: list[tuple[str, str]] = [
+    ("mean", "Media"),
+    ("median", "Mediana"),
+    ("std", "Desvio Padrao"),
+    ("min", "Minimo"),
+    ("max", "Maximo"),
+    ("count", "Contagem"),
+]
+
+
+def segment_stats_spec(segment_col: str, metric_col: str) -> AggregateSpec:
+    return AggregateSpec(
+        group_by=[segment_col],
+        measures=[
+            Measure(metric_col, stat, alias.lower().replace(" ", "_"))
+            for stat, alias in SEGMENT_STATS
+        ],
+    )
+
+
 def compute_segment_stats(df: pd.DataFrame, segment_col: str, metric_col: str) -> pd.DataFrame:
-    stats = df.groupby(segment_col)[metric_col].agg(
-        ["mean", "median", "std", "min", "max", "count"]
-    ).round(2)
-    stats.columns = ["Media", "Mediana", "Desvio Padrao", "Minimo", "Maximo", "Contagem"]
+    """Estatisticas por segmento a partir das linhas ou da tabela ja agregada."""
+    spec = segment_stats_spec(segment_col, metric_col)
+    stats = spec.aggregate(df).set_index(segment_col).round(2)
+    stats.columns = [alias for _, alias in SEGMENT_STATS]
     return stats.sort_values("Media", ascending=False)
 
 
+def segmentation_levels() -> list[tuple[str, ...]]:
+    return [(d["coluna"],) for d in SEGMENTATION_DIMENSIONS]
+
+
+def build_segmentation_query(
+    qb: QueryBuilder,
+    table: str,
+    metric_col: str,
+    where: Optional[str] = None,
+    approximate: Optional[ApproximateMode] = None,
+) -> str:
+    """Estatisticas de todas as dimensoes de segmentacao em uma unica leitura.
+
+    O resultado, separado por ``split_grouping_sets``, fica no cache sob a
+    mesma chave de ``build_aggregate_query`` com ``segment_stats_spec`` de
+    cada dimensao, de modo que trocar a dimensao nao dispara nova query.
+    """
+    spec = segment_stats_spec(SEGMENTATION_DIMENSIONS[0]["coluna"], metric_col)
+    return qb.build_grouping_sets(
+        table,
+        spec.metric_expressions(approximate),
+        [list(level) for level in segmentation_levels()],
+        where=where,
+        approximate=approximate,
+    )
+
+
 def render_segmentation_page(df: Optional[pd.DataFrame] = None) -> None:
     st.header("Segmentacao")
     st.markdown("Analise comparativa entre diferentes segmentos educacionais.")
@@ -60,8 +112,12 @@ def render_segmentation_page(df: Optional[pd.DataFrame] = None) -> None:
         _render_demo_segmentation()
         return
 
-    if dim_col in df.columns and metric_col in df.columns:
+    if dim_col in df.columns and (
+        metric_col in df.columns or segment_stats_spec(dim_col, metric_col).is_aggregated(df)
+    ):
         stats = compute_segment_stats(df, dim_col, metric_col)
+        render_stale_notice(df)
+        render_approximate_badge(approximate_error(df))
         st.dataframe(stats, use_container_width=True)
         st.bar_chart(stats["Media"])
 
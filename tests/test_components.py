@@ -1,12 +1,790 @@
+import concurrent.futures
+import json
+import os
+import threading
+import time
+from typing import Optional
+
 import pytest
 import pandas as pd
-from datetime import date
+import pyarrow as pa
+from google.api_core import exceptions
+from google.cloud import bigquery
+from datetime import date, datetime
 
-from src.core.cache_manager import CacheManager, CacheEntry
+from src.core.bigquery_client import BigQueryClient, ResultTooLargeError, build_query_parameters
+from src.config import CACHE_HARD_TTL_SECONDS, MAX_CACHE_BYTES
+from src.core.cache_manager import CacheManager, CacheEntry, create_cache_manager, estimate_size
+from src.core.cache_codec import ArrowCodec
+from src.core.client_pool import BigQueryClientPool
+from src.core.disk_cache import DiskCache
+from src.core.shared_cache import SharedCache
+from src.core.subset_cache import Predicate, SubsetCache, parse_select
+from src.core.single_flight import SingleFlight
+from src.core.sql_normalizer import canonicalize_sql, sql_fingerprint, extract_tables
+from src.core.table_watcher import TableWatcher
+from src.core.cache_metrics import CacheMetrics, set_current_page
+from src.core.query_history import QueryHistory, QueryRecord
+from src.core.cache_warmup import CacheWarmer, WarmupCandidate, rank_candidates
+from src.core.saved_queries import SavedQuery, SavedQueryManager
+from src.core.query_backend import QueryBackend, LocalParquetBackend
 from src.core.query_builder import QueryBuilder
+from src.core.aggregate_spec import AggregateSpec, Measure
+from src.core.approximate import ApproximateMode, approximate_error, error_bound_pct
+from src.core.rollup_cube import RollupCube
+from src.core.query_planner import QueryPlanner, QueryRequest
+from src.core.grouping_sets import file_levels_in_cache, rollup_levels, split_grouping_sets
 from src.core.csv_processor import CSVProcessor
+from src.core.retry import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    deterministic_job_id,
+    is_retryable,
+)
+from src.core.job_tracker import JobSupersededError, JobTracker, set_current_rerun
+from src.core.query_budget import BYTES_BILLED_ATTR, QueryBudget, format_bytes
+from src.analytics.scheduler import Frequency, ReportScheduler, ScheduledReport
+from src.components.sql_editor import check_query_cost, execute_within_budget
 from src.components.date_picker import DateRange
-from src.components.filters import FilterState, REGIOES_BR, ESTADOS_BR
+from src.components.metrics_cards import approximate_badge_text
+from src.components.filters import (
+    FilterState, REGIOES_BR, ESTADOS_BR, compile_filters, apply_filters, filter_predicates,
+    filter_request,
+)
+
+
+class FakeRowIterator:
+
+    def __init__(self, batches: list[pa.RecordBatch], fail_after: Optional[int] = None):
+        self.batches = batches
+        self.fail_after = fail_after
+        self.schema = [
+            bigquery.SchemaField("ano", "INTEGER"),
+            bigquery.SchemaField("taxa_aprovacao", "FLOAT"),
+        ]
+
+    def to_arrow_iterable(self, bqstorage_client=None):
+        for i, batch in enumerate(self.batches):
+            if i == self.fail_after:
+                raise ConnectionError("conexao encerrada pelo servidor")
+            yield batch
+
+
+class FakeQueryJob:
+
+    def __init__(self, batches: list[pa.RecordBatch], fail_after: Optional[int] = None):
+        self.batches = batches
+        self.fail_after = fail_after
+
+    def result(self, timeout=None):
+        return FakeRowIterator(self.batches, self.fail_after)
+
+
+class FakeArrowClient:
+    """Cliente falso que devolve o resultado em lotes Arrow."""
+
+    def __init__(self, num_batches: int = 3, rows_per_batch: int = 100):
+        self.batches = [
+            pa.RecordBatch.from_pydict({
+                "ano": [2015 + i] * rows_per_batch,
+                "taxa_aprovacao": [90.0 + i] * rows_per_batch,
+            })
+            for i in range(num_batches)
+        ]
+        self.last_job_config = None
+        self.fail_after: Optional[int] = None
+
+    def query(self, query, job_config=None, job_id=None, timeout=None):
+        self.last_job_config = job_config
+        return FakeQueryJob(self.batches, self.fail_after)
+
+
+def make_fake_bq_client(fake_client) -> BigQueryClient:
+    client = BigQueryClient(credentials_path="fake.json", project_id="projeto-teste")
+    client.client = fake_client
+    return client
+
+
+class TestBigQueryStreaming:
+
+    def test_stream_record_batches(self):
+        client = make_fake_bq_client(FakeArrowClient(num_batches=3))
+        batches = list(client.stream_query("SELECT * FROM t"))
+        assert len(batches) == 3
+        assert all(isinstance(b, pa.RecordBatch) for b in batches)
+
+    def test_stream_dataframe_chunks(self):
+        client = make_fake_bq_client(FakeArrowClient(num_batches=2, rows_per_batch=10))
+        chunks = list(client.stream_query("SELECT * FROM t", as_dataframe=True))
+        assert all(isinstance(c, pd.DataFrame) for c in chunks)
+        assert sum(len(c) for c in chunks) == 20
+
+    def test_stream_respects_memory_cap(self):
+        fake = FakeArrowClient(num_batches=5)
+        client = make_fake_bq_client(fake)
+        cap = fake.batches[0].nbytes * 2
+        batches = []
+        with pytest.raises(ResultTooLargeError):
+            for batch in client.stream_query("SELECT * FROM t", max_memory_bytes=cap):
+                batches.append(batch)
+        assert len(batches) == 2
+
+    def test_execute_query_streaming_rejects_truncated_result(self):
+        fake = FakeArrowClient(num_batches=5)
+        client = make_fake_bq_client(fake)
+        cap = fake.batches[0].nbytes * 2
+        assert client.execute_query_streaming("SELECT * FROM t", max_memory_bytes=cap) is None
+        assert len(client.execute_query_streaming("SELECT * FROM t")) == 500
+
+    def test_execute_query_streaming_rejects_interrupted_stream(self):
+        fake = FakeArrowClient(num_batches=3)
+        fake.fail_after = 1
+        client = make_fake_bq_client(fake)
+        with pytest.raises(ConnectionError):
+            list(client.stream_query("SELECT * FROM t"))
+        assert client.execute_query_streaming("SELECT * FROM t") is None
+
+    def test_execute_query_streaming_empty_result(self):
+        client = make_fake_bq_client(FakeArrowClient(num_batches=0))
+        df = client.execute_query_streaming("SELECT * FROM t")
+        assert df is not None and df.empty
+        assert list(df.columns) == ["ano", "taxa_aprovacao"]
+        assert df["ano"].dtype == "int64"
+
+    def test_execute_query_streaming_concatenates(self):
+        client = make_fake_bq_client(FakeArrowClient(num_batches=4, rows_per_batch=25))
+        df = client.execute_query_streaming("SELECT * FROM t")
+        assert len(df) == 100
+        assert list(df.columns) == ["ano", "taxa_aprovacao"]
+
+    def test_params_sent_as_query_parameters(self):
+        fake = FakeArrowClient(num_batches=1)
+        client = make_fake_bq_client(fake)
+        client.execute_query_streaming(
+            "SELECT * FROM t WHERE sigla_uf IN UNNEST(@estados)", params={"estados": ["SP"]}
+        )
+        [param] = fake.last_job_config.query_parameters
+        assert param.name == "estados" and param.values == ["SP"]
+
+    def test_stream_without_client(self):
+        client = BigQueryClient(credentials_path="fake.json", project_id="projeto-teste")
+        assert list(client.stream_query("SELECT 1")) == []
+
+
+class FakeLatencyJob:
+
+    def __init__(self, latency: float, fail: bool = False):
+        self.latency = latency
+        self.fail = fail
+        self.cancelled = False
+
+    def result(self, timeout=None):
+        if timeout is not None and self.latency > timeout:
+            time.sleep(timeout)
+            raise concurrent.futures.TimeoutError("job excedeu o timeout")
+        time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("falha simulada")
+        return self
+
+    def to_dataframe(self, bqstorage_client=None):
+        return pd.DataFrame({"latencia": [self.latency]})
+
+    def cancel(self):
+        self.cancelled = True
+        return True
+
+
+class FakeLatencyClient:
+    """Cliente falso com latencia injetada por query."""
+
+    def __init__(self, latencies: dict[str, float], failing: set[str] | None = None):
+        self.latencies = latencies
+        self.failing = failing or set()
+        self.jobs: dict[str, FakeLatencyJob] = {}
+        self.submissions: list[tuple[str, object]] = []
+
+    def query(self, query, job_config=None, job_id=None, timeout=None):
+        self.submissions.append((job_id, job_config))
+        job = FakeLatencyJob(self.latencies[query], fail=query in self.failing)
+        self.jobs[query] = job
+        return job
+
+
+class FakeDryRunJob:
+
+    def __init__(self, total_bytes_processed: int):
+        self.total_bytes_processed = total_bytes_processed
+
+
+class FakeDryRunClient:
+
+    def __init__(self, total_bytes_processed: int):
+        self.total_bytes_processed = total_bytes_processed
+        self.last_job_config = None
+
+    def query(self, query, job_config=None, job_id=None, timeout=None):
+        self.last_job_config = job_config
+        return FakeDryRunJob(self.total_bytes_processed)
+
+
+class FakeFlakyClient:
+    """Cliente falso que falha nas primeiras chamadas e registra os job_ids."""
+
+    def __init__(self, submit_errors: list[Exception] | None = None,
+                 fetch_errors: list[Exception] | None = None, created_on_error: bool = True):
+        self.created_on_error = created_on_error
+        self.submit_errors = list(submit_errors or [])
+        self.fetch_errors = list(fetch_errors or [])
+        self.job_ids: list[str] = []
+        self.created: set[str] = set()
+        self.reused: list[str] = []
+
+    def query(self, query, job_config=None, job_id=None, timeout=None):
+        self.job_ids.append(job_id)
+        if job_id in self.created:
+            raise exceptions.Conflict(f"Already Exists: Job {job_id}")
+        if self.submit_errors:
+            if self.created_on_error:
+                self.created.add(job_id)
+            raise self.submit_errors.pop(0)
+        self.created.add(job_id)
+        return self.job(job_id)
+
+    def get_job(self, job_id):
+        self.reused.append(job_id)
+        return self.job(job_id)
+
+    def job(self, job_id):
+        client = self
+
+        class Job:
+            def to_dataframe(self, bqstorage_client=None):
+                if client.fetch_errors:
+                    raise client.fetch_errors.pop(0)
+                return pd.DataFrame({"job": [job_id]})
+
+        return Job()
+
+
+class FakeTrackedJob:
+
+    def __init__(self, job_id: str, blocking: bool = True):
+        self.job_id = job_id
+        self.blocking = blocking
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.error_result = None
+
+    def cancel(self):
+        self.cancelled.set()
+        self.error_result = {"reason": "stopped"}
+        return True
+
+    def to_dataframe(self, bqstorage_client=None):
+        deadline = time.monotonic() + (5 if self.blocking else 0)
+        while not self.finished.is_set() and time.monotonic() < deadline:
+            if self.cancelled.wait(timeout=0.01):
+                break
+        if self.cancelled.is_set():
+            raise exceptions.BadRequest(
+                "Job execution was cancelled", errors=[{"reason": "stopped"}]
+            )
+        return pd.DataFrame({"job": [self.job_id]})
+
+
+class FakeSlowClient:
+    """Cliente falso cujos jobs (com ``blocking``) so terminam quando cancelados."""
+
+    def __init__(self, blocking: bool = True):
+        self.blocking = blocking
+        self.jobs: dict[str, FakeTrackedJob] = {}
+        self.submitted = threading.Event()
+
+    def query(self, query, job_config=None, job_id=None, timeout=None):
+        if job_id in self.jobs:
+            raise exceptions.Conflict(f"Already Exists: Job {job_id}")
+        self.jobs[job_id] = FakeTrackedJob(job_id, self.blocking)
+        self.submitted.set()
+        return self.jobs[job_id]
+
+    def get_job(self, job_id):
+        return self.jobs[job_id]
+
+
+class TestJobTracker:
+
+    def test_new_rerun_cancels_previous_generation(self):
+        tracker = JobTracker()
+        first = tracker.begin_rerun("sessao-a")
+        old, other = FakeTrackedJob("old"), FakeTrackedJob("other")
+        tracker.register(old, ("sessao-a", first))
+        tracker.register(other, ("sessao-b", tracker.begin_rerun("sessao-b")))
+        assert tracker.in_flight() == 2
+
+        assert tracker.begin_rerun("sessao-a") == first + 1
+        assert old.cancelled.is_set()
+        assert not other.cancelled.is_set()
+        assert tracker.in_flight("sessao-a") == 0
+
+    def test_shared_job_cancelled_only_when_orphaned(self):
+        tracker = JobTracker()
+        shared = FakeTrackedJob("shared")
+        tracker.register(shared, ("sessao-a", tracker.begin_rerun("sessao-a")))
+        tracker.register(shared, ("sessao-b", tracker.begin_rerun("sessao-b")))
+        tracker.begin_rerun("sessao-a")
+        assert not shared.cancelled.is_set()
+        assert tracker.end_session("sessao-b") == 1
+        assert shared.cancelled.is_set()
+
+    def test_superseded_run_cannot_register(self):
+        tracker = JobTracker()
+        stale = ("sessao-a", tracker.begin_rerun("sessao-a"))
+        tracker.begin_rerun("sessao-a")
+        job = FakeTrackedJob("late")
+        with pytest.raises(JobSupersededError):
+            tracker.register(job, stale)
+        assert job.cancelled.is_set()
+
+    def test_sweep_ends_inactive_sessions(self):
+        tracker = JobTracker()
+        job = FakeTrackedJob("j")
+        tracker.register(job, ("sessao-a", tracker.begin_rerun("sessao-a")))
+        tracker.begin_rerun("sessao-b")
+        assert tracker.sweep(lambda sid: sid == "sessao-b") == 1
+        assert job.cancelled.is_set()
+        assert tracker.is_superseded(("sessao-a", 1))
+
+    def test_untracked_outside_rerun(self):
+        tracker = JobTracker()
+        assert tracker.register(FakeTrackedJob("warmup")) is None
+        assert tracker.in_flight() == 0
+
+    def test_client_job_cancelled_by_newer_rerun(self):
+        fake = FakeSlowClient()
+        client = make_fake_bq_client(fake)
+        client.jobs = JobTracker()
+        generation = client.jobs.begin_rerun("sessao-a")
+        results = []
+
+        def old_rerun():
+            set_current_rerun("sessao-a", generation)
+            results.append(client.execute_query("SELECT * FROM censo_escolar"))
+
+        thread = threading.Thread(target=old_rerun)
+        thread.start()
+        assert fake.submitted.wait(timeout=5)
+        deadline = time.monotonic() + 5
+        while client.jobs.in_flight("sessao-a") == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        client.jobs.begin_rerun("sessao-a")
+        thread.join(timeout=5)
+
+        [job] = fake.jobs.values()
+        assert job.cancelled.is_set()
+        assert results == [None]
+
+    def test_coalesced_waiter_keeps_job_alive(self):
+        fake = FakeSlowClient()
+        client = make_fake_bq_client(fake)
+        cache = CacheManager(default_ttl=60)
+        query = "SELECT * FROM censo_escolar WHERE ano = 2023"
+        generations = {sid: client.jobs.begin_rerun(sid) for sid in ("coal-a", "coal-b")}
+        results = {}
+
+        def rerun(session_id):
+            set_current_rerun(session_id, generations[session_id])
+            results[session_id] = cache.get_or_compute(query, lambda: client.execute_query(query))
+
+        leader = threading.Thread(target=rerun, args=("coal-a",))
+        leader.start()
+        assert fake.submitted.wait(timeout=5)
+        follower = threading.Thread(target=rerun, args=("coal-b",))
+        follower.start()
+        deadline = time.monotonic() + 5
+        while client.jobs.in_flight("coal-b") == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        client.jobs.begin_rerun("coal-a")
+        [job] = fake.jobs.values()
+        assert not job.cancelled.is_set()
+        job.finished.set()
+        leader.join(timeout=5)
+        follower.join(timeout=5)
+        assert results["coal-b"]["job"].iloc[0] == job.job_id
+
+    def test_adopted_job_never_cancelled(self):
+        fake = FakeSlowClient()
+        client = make_fake_bq_client(fake)
+        client.jobs = JobTracker()
+        query = "SELECT * FROM censo_escolar"
+        job_id = deterministic_job_id(query)
+        fake.jobs[job_id] = FakeTrackedJob(job_id)
+        generation = client.jobs.begin_rerun("sessao-a")
+
+        def old_rerun():
+            set_current_rerun("sessao-a", generation)
+            client.execute_query(query)
+
+        thread = threading.Thread(target=old_rerun)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while client.jobs.in_flight("sessao-a") == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        client.jobs.begin_rerun("sessao-a")
+        assert not fake.jobs[job_id].cancelled.is_set()
+        fake.jobs[job_id].finished.set()
+        thread.join(timeout=5)
+
+    def test_cancelled_job_id_not_reused(self):
+        fake = FakeSlowClient(blocking=False)
+        client = make_fake_bq_client(fake)
+        query = "SELECT * FROM censo_escolar"
+        job_id = deterministic_job_id(query)
+        fake.jobs[job_id] = FakeTrackedJob(job_id)
+        fake.jobs[job_id].cancel()
+
+        df = client.execute_query(query)
+        assert df["job"].iloc[0] == f"{job_id}_r1"
+
+
+class TestRetryPolicy:
+
+    def policy(self, sleeps: list[float], max_attempts: int = 4) -> RetryPolicy:
+        return RetryPolicy(max_attempts=max_attempts, initial_delay=1.0, max_delay=3.0,
+                           sleep=sleeps.append, rng=lambda: 1.0)
+
+    def test_classifies_transient_errors(self):
+        assert is_retryable(exceptions.TooManyRequests("limite"))
+        assert is_retryable(exceptions.ServiceUnavailable("indisponivel"))
+        assert is_retryable(
+            exceptions.Forbidden("limite", errors=[{"reason": "rateLimitExceeded"}])
+        )
+        assert not is_retryable(exceptions.Forbidden("negado", errors=[{"reason": "accessDenied"}]))
+        assert not is_retryable(exceptions.BadRequest("sintaxe"))
+        assert not is_retryable(ValueError("erro"))
+
+    def test_exponential_backoff_with_cap(self):
+        sleeps: list[float] = []
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 4:
+                raise exceptions.InternalServerError("erro")
+            return "ok"
+
+        assert self.policy(sleeps).call(flaky) == "ok"
+        assert sleeps == [1.0, 2.0, 3.0]
+        jittered = RetryPolicy(initial_delay=1.0, rng=lambda: 0.25)
+        assert jittered.delay(2) == pytest.approx(1.0)
+
+    def test_non_retryable_and_exhausted(self):
+        sleeps: list[float] = []
+        with pytest.raises(exceptions.BadRequest):
+            self.policy(sleeps).call(lambda: (_ for _ in ()).throw(exceptions.BadRequest("x")))
+        assert sleeps == []
+        with pytest.raises(exceptions.TooManyRequests):
+            self.policy(sleeps, max_attempts=2).call(
+                lambda: (_ for _ in ()).throw(exceptions.TooManyRequests("x"))
+            )
+        assert len(sleeps) == 1
+
+    def test_circuit_breaker_opens_and_recovers(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+        policy = self.policy([], max_attempts=5)
+        with pytest.raises(CircuitOpenError):
+            policy.call(lambda: (_ for _ in ()).throw(exceptions.ServiceUnavailable("x")), breaker)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+
+        now[0] = 31.0
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert policy.call(lambda: "ok", breaker) == "ok"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_trial_released_on_non_retryable_error(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        policy = self.policy([], max_attempts=1)
+        with pytest.raises(exceptions.ServiceUnavailable):
+            policy.call(lambda: (_ for _ in ()).throw(exceptions.ServiceUnavailable("x")), breaker)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        now[0] = 31.0
+        with pytest.raises(exceptions.BadRequest):
+            policy.call(lambda: (_ for _ in ()).throw(exceptions.BadRequest("sintaxe")), breaker)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert policy.call(lambda: "ok", breaker) == "ok"
+
+    def test_half_open_trial_released_on_local_error(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        policy = self.policy([], max_attempts=1)
+        with pytest.raises(exceptions.ServiceUnavailable):
+            policy.call(lambda: (_ for _ in ()).throw(exceptions.ServiceUnavailable("x")), breaker)
+        now[0] = 31.0
+        with pytest.raises(JobSupersededError):
+            policy.call(lambda: (_ for _ in ()).throw(JobSupersededError("rerun")), breaker)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert policy.call(lambda: "ok", breaker) == "ok"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_deterministic_job_id(self):
+        first = deterministic_job_id("SELECT 1", {"a": 1}, window_seconds=60, now=120)
+        assert first == deterministic_job_id("select  1", {"a": 1}, window_seconds=60, now=179)
+        assert first != deterministic_job_id("SELECT 1", {"a": 2}, window_seconds=60, now=120)
+        assert first != deterministic_job_id("SELECT 1", {"a": 1}, window_seconds=60, now=180)
+
+    def test_lost_submission_reuses_existing_job(self):
+        fake = FakeFlakyClient(submit_errors=[exceptions.ServiceUnavailable("timeout")])
+        client = make_fake_bq_client(fake)
+        client.retry_policy = self.policy([])
+        df = client.execute_query("SELECT * FROM t")
+        assert fake.job_ids[0] == fake.job_ids[1]
+        assert fake.reused == [fake.job_ids[0]]
+        assert df["job"].iloc[0] == fake.job_ids[0]
+
+    def test_failed_job_retried_under_new_id(self):
+        fake = FakeFlakyClient(fetch_errors=[exceptions.InternalServerError("backendError")])
+        client = make_fake_bq_client(fake)
+        client.retry_policy = self.policy([])
+        df = client.execute_query("SELECT * FROM t")
+        assert fake.job_ids[1] == f"{fake.job_ids[0]}_r1"
+        assert df["job"].iloc[0] == fake.job_ids[1]
+
+    def test_open_circuit_fails_fast(self):
+        fake = FakeFlakyClient(submit_errors=[exceptions.ServiceUnavailable("x")] * 10,
+                               created_on_error=False)
+        client = make_fake_bq_client(fake)
+        client.retry_policy = self.policy([], max_attempts=3)
+        client.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        assert client.execute_query("SELECT * FROM t") is None
+        submitted = len(fake.job_ids)
+        assert client.execute_query("SELECT * FROM t") is None
+        assert len(fake.job_ids) == submitted
+
+    def test_cache_serves_expired_value_when_source_fails(self):
+        cache = CacheManager(default_ttl=60)
+        df = pd.DataFrame({"a": [1]})
+        cache.set("SELECT a FROM t", df, ttl=1)
+        cache._cache[cache._generate_key("SELECT a FROM t")].created_at -= 10
+        result = cache.get_or_compute("SELECT a FROM t", lambda: None)
+        pd.testing.assert_frame_equal(result, df)
+        assert result.attrs["dados_obsoletos"] is True
+        assert "dados_obsoletos" not in df.attrs
+        assert cache.get_or_compute("SELECT b FROM t", lambda: None) is None
+
+
+class TestQueryBudget:
+
+    def test_estimate_uses_dry_run(self):
+        fake = FakeDryRunClient(5 * 1024 ** 3)
+        client = make_fake_bq_client(fake)
+        assert client.estimate("SELECT * FROM t") == 5 * 1024 ** 3
+        assert fake.last_job_config.dry_run is True
+        assert fake.last_job_config.use_query_cache is False
+
+    def test_maximum_bytes_billed_on_job_config(self):
+        fake = FakeArrowClient(num_batches=1)
+        client = make_fake_bq_client(fake)
+        client.maximum_bytes_billed = 1000
+        client.execute_query_streaming("SELECT * FROM t")
+        assert fake.last_job_config.maximum_bytes_billed == 1000
+        client.execute_query_streaming("SELECT * FROM t", maximum_bytes_billed=500)
+        assert fake.last_job_config.maximum_bytes_billed == 500
+
+    def test_per_query_and_per_user_limits(self):
+        budget = QueryBudget(max_bytes_per_query=100, max_bytes_per_user=250)
+        assert budget.check(150, "ana")[0] is False
+        assert budget.check(None, "ana")[0] is False
+        assert budget.check(100, "ana")[0] is True
+
+        budget.record("ana", 100)
+        budget.record("ana", 100)
+        assert budget.remaining("ana") == 50
+        assert budget.maximum_bytes_billed("ana") == 50
+        allowed, message = budget.check(80, "ana")
+        assert not allowed and "cota" in message
+        assert budget.check(80, "bia")[0] is True
+        assert budget.maximum_bytes_billed() == 100
+
+    def test_usage_expires_with_window(self):
+        budget = QueryBudget(max_bytes_per_query=None, max_bytes_per_user=100, window_seconds=0)
+        budget.record("ana", 100)
+        time.sleep(0.01)
+        assert budget.remaining("ana") == 100
+
+    def test_format_bytes(self):
+        assert format_bytes(512) == "512 B"
+        assert format_bytes(3 * 1024 ** 2) == "3.0 MB"
+        assert format_bytes(2 * 1024 ** 4) == "2.0 TB"
+        assert format_bytes(None) == "desconhecido"
+
+    def test_editor_cost_check(self):
+        budget = QueryBudget(max_bytes_per_query=1024 ** 3)
+        allowed, message, estimated = check_query_cost(
+            "SELECT * FROM censo_escolar", lambda q: 4 * 1024 ** 4, budget, "ana"
+        )
+        assert not allowed and estimated == 4 * 1024 ** 4
+        assert "4.0 TB" in message
+        allowed, message, _ = check_query_cost("SELECT 1", lambda q: 10, budget, "ana")
+        assert allowed and message == "Estimativa: 10 B processados"
+
+    def test_editor_sends_user_cap_and_charges_billed_bytes(self):
+        budget = QueryBudget(max_bytes_per_query=1000, max_bytes_per_user=300)
+        budget.record("ana", 100)
+        calls = []
+
+        def execute(query, maximum_bytes_billed=None):
+            calls.append(maximum_bytes_billed)
+            df = pd.DataFrame({"x": [1]})
+            df.attrs[BYTES_BILLED_ATTR] = 40
+            return df
+
+        execute_within_budget("SELECT 1", execute, budget, "ana", estimated=150)
+        assert calls == [200]
+        assert budget.used("ana") == 140
+
+        execute_within_budget("SELECT 1", lambda q, **kw: pd.DataFrame(), budget, "ana", 60)
+        assert budget.used("ana") == 200
+
+    def test_scheduler_refuses_report_over_budget(self):
+        scheduler = ReportScheduler(budget=QueryBudget(max_bytes_per_query=100))
+        report = ScheduledReport("censo", "Censo completo", Frequency.DIARIO, [], "censo")
+        executed = []
+        ok = scheduler.execute_report(report, executed.append, estimator=lambda r: 1000)
+        assert ok is False
+        assert executed == []
+        assert report.last_estimate_bytes == 1000
+
+        assert scheduler.execute_report(report, executed.append, estimator=lambda r: 10)
+        assert executed == [report]
+        assert scheduler.budget.used("agendador") == 10
+
+
+class TestBigQueryExecuteMany:
+
+    def test_runs_queries_concurrently(self):
+        latencies = {f"q{i}": 0.2 for i in range(4)}
+        client = make_fake_bq_client(FakeLatencyClient(latencies))
+        start = time.perf_counter()
+        results = dict(client.execute_many({k: k for k in latencies}, max_workers=4))
+        elapsed = time.perf_counter() - start
+        assert set(results) == set(latencies)
+        assert all(df is not None for df in results.values())
+        assert elapsed < 0.6
+
+    def test_yields_in_completion_order(self):
+        client = make_fake_bq_client(FakeLatencyClient({"lenta": 0.3, "rapida": 0.01}))
+        names = [name for name, _ in client.execute_many({"lenta": "lenta", "rapida": "rapida"})]
+        assert names == ["rapida", "lenta"]
+
+    def test_error_isolation(self):
+        fake = FakeLatencyClient({"ok": 0.01, "erro": 0.01}, failing={"erro"})
+        client = make_fake_bq_client(fake)
+        results = dict(client.execute_many({"ok": "ok", "erro": "erro"}))
+        assert results["ok"] is not None
+        assert results["erro"] is None
+
+    def test_per_query_timeout_cancels_job(self):
+        fake = FakeLatencyClient({"lenta": 5.0, "rapida": 0.01})
+        client = make_fake_bq_client(fake)
+        results = dict(client.execute_many({"lenta": "lenta", "rapida": "rapida"}, timeout=0.1))
+        assert results["lenta"] is None
+        assert results["rapida"] is not None
+        assert fake.jobs["lenta"].cancelled
+
+    def test_submissions_use_job_ids_params_and_breaker(self):
+        fake = FakeLatencyClient({"q": 0.01})
+        client = make_fake_bq_client(fake)
+        results = dict(client.execute_many({"a": "q"}, params={"a": {"ano": 2023}}))
+        assert results["a"] is not None
+        job_id, job_config = fake.submissions[0]
+        assert job_id == deterministic_job_id("q", {"ano": 2023})
+        assert job_config.query_parameters[0].name == "ano"
+
+        client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        client.breaker.record_failure()
+        assert dict(client.execute_many({"b": "q"})) == {"b": None}
+        assert len(fake.submissions) == 1
+
+
+class FakeHealthClient:
+
+    def __init__(self, healthy: bool = True):
+        self.healthy = healthy
+        self.queries: list[str] = []
+        self.closed = False
+
+    def query(self, query, job_config=None, job_id=None, timeout=None):
+        self.queries.append(query)
+        if not self.healthy:
+            raise RuntimeError("servico indisponivel")
+        return FakeQueryJob([])
+
+    def close(self):
+        self.closed = True
+
+
+class TestBigQueryClientPool:
+
+    def test_client_created_once_without_health_check(self):
+        created = []
+
+        def factory():
+            client = make_fake_bq_client(FakeHealthClient())
+            created.append(client)
+            return client
+
+        pool = BigQueryClientPool("fake.json", "projeto-teste", health_check_interval=0,
+                                  client_factory=factory)
+        first = pool.get_client()
+        second = pool.get_client()
+        assert first is second
+        assert len(created) == 1
+        assert first.client.queries == []
+
+    def test_client_replaced_only_after_consecutive_failures(self):
+        fakes = [FakeHealthClient(healthy=False), FakeHealthClient()]
+        created = iter(fakes)
+        pool = BigQueryClientPool("fake.json", "projeto-teste", health_check_interval=0,
+                                  failure_threshold=2,
+                                  client_factory=lambda: make_fake_bq_client(next(created)))
+        first = pool.get_client()
+        assert not pool.run_health_check()
+        assert pool.get_client() is first
+
+        assert not pool.run_health_check()
+        second = pool.get_client()
+        assert second is not first and second.client is fakes[1]
+        assert not fakes[0].closed
+        assert pool.status()["connected"]
+
+        assert pool.run_health_check()
+        assert pool.status()["consecutive_failures"] == 0
+
+    def test_client_kept_when_replacement_fails(self):
+        fake = FakeHealthClient(healthy=False)
+        clients = iter([make_fake_bq_client(fake), None])
+        pool = BigQueryClientPool("fake.json", "projeto-teste", health_check_interval=0,
+                                  failure_threshold=1, client_factory=lambda: next(clients))
+        first = pool.get_client()
+        assert not pool.run_health_check()
+        assert pool.get_client() is first
+        assert not fake.closed
+
+    def test_background_health_check(self):
+        fake = FakeHealthClient()
+        pool = BigQueryClientPool("fake.json", "projeto-teste", health_check_interval=0.05,
+                                  client_factory=lambda: make_fake_bq_client(fake))
+        pool.get_client()
+        time.sleep(0.2)
+        pool.close()
+        assert pool.healthy
+        assert "SELECT 1 AS health_check" in fake.queries
 
 
 class TestCacheManager:
@@ -35,6 +813,17 @@ class TestCacheManager:
         cache.set("q3", "r3")
         assert cache.size == 2
 
+    def test_default_limits_from_config(self, tmp_path):
+        shared_path = tmp_path / "compartilhado" / "cache.sqlite"
+        cache = create_cache_manager(shared_path, tmp_path / "disco")
+        assert cache.max_bytes == MAX_CACHE_BYTES
+        assert cache.default_hard_ttl == CACHE_HARD_TTL_SECONDS
+        assert isinstance(cache.disk_cache, DiskCache)
+
+        (tmp_path / "compartilhado").mkdir()
+        shared = create_cache_manager(shared_path, tmp_path / "disco")
+        assert isinstance(shared.disk_cache, SharedCache)
+
     def test_cache_stats(self):
         cache = CacheManager(default_ttl=3600)
         cache.set("q1", "r1")
@@ -55,6 +844,833 @@ class TestCacheManager:
         assert cache.get("SELECT *", params={"estado": "SP"}) == "r1"
         assert cache.get("SELECT *", params={"estado": "RJ"}) == "r2"
 
+    def test_cache_evicts_least_recently_used(self):
+        cache = CacheManager(default_ttl=60, max_entries=2)
+        cache.set("q1", "r1")
+        cache.set("q2", "r2")
+        cache.get("q1")
+        cache.set("q3", "r3")
+        assert cache.get("q1") == "r1"
+        assert cache.get("q2") is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_cache_byte_budget(self):
+        df = pd.DataFrame({"sigla_uf": ["SP"] * 1000, "valor": range(1000)})
+        df_size = int(df.memory_usage(deep=True).sum())
+        cache = CacheManager(default_ttl=60, max_entries=100, max_bytes=df_size * 2)
+        cache.set("q1", df)
+        cache.set("q2", df.copy())
+        cache.set("q3", df.copy())
+        assert cache.size == 2
+        assert cache.total_bytes <= df_size * 2
+        assert cache.get("q1") is None
+
+    def test_cache_rejects_value_over_budget(self):
+        cache = CacheManager(default_ttl=60, max_bytes=100)
+        cache.set("grande", pd.DataFrame({"x": range(1000)}))
+        assert cache.size == 0
+
+    def test_cache_stats_entry_sizes(self):
+        cache = CacheManager(default_ttl=60)
+        df = pd.DataFrame({"x": range(100)})
+        cache.set("q1", df)
+        cache.get("q1")
+        stats = cache.stats()
+        assert stats["total_bytes"] == int(df.memory_usage(deep=True).sum())
+        assert stats["entries"][0]["size_bytes"] == stats["total_bytes"]
+        assert stats["entries"][0]["hits"] == 1
+
+    def test_cache_overwrite_updates_bytes(self):
+        cache = CacheManager(default_ttl=60)
+        cache.set("q1", pd.DataFrame({"x": range(1000)}))
+        cache.set("q1", pd.DataFrame({"x": range(10)}))
+        assert cache.size == 1
+        assert cache.total_bytes == cache.stats()["entries"][0]["size_bytes"]
+
+
+class TestDiskCache:
+
+    def sample_df(self, rows: int = 100) -> pd.DataFrame:
+        return pd.DataFrame({
+            "sigla_uf": ["SP", "RJ"] * (rows // 2),
+            "taxa_aprovacao": [90.0 + i % 5 for i in range(rows)],
+        })
+
+    @pytest.mark.parametrize("file_format", ["arrow", "parquet"])
+    def test_roundtrip(self, tmp_path, file_format):
+        disk = DiskCache(tmp_path, file_format=file_format)
+        df = self.sample_df()
+        assert disk.put("chave", df, ttl=60)
+        value, meta = disk.get("chave")
+        pd.testing.assert_frame_equal(value, df)
+        assert 0 < meta["expires_at"] - time.time() <= 60
+
+    def test_expired_entry_removed(self, tmp_path):
+        disk = DiskCache(tmp_path)
+        disk.put("chave", self.sample_df(), ttl=60)
+        meta_path = tmp_path / "chave.json"
+        meta = json.loads(meta_path.read_text())
+        meta["expires_at"] = time.time() - 1
+        meta_path.write_text(json.dumps(meta))
+        assert disk.get("chave") is None
+        assert not (tmp_path / "chave.arrow").exists()
+
+    def test_size_cap_evicts_least_recent(self, tmp_path):
+        disk = DiskCache(tmp_path)
+        disk.put("a", self.sample_df(1000))
+        entry_size = disk.total_bytes
+        disk.max_bytes = entry_size * 2
+        os.utime(tmp_path / "a.arrow", (time.time() - 100, time.time() - 100))
+        disk.put("b", self.sample_df(1000))
+        disk.put("c", self.sample_df(1000))
+        assert disk.get("a") is None
+        assert disk.get("c") is not None
+        assert disk.total_bytes <= entry_size * 2
+
+    def test_leftover_temp_files_cleaned(self, tmp_path):
+        (tmp_path / "parcial.tmp").write_bytes(b"lixo")
+        DiskCache(tmp_path)
+        assert not list(tmp_path.glob("*.tmp"))
+
+    def test_non_tabular_values_skipped(self, tmp_path):
+        disk = DiskCache(tmp_path)
+        assert not disk.put("escalar", 42)
+
+    def test_mixed_type_frame_skipped(self, tmp_path):
+        disk = DiskCache(tmp_path)
+        df = pd.DataFrame({"a": [1, "x", 2.5]})
+        assert not disk.put("misto", df)
+        cache = CacheManager(default_ttl=60, disk_cache=disk, spill_threshold_bytes=1)
+        cache.set("misto", df)
+        pd.testing.assert_frame_equal(cache.get("misto"), df)
+
+    def test_cache_manager_spills_evicted_entries(self, tmp_path):
+        cache = CacheManager(default_ttl=60, max_entries=1, disk_cache=DiskCache(tmp_path))
+        df = self.sample_df()
+        cache.set("q1", df)
+        cache.set("q2", self.sample_df())
+        assert cache.size == 1
+        pd.testing.assert_frame_equal(cache.get("q1"), df)
+
+    def test_cache_manager_survives_restart(self, tmp_path):
+        df = self.sample_df()
+        first = CacheManager(default_ttl=60, disk_cache=DiskCache(tmp_path),
+                             spill_threshold_bytes=1)
+        first.set("SELECT * FROM censo", df)
+        assert first.size == 0
+
+        restarted = CacheManager(default_ttl=60, disk_cache=DiskCache(tmp_path))
+        pd.testing.assert_frame_equal(restarted.get("SELECT * FROM censo"), df)
+
+    def test_cache_manager_invalidate_removes_disk_copy(self, tmp_path):
+        cache = CacheManager(default_ttl=60, disk_cache=DiskCache(tmp_path),
+                             spill_threshold_bytes=1)
+        cache.set("q1", self.sample_df())
+        cache.invalidate("q1")
+        assert cache.get("q1") is None
+
+
+class TestSharedCache:
+
+    def sample_df(self) -> pd.DataFrame:
+        return pd.DataFrame({"sigla_uf": ["SP", "RJ"], "taxa_aprovacao": [91.0, 89.5]})
+
+    def test_roundtrip_preserves_type(self, tmp_path):
+        shared = SharedCache(tmp_path / "cache.sqlite")
+        df = self.sample_df()
+        shared.put("df", df, ttl=60, tables=frozenset({"educacao.censo"}))
+        shared.put("arrow", pa.Table.from_pandas(df, preserve_index=False))
+        shared.put("escalar", {"total": 3})
+        value, meta = shared.get("df")
+        pd.testing.assert_frame_equal(value, df)
+        assert meta["tables"] == ["educacao.censo"]
+        assert isinstance(shared.get("arrow")[0], pa.Table)
+        assert shared.get("escalar")[0] == {"total": 3}
+
+    def test_mixed_type_frame_not_shared(self, tmp_path):
+        shared = SharedCache(tmp_path / "cache.sqlite")
+        df = pd.DataFrame({"a": [1, "x", 2.5]})
+        assert not shared.put("misto", df)
+        cache = CacheManager(default_ttl=60, disk_cache=shared)
+        cache.set("misto", df)
+        pd.testing.assert_frame_equal(cache.get("misto"), df)
+
+    def test_replicas_share_results(self, tmp_path):
+        db = tmp_path / "cache.sqlite"
+        replica_a = CacheManager(default_ttl=60, disk_cache=SharedCache(db))
+        replica_b = CacheManager(default_ttl=60, disk_cache=SharedCache(db))
+        replica_a.set("SELECT * FROM educacao.censo", self.sample_df())
+        pd.testing.assert_frame_equal(
+            replica_b.get("SELECT * FROM educacao.censo"), self.sample_df()
+        )
+        replica_b.invalidate_table("educacao.censo")
+        replica_c = CacheManager(default_ttl=60, disk_cache=SharedCache(db))
+        assert replica_c.get("SELECT * FROM educacao.censo") is None
+
+    def test_lease_is_exclusive(self, tmp_path):
+        db = tmp_path / "cache.sqlite"
+        first, second = SharedCache(db), SharedCache(db)
+        assert first.acquire_lease("q")
+        assert not second.acquire_lease("q")
+        first.release_lease("q")
+        assert second.acquire_lease("q")
+
+    def test_expired_lease_taken_over(self, tmp_path):
+        db = tmp_path / "cache.sqlite"
+        first = SharedCache(db, lease_seconds=0.05)
+        second = SharedCache(db, poll_interval=0.01)
+        assert first.acquire_lease("q")
+        assert second.single_flight("q", lambda: "recalculado") == "recalculado"
+
+    def test_lease_renewed_while_computing(self, tmp_path):
+        db = tmp_path / "cache.sqlite"
+        owner = SharedCache(db, lease_seconds=0.15)
+        other = SharedCache(db)
+        taken = []
+
+        def slow_compute():
+            time.sleep(0.5)
+            taken.append(other.acquire_lease("q"))
+            return "valor"
+
+        assert owner.single_flight("q", slow_compute) == "valor"
+        assert taken == [False]
+        assert other.acquire_lease("q")
+
+    def test_single_flight_across_replicas(self, tmp_path):
+        db = tmp_path / "cache.sqlite"
+        replica_a = CacheManager(default_ttl=60, disk_cache=SharedCache(db, poll_interval=0.01))
+        replica_b = CacheManager(default_ttl=60, disk_cache=SharedCache(db, poll_interval=0.01))
+        calls = []
+        started = threading.Event()
+
+        def slow_loader():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return self.sample_df()
+
+        results = {}
+        worker = threading.Thread(
+            target=lambda: results.update(a=replica_a.get_or_compute("q", slow_loader))
+        )
+        worker.start()
+        started.wait(timeout=5)
+        results["b"] = replica_b.get_or_compute("q", slow_loader)
+        worker.join()
+
+        assert len(calls) == 1
+        pd.testing.assert_frame_equal(results["b"], self.sample_df())
+
+    def test_size_cap_evicts_least_recent(self, tmp_path):
+        shared = SharedCache(tmp_path / "cache.sqlite")
+        shared.put("a", self.sample_df())
+        shared.max_bytes = shared.total_bytes * 2
+        shared.put("b", self.sample_df())
+        shared.get("a")
+        shared.put("c", self.sample_df())
+        assert shared.get("b") is None
+        assert shared.get("a") is not None
+
+
+class TestSubsetCache:
+
+    def superset_df(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "ano": [2015, 2016, 2017, 2018] * 3,
+            "sigla_uf": ["SP"] * 4 + ["RJ"] * 4 + ["MG"] * 4,
+            "dependencia_administrativa": ["Estadual", "Municipal"] * 6,
+            "ideb": [float(i) for i in range(12)],
+        })
+
+    def test_parse_select(self):
+        shape = parse_select(
+            "SELECT ano, ideb FROM `p.d.censo` WHERE sigla_uf IN ('SP', 'RJ') "
+            "AND ano BETWEEN 2015 AND 2020 AND ano > 2016 ORDER BY ano DESC"
+        )
+        assert shape.table == "`p.d.censo`"
+        assert shape.columns == ("ano", "ideb")
+        assert shape.predicates["sigla_uf"].values == frozenset({"SP", "RJ"})
+        assert shape.predicates["ano"].low == 2016
+        assert not shape.predicates["ano"].low_inclusive
+        assert shape.order_by == [("ano", False)]
+
+    @pytest.mark.parametrize("query", [
+        "SELECT uf, COUNT(*) FROM t GROUP BY uf",
+        "SELECT * FROM t WHERE a = 1 OR b = 2",
+        "SELECT * FROM t LIMIT 10",
+        "SELECT * FROM t WHERE a IN (SELECT a FROM u)",
+    ])
+    def test_parse_rejects_unsupported(self, query):
+        assert parse_select(query) is None
+
+    def test_filtered_query_answered_from_superset(self):
+        qb = QueryBuilder(dataset="educacao", project_id="teste")
+        subset_cache = SubsetCache(CacheManager(default_ttl=60))
+        subset_cache.set(
+            qb.build_education_query("censo", ano_inicio=2015, ano_fim=2023),
+            self.superset_df().sort_values("ano", ascending=False, kind="mergesort"),
+        )
+
+        result = subset_cache.get(
+            qb.build_education_query("censo", estado="RJ", ano_inicio=2016, ano_fim=2017)
+        )
+        assert list(result["ano"]) == [2017, 2016]
+        assert set(result["sigla_uf"]) == {"RJ"}
+        assert subset_cache.stats()["derived_hits"] == 1
+
+    def test_projection_and_in_list(self):
+        subset_cache = SubsetCache(CacheManager(default_ttl=60))
+        subset_cache.set("SELECT * FROM censo", self.superset_df())
+        result = subset_cache.get(
+            "SELECT sigla_uf, ideb FROM censo "
+            "WHERE sigla_uf IN ('SP', 'MG') AND dependencia_administrativa = 'Estadual'"
+        )
+        assert list(result.columns) == ["sigla_uf", "ideb"]
+        assert list(result["ideb"]) == [0.0, 2.0, 8.0, 10.0]
+
+    def test_wider_query_not_answered(self):
+        subset_cache = SubsetCache(CacheManager(default_ttl=60))
+        subset_cache.set("SELECT * FROM censo WHERE ano >= 2016", self.superset_df())
+        assert subset_cache.get("SELECT * FROM censo WHERE ano >= 2015") is None
+        assert subset_cache.get("SELECT * FROM censo") is None
+        assert subset_cache.get("SELECT * FROM outra WHERE ano >= 2017") is None
+
+    def test_missing_filter_column_not_answered(self):
+        subset_cache = SubsetCache(CacheManager(default_ttl=60))
+        subset_cache.set("SELECT ano, ideb FROM censo", self.superset_df()[["ano", "ideb"]])
+        assert subset_cache.get("SELECT ano, ideb FROM censo WHERE sigla_uf = 'SP'") is None
+        assert subset_cache.get("SELECT * FROM censo WHERE ano = 2015") is None
+
+    def test_parameterized_queries_resolved(self):
+        subset_cache = SubsetCache(CacheManager(default_ttl=60))
+        query = "SELECT * FROM censo WHERE ano >= @ano_min AND sigla_uf IN UNNEST(@estados)"
+        subset_cache.set(query, self.superset_df(), {"ano_min": 2015, "estados": ["SP", "RJ"]})
+
+        result = subset_cache.get(query, {"ano_min": 2017, "estados": ["RJ"]})
+        assert set(result["sigla_uf"]) == {"RJ"}
+        assert result["ano"].min() >= 2017
+        assert subset_cache.get(query, {"ano_min": 2017, "estados": ["MG"]}) is None
+        assert parse_select(query, {"ano_min": 2015}) is None
+        assert parse_select("SELECT * FROM censo WHERE ano = @ano") is None
+
+    def test_one_outcome_per_lookup(self):
+        cache = CacheManager(default_ttl=60)
+        subset_cache = SubsetCache(cache)
+        subset_cache.set("SELECT * FROM censo", self.superset_df())
+        assert subset_cache.get("SELECT * FROM censo WHERE ano = 2015") is not None
+        total = cache.metrics.snapshot()["total"]
+        assert (total["hits"], total["misses"]) == (1, 0)
+
+        assert subset_cache.get("SELECT * FROM outra") is None
+        total = cache.metrics.snapshot()["total"]
+        assert (total["hits"], total["misses"]) == (1, 1)
+
+    def test_invalidated_superset_dropped(self):
+        cache = CacheManager(default_ttl=60)
+        subset_cache = SubsetCache(cache)
+        subset_cache.set("SELECT * FROM censo", self.superset_df())
+        cache.invalidate_table("censo")
+        assert subset_cache.get("SELECT * FROM censo WHERE ano = 2015") is None
+        assert subset_cache.stats()["indexed_queries"] == 0
+
+
+class TestCacheCodec:
+
+    def sample_df(self, rows: int = 6000) -> pd.DataFrame:
+        return pd.DataFrame({
+            "sigla_uf": ["SP", "RJ", "MG"] * (rows // 3),
+            "etapa_ensino": ["Ensino Medio", "Educacao Infantil"] * (rows // 2),
+            "escola": [f"Escola {i}" for i in range(rows)],
+            "ideb": [5.0 + (i % 10) / 10 for i in range(rows)],
+        })
+
+    @pytest.mark.parametrize("compression", ["zstd", "lz4"])
+    def test_roundtrip_preserves_frame(self, compression):
+        codec = ArrowCodec(compression)
+        df = self.sample_df()
+        compressed = codec.encode(df)
+        assert compressed.nbytes < compressed.raw_bytes
+        pd.testing.assert_frame_equal(codec.decode(compressed), df)
+
+    def test_arrow_table_roundtrip(self):
+        codec = ArrowCodec()
+        table = pa.Table.from_pandas(self.sample_df(), preserve_index=False)
+        assert codec.decode(codec.encode(table)).equals(table)
+
+    def test_non_tabular_not_encoded(self):
+        assert ArrowCodec().encode({"total": 1}) is None
+
+    def test_invalid_compression(self):
+        with pytest.raises(ValueError):
+            ArrowCodec("gzip")
+
+    def test_mixed_type_column_stored_uncompressed(self):
+        df = pd.DataFrame({"a": [1, "x", 2.5]})
+        assert ArrowCodec().encode(df) is None
+        cache = CacheManager(default_ttl=60, codec=ArrowCodec())
+        assert cache.get_or_compute("misto", lambda: df) is df
+        pd.testing.assert_frame_equal(cache.get("misto"), df)
+        assert not cache.stats()["entries"][0]["compressed"]
+
+    def test_cache_manager_stores_compressed(self):
+        plain = CacheManager(default_ttl=60)
+        compressed = CacheManager(default_ttl=60, codec=ArrowCodec(), hot_entries=1)
+        df = self.sample_df()
+        plain.set("q1", df)
+        compressed.set("q1", df)
+        compressed.set("escalar", 42)
+
+        assert compressed.total_bytes * 5 < plain.total_bytes
+        pd.testing.assert_frame_equal(compressed.get("q1"), df)
+        assert compressed.get("escalar") == 42
+        assert compressed.stats()["entries"][0]["compressed"]
+
+    def test_hot_set_reuses_decoded_value(self):
+        cache = CacheManager(default_ttl=60, codec=ArrowCodec(), hot_entries=1)
+        cache.set("q1", self.sample_df(30))
+        cache.set("q2", self.sample_df(30))
+        first = cache.get("q1")
+        assert cache.get("q1") is first
+        cache.get("q2")
+        assert cache.stats()["hot_entries"] == 1
+        assert cache.get("q1") is not first
+
+    def test_hot_set_counts_toward_byte_budget(self):
+        df = self.sample_df(3000)
+        cache = CacheManager(default_ttl=60, codec=ArrowCodec(), hot_entries=10)
+        cache.set("q0", df)
+        compressed_size = cache.total_bytes
+        decoded_size = estimate_size(cache.codec.decode(cache.codec.encode(df)))
+        cache.max_bytes = compressed_size * 4 + decoded_size
+        for i in range(1, 4):
+            cache.set(f"q{i}", df)
+        for i in range(4):
+            cache.get(f"q{i}")
+            assert cache.total_bytes <= cache.max_bytes
+        stats = cache.stats()
+        assert stats["hot_entries"] == 1
+        assert stats["hot_bytes"] == decoded_size
+        assert stats["total_entries"] == 4
+
+        cache.set("q4", df)
+        assert cache.stats()["hot_entries"] == 0
+        assert cache.size == 5
+
+    def test_spill_writes_decoded_value(self, tmp_path):
+        cache = CacheManager(default_ttl=60, max_entries=1, codec=ArrowCodec(),
+                             disk_cache=DiskCache(tmp_path))
+        df = self.sample_df(30)
+        cache.set("q1", df)
+        cache.set("q2", df)
+        pd.testing.assert_frame_equal(cache.get("q1"), df)
+
+
+class TestStaleWhileRevalidate:
+
+    def age_entry(self, cache: CacheManager, query: str, seconds: float) -> None:
+        cache._cache[CacheManager._generate_key(query)].created_at -= seconds
+
+    def wait_refresh(self, cache: CacheManager) -> None:
+        deadline = time.time() + 2
+        while cache.stats()["refreshing"] and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_stale_value_served_and_refreshed(self):
+        cache = CacheManager(default_ttl=10, default_hard_ttl=100)
+        cache.set("q", "antigo")
+        self.age_entry(cache, "q", 20)
+
+        refreshed = threading.Event()
+
+        def loader():
+            refreshed.set()
+            return "novo"
+
+        assert cache.get_or_compute("q", loader) == "antigo"
+        assert refreshed.wait(2)
+        self.wait_refresh(cache)
+        assert cache.get("q") == "novo"
+
+    def test_plain_get_misses_after_soft_ttl(self):
+        cache = CacheManager(default_ttl=10, default_hard_ttl=100)
+        cache.set("q", "antigo")
+        self.age_entry(cache, "q", 20)
+        assert cache.get("q") is None
+        assert cache.size == 1
+
+    def test_hard_ttl_is_a_real_miss(self):
+        cache = CacheManager(default_ttl=10, default_hard_ttl=100)
+        cache.set("q", "antigo")
+        self.age_entry(cache, "q", 200)
+        assert cache.get_or_compute("q", lambda: "novo") == "novo"
+
+    def test_single_background_refresh_per_key(self):
+        cache = CacheManager(default_ttl=10, default_hard_ttl=100)
+        cache.set("q", "antigo")
+        self.age_entry(cache, "q", 20)
+        calls = {"n": 0}
+
+        def slow_loader():
+            calls["n"] += 1
+            time.sleep(0.1)
+            return "novo"
+
+        for _ in range(5):
+            assert cache.get_or_compute("q", slow_loader) == "antigo"
+        self.wait_refresh(cache)
+        assert calls["n"] == 1
+
+    def test_failed_refresh_keeps_stale_value(self):
+        cache = CacheManager(default_ttl=10, default_hard_ttl=100)
+        cache.set("q", "antigo")
+        self.age_entry(cache, "q", 20)
+
+        def failing():
+            raise RuntimeError("BigQuery indisponivel")
+
+        assert cache.get_or_compute("q", failing) == "antigo"
+        self.wait_refresh(cache)
+        assert cache.get_or_compute("q", failing) == "antigo"
+
+
+class TestTableInvalidation:
+
+    CENSO = "SELECT * FROM `p.d.censo_escolar` WHERE ano = 2023"
+    IDEB = "SELECT * FROM `p.d.ideb` WHERE ano = 2021"
+
+    def test_extract_tables(self):
+        query = (
+            "WITH base AS (SELECT * FROM `p.d.censo_escolar`) "
+            "SELECT EXTRACT(YEAR FROM data) FROM base JOIN p.d.ideb USING (ano)"
+        )
+        assert extract_tables(query) == {"p.d.censo_escolar", "p.d.ideb"}
+
+    def test_invalidate_only_dependent_entries(self):
+        cache = CacheManager(default_ttl=60)
+        cache.set(self.CENSO, "censo")
+        cache.set(self.IDEB, "ideb")
+        assert cache.invalidate_table("p.d.censo_escolar") == 1
+        assert cache.get(self.CENSO) is None
+        assert cache.get(self.IDEB) == "ideb"
+
+    def test_explicit_tables_from_query_builder(self):
+        qb = QueryBuilder(dataset="d", project_id="p")
+        cache = CacheManager(default_ttl=60)
+        cache.set("SELECT 1", "r", tables=[qb.table_ref("censo_escolar")])
+        assert cache.tracked_tables() == {"p.d.censo_escolar"}
+
+    def test_watcher_invalidates_after_table_rewrite(self):
+        cache = CacheManager(default_ttl=3600)
+        cache.set(self.CENSO, "censo")
+        cache.set(self.IDEB, "ideb")
+        created = time.time()
+        metadata = {
+            "p.d.censo_escolar": {"modified": datetime.fromtimestamp(created - 60).isoformat()},
+            "p.d.ideb": {"modified": datetime.fromtimestamp(created - 60).isoformat()},
+        }
+        watcher = TableWatcher(cache, lambda table: metadata[table], interval=0)
+
+        assert watcher.poll_once() == 0
+        metadata["p.d.censo_escolar"]["modified"] = datetime.fromtimestamp(
+            created + 1
+        ).isoformat()
+        assert watcher.poll_once() == 1
+        assert cache.get(self.CENSO) is None
+        assert cache.get(self.IDEB) == "ideb"
+
+    def test_disk_entries_invalidated(self, tmp_path):
+        cache = CacheManager(default_ttl=60, disk_cache=DiskCache(tmp_path),
+                             spill_threshold_bytes=1)
+        cache.set(self.CENSO, pd.DataFrame({"x": [1]}))
+        assert "p.d.censo_escolar" in cache.tracked_tables()
+        assert cache.invalidate_table("p.d.censo_escolar") == 1
+        assert cache.get(self.CENSO) is None
+
+
+class TestCacheMetrics:
+
+    def test_hit_miss_counters(self):
+        cache = CacheManager(default_ttl=60)
+        cache.get("SELECT 1")
+        cache.set("SELECT 1", "r")
+        cache.get("SELECT 1")
+        cache.get("select 1")
+        total = cache.stats()["metrics"]["total"]
+        assert total["hits"] == 2
+        assert total["misses"] == 1
+        assert cache.stats()["hit_ratio"] == pytest.approx(2 / 3, abs=1e-3)
+
+    def test_namespace_and_page_breakdown(self):
+        cache = CacheManager(default_ttl=60)
+        set_current_page("kpis")
+        try:
+            cache.get_or_compute("SELECT 1", lambda: "r", namespace="indicadores")
+            cache.get_or_compute("SELECT 1", lambda: "r", namespace="indicadores")
+        finally:
+            set_current_page("-")
+        snapshot = cache.metrics.snapshot()
+        assert snapshot["by_namespace"]["indicadores"]["hits"] == 1
+        assert snapshot["by_namespace"]["indicadores"]["misses"] == 1
+        assert snapshot["by_page"]["kpis"]["hits"] == 1
+
+    def test_time_saved_and_miss_latency(self):
+        cache = CacheManager(default_ttl=60)
+
+        def slow():
+            time.sleep(0.05)
+            return "r"
+
+        cache.get_or_compute("SELECT 1", slow)
+        cache.get_or_compute("SELECT 1", slow)
+        total = cache.metrics.snapshot()["total"]
+        assert total["miss_latency_ms"] >= 50
+        assert total["time_saved_ms"] >= 50
+
+    def test_evictions_and_bytes(self):
+        cache = CacheManager(default_ttl=60, max_entries=1)
+        cache.set("q1", pd.DataFrame({"x": range(10)}))
+        cache.set("q2", pd.DataFrame({"x": range(10)}))
+        total = cache.metrics.snapshot()["total"]
+        assert total["evictions"] == 1
+        assert total["bytes_stored"] > 0
+
+    def test_fingerprint_breakdown(self):
+        cache = CacheManager(default_ttl=60)
+        cache.set("SELECT 1", "r")
+        cache.get("select   1")
+        by_fp = cache.metrics.snapshot()["by_fingerprint"]
+        assert by_fp[sql_fingerprint("SELECT 1")[:16]]["hits"] == 1
+
+    def test_prometheus_export(self):
+        cache = CacheManager(default_ttl=60)
+        cache.set("SELECT 1", "r")
+        cache.get("SELECT 1")
+        text = cache.prometheus_metrics()
+        assert "# TYPE painel_cache_hits_total counter" in text
+        assert 'painel_cache_hits_total{namespace="default",page="-"} 1' in text
+        assert "painel_cache_entries 1" in text
+
+    def test_fingerprint_cardinality_capped(self):
+        metrics = CacheMetrics(max_fingerprints=2)
+        for i in range(5):
+            metrics.record_miss(fingerprint=f"fp{i}")
+        assert len(metrics.snapshot()["by_fingerprint"]) == 3
+
+
+class TestCacheWarmup:
+
+    def build_history(self) -> QueryHistory:
+        history = QueryHistory()
+        for _ in range(5):
+            history.add(QueryRecord(query="SELECT * FROM leve", execution_time_ms=10.0))
+        for _ in range(2):
+            history.add(QueryRecord(query="SELECT * FROM pesada", execution_time_ms=900.0))
+        history.add(QueryRecord(query="SELECT * FROM falha", status="error"))
+        return history
+
+    def test_history_persistence(self, tmp_path):
+        path = tmp_path / "historico.json"
+        history = QueryHistory(storage_path=path)
+        history.add(QueryRecord(query="SELECT 1", execution_time_ms=12.5, user="ana"))
+        assert history.save()
+
+        reloaded = QueryHistory(storage_path=path)
+        record = reloaded.get_recent(1)[0]
+        assert record.execution_time_ms == 12.5
+        assert record.fingerprint == sql_fingerprint("SELECT 1")
+        assert isinstance(record.executed_at, datetime)
+
+    def test_history_saved_on_add_and_params_replayed(self, tmp_path):
+        path = tmp_path / "historico.json"
+        query = "SELECT * FROM censo WHERE ano = @ano"
+        QueryHistory(storage_path=path).add(
+            QueryRecord(query=query, execution_time_ms=50.0, params={"ano": 2023})
+        )
+
+        candidates = rank_candidates(QueryHistory(storage_path=path))
+        assert candidates[0].params == {"ano": 2023}
+
+        cache = CacheManager(default_ttl=60)
+        calls = []
+
+        def executor(query, params=None):
+            calls.append(params)
+            return pd.DataFrame({"x": [1]})
+
+        CacheWarmer(cache, executor).run(candidates)
+        assert calls == [{"ano": 2023}]
+        assert cache.get(query, {"ano": 2023}) is not None
+
+    def test_client_records_only_rerun_queries(self):
+        client = make_fake_bq_client(FakeSlowClient(blocking=False))
+        client.jobs = JobTracker()
+        client.history = QueryHistory()
+        generation = client.jobs.begin_rerun("sessao-h")
+        client.execute_query("SELECT * FROM aquecimento")
+
+        def rerun():
+            set_current_rerun("sessao-h", generation)
+            client.execute_query("SELECT * FROM censo WHERE ano = @ano", params={"ano": 2023})
+
+        thread = threading.Thread(target=rerun)
+        thread.start()
+        thread.join(timeout=5)
+        records = client.history.get_recent()
+        assert [r.params for r in records] == [{"ano": 2023}]
+        assert records[0].is_success
+
+    def test_rank_by_frequency_times_latency(self, tmp_path):
+        saved = SavedQueryManager(storage_path=tmp_path / "salvas.json")
+        saved.save_query(SavedQuery(name="nova", query="SELECT * FROM nunca_rodou"))
+        ranked = rank_candidates(self.build_history(), saved)
+        assert [c.query for c in ranked] == [
+            "SELECT * FROM pesada", "SELECT * FROM leve", "SELECT * FROM nunca_rodou",
+        ]
+        assert rank_candidates(self.build_history(), top_n=1)[0].score == 1800.0
+
+    def test_warm_populates_cache(self):
+        cache = CacheManager(default_ttl=60)
+        cache.set("SELECT * FROM leve", pd.DataFrame({"x": [0]}))
+        executed = []
+
+        def executor(query, params=None):
+            executed.append(query)
+            return pd.DataFrame({"x": [1]})
+
+        summary = CacheWarmer(cache, executor).run(rank_candidates(self.build_history()))
+        assert executed == ["SELECT * FROM pesada"]
+        assert summary["warmed"] == 1 and summary["cached"] == 1
+        assert cache.get("SELECT * FROM pesada") is not None
+
+    def test_bytes_budget_respected(self):
+        cache = CacheManager(default_ttl=60)
+        df = pd.DataFrame({"x": range(1000)})
+        candidates = [WarmupCandidate(str(i), f"SELECT {i}") for i in range(3)]
+        warmer = CacheWarmer(cache, lambda q, params=None: df, max_workers=1,
+                             bytes_budget=int(df.memory_usage(deep=True).sum()))
+        summary = warmer.run(candidates)
+        assert summary["warmed"] == 1
+        assert summary["skipped"] == 2
+        assert cache.size == 1
+
+    def test_time_budget_stops_warmup(self):
+        cache = CacheManager(default_ttl=60)
+
+        def slow_executor(query, params=None):
+            time.sleep(0.3)
+            return pd.DataFrame({"x": [1]})
+
+        candidates = [WarmupCandidate(str(i), f"SELECT {i}") for i in range(4)]
+        warmer = CacheWarmer(cache, slow_executor, max_workers=1, time_budget_seconds=0.1)
+        start = time.monotonic()
+        summary = warmer.run(candidates)
+        assert time.monotonic() - start < 0.3
+        assert summary["skipped"] == 4
+
+
+class TestSingleFlight:
+
+    def test_concurrent_calls_coalesced(self):
+        flight = SingleFlight()
+        calls = {"n": 0}
+        barrier = threading.Barrier(10)
+
+        def slow_query():
+            calls["n"] += 1
+            time.sleep(0.2)
+            return "resultado"
+
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(flight.do("chave", slow_query))
+
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert calls["n"] == 1
+        assert results == ["resultado"] * 10
+        stats = flight.stats()
+        assert stats["executions"] == 1
+        assert stats["coalesced"] == 9
+        assert stats["in_flight"] == 0
+
+    def test_exception_propagates_to_waiters(self):
+        flight = SingleFlight()
+
+        def failing():
+            raise RuntimeError("falha")
+
+        with pytest.raises(RuntimeError):
+            flight.do("chave", failing)
+        assert flight.in_flight == 0
+
+    def test_cache_get_or_compute_single_execution(self):
+        cache = CacheManager(default_ttl=60)
+        calls = {"n": 0}
+
+        def loader():
+            calls["n"] += 1
+            time.sleep(0.1)
+            return pd.DataFrame({"x": [1]})
+
+        threads = [
+            threading.Thread(target=cache.get_or_compute, args=("SELECT 1", loader))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert calls["n"] == 1
+        assert cache.get("SELECT 1") is not None
+
+
+class TestSqlNormalizer:
+
+    def test_whitespace_and_keyword_case(self):
+        a = "select sigla_uf,  avg(ideb)\nfrom `p.d.ideb`\n  where ano = 2021 group by sigla_uf"
+        b = "SELECT sigla_uf, AVG(ideb) FROM `p.d.ideb` WHERE ano = 2021 GROUP BY sigla_uf;"
+        assert sql_fingerprint(a) == sql_fingerprint(b)
+
+    def test_comments_removed(self):
+        a = "SELECT * -- todas as colunas\nFROM t /* tabela */ WHERE ano = 2023"
+        assert canonicalize_sql(a) == "SELECT * FROM t WHERE ano = 2023"
+
+    def test_in_list_sorted(self):
+        a = "SELECT * FROM t WHERE sigla_uf IN ('SP', 'RJ', 'MG')"
+        b = "SELECT * FROM t WHERE sigla_uf IN ('MG','SP','RJ', 'SP')"
+        assert canonicalize_sql(a) == canonicalize_sql(b)
+
+    def test_string_literals_keep_case(self):
+        a = "SELECT * FROM t WHERE regiao = 'Sul'"
+        b = "SELECT * FROM t WHERE regiao = 'SUL'"
+        assert sql_fingerprint(a) != sql_fingerprint(b)
+
+    def test_subquery_in_not_sorted(self):
+        query = "SELECT * FROM t WHERE uf IN (SELECT uf FROM u)"
+        assert canonicalize_sql(query) == "SELECT * FROM t WHERE uf IN ( SELECT uf FROM u )"
+
+    def test_cache_keys_shared(self):
+        cache = CacheManager(default_ttl=60)
+        cache.set("select *\nfrom t   where uf in ('SP','RJ')", "r1")
+        assert cache.get("SELECT * FROM t WHERE uf IN ('RJ', 'SP') -- editor") == "r1"
+
+    def test_history_groups_by_fingerprint(self):
+        history = QueryHistory()
+        history.add(QueryRecord(query="select 1"))
+        history.add(QueryRecord(query="SELECT   1;"))
+        history.add(QueryRecord(query="SELECT 2"))
+        groups = history.group_by_fingerprint()
+        assert len(groups) == 2
+        assert len(history.get_by_fingerprint(sql_fingerprint("SELECT 1"))) == 2
+
 
 class TestQueryBuilder:
 
@@ -87,6 +1703,22 @@ class TestQueryBuilder:
         assert "AVG(taxa_aprovacao)" in query
         assert "GROUP BY sigla_uf" in query
 
+    def test_build_aggregate_query_from_spec(self):
+        spec = AggregateSpec(
+            group_by=["sigla_uf"],
+            measures=[Measure("ideb", "median", "mediana"), Measure("ideb", "count")],
+        )
+        query = self.qb.build_aggregate_query("indicadores", spec, where="ano = 2023")
+        assert query == (
+            "SELECT sigla_uf, APPROX_QUANTILES(ideb, 100)[OFFSET(50)] AS mediana, "
+            "COUNT(ideb) AS count_ideb FROM `projeto-teste.educacao.indicadores` "
+            "WHERE ano = 2023 GROUP BY sigla_uf"
+        )
+
+    def test_build_aggregation_without_groups(self):
+        query = self.qb.build_aggregation("indicadores", ["SUM(aprovados) AS aprovados"], [])
+        assert "GROUP BY" not in query
+
     def test_build_date_range_filter(self):
         f = self.qb.build_date_range_filter("data", "2020-01-01", "2023-12-31")
         assert "BETWEEN" in f
@@ -96,11 +1728,417 @@ class TestQueryBuilder:
         assert "sigla_uf = 'SP'" in query
         assert "ano >= 2020" in query
 
+    def test_build_kpi_batch_query(self):
+        query = self.qb.build_kpi_batch_query(
+            "indicadores", ["ideb", "taxa_abandono"], [2022, 2023], where="sigla_uf = 'SP'"
+        )
+        assert query.count("FROM") == 1
+        assert "AVG(IF(ano = 2023, ideb, NULL)) AS ideb__2023" in query
+        assert "AVG(IF(ano = 2022, taxa_abandono, NULL)) AS taxa_abandono__2022" in query
+        assert query.endswith("WHERE ano IN (2022, 2023) AND sigla_uf = 'SP'")
+
     def test_build_kpi_query(self):
         query = self.qb.build_kpi_query("indicadores", "taxa_aprovacao")
         assert "AVG(taxa_aprovacao)" in query
 
 
+class TestAggregateSpec:
+
+    def rows(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "sigla_uf": ["SP", "SP", "RJ", "RJ", "RJ"],
+            "ideb": [5.0, 6.0, 4.0, 5.0, 9.0],
+        })
+
+    def spec(self) -> AggregateSpec:
+        return AggregateSpec(
+            group_by=["sigla_uf"],
+            measures=[Measure("ideb", "mean", "media"), Measure("ideb", "median", "mediana"),
+                      Measure("ideb", "count", "n")],
+        )
+
+    def test_aggregate_rows(self):
+        result = self.spec().aggregate(self.rows()).set_index("sigla_uf")
+        assert result.loc["RJ", "media"] == 6.0
+        assert result.loc["RJ", "mediana"] == 5.0
+        assert result.loc["SP", "n"] == 2
+
+    def test_aggregated_input_passes_through(self):
+        aggregated = self.spec().aggregate(self.rows())
+        assert self.spec().is_aggregated(aggregated)
+        assert not self.spec().is_aggregated(self.rows())
+        pd.testing.assert_frame_equal(self.spec().aggregate(aggregated), aggregated)
+
+    def test_aggregate_without_groups(self):
+        spec = AggregateSpec(measures=[Measure("ideb", "sum", "total")])
+        assert spec.aggregate(self.rows())["total"].tolist() == [29.0]
+
+    def test_invalid_stat(self):
+        with pytest.raises(ValueError):
+            Measure("ideb", "mode")
+
+
+class TestRollupCube:
+
+    def rows(self) -> pd.DataFrame:
+        n = 240
+        return pd.DataFrame({
+            "ano": [2020 + i % 4 for i in range(n)],
+            "sigla_uf": [["SP", "RJ", "BA"][i % 3] for i in range(n)],
+            "dependencia_administrativa": [["Estadual", "Municipal"][i % 2] for i in range(n)],
+            "ideb": [3.0 + (i * 7 % 31) / 10 for i in range(n)],
+        })
+
+    def cube(self) -> RollupCube:
+        cube = RollupCube(["ano", "sigla_uf", "dependencia_administrativa"], ["ideb"])
+        cube.load_rows(self.rows())
+        return cube
+
+    def test_coarser_slice_matches_pandas(self):
+        spec = AggregateSpec(
+            group_by=["sigla_uf"],
+            measures=[
+                Measure("ideb", stat, stat)
+                for stat in ("mean", "std", "count", "min", "max", "sum")
+            ],
+        )
+        result = self.cube().answer(spec).set_index("sigla_uf").sort_index()
+        expected = spec.aggregate(self.rows()).set_index("sigla_uf").sort_index()
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    def test_filtered_total(self):
+        state = FilterState()
+        state.estados = ["SP", "RJ"]
+        state.ano_inicio = 2022
+        spec = AggregateSpec(measures=[Measure("ideb", "mean", "media")])
+        result = self.cube().answer(spec, filter_predicates(state))
+        rows = self.rows()
+        mask = rows["sigla_uf"].isin(["SP", "RJ"]) & (rows["ano"] >= 2022)
+        assert result["media"].iloc[0] == pytest.approx(rows.loc[mask, "ideb"].mean())
+
+    def test_non_additive_or_unknown_not_answered(self):
+        cube = self.cube()
+        assert cube.answer(AggregateSpec(["sigla_uf"], [Measure("ideb", "median")])) is None
+        assert cube.answer(AggregateSpec(["regiao"], [Measure("ideb", "mean")])) is None
+        assert cube.answer(AggregateSpec(["ano"], [Measure("taxa_abandono", "mean")])) is None
+        assert RollupCube().answer(AggregateSpec(["ano"], [Measure("ideb", "mean")])) is None
+
+    def test_build_query(self):
+        qb = QueryBuilder(dataset="educacao", project_id="teste")
+        query = RollupCube(["ano", "sigla_uf"], ["ideb"]).build_query(qb, "indicadores")
+        assert "SUM(ideb * ideb) AS ideb__sumsq" in query
+        assert query.endswith("GROUP BY ano, sigla_uf")
+
+    def test_save_and_reload(self, tmp_path):
+        cube = self.cube()
+        assert cube.save(tmp_path / "cubo.parquet")
+        reloaded = RollupCube(cube.dimensions, cube.measures)
+        assert reloaded.load_file(tmp_path / "cubo.parquet")
+        assert reloaded.size == cube.size
+        assert reloaded.built_at == pytest.approx(cube.built_at)
+        spec = AggregateSpec(["ano"], [Measure("ideb", "mean", "media")])
+        pd.testing.assert_frame_equal(reloaded.answer(spec), cube.answer(spec))
+
+
+class TestGroupingSets:
+
+    def setup_method(self):
+        self.qb = QueryBuilder(dataset="educacao", project_id="teste")
+
+    def result(self) -> pd.DataFrame:
+        # Resultado simulado de ROLLUP (regiao, sigla_uf); inclui uma regiao NULL real
+        return pd.DataFrame({
+            "regiao": [None, "Sul", "Sul", "Sul", None, None],
+            "sigla_uf": [None, None, "PR", "RS", "XX", None],
+            "media": [5.0, 5.5, 5.4, 5.6, 4.0, 4.0],
+            "grouping__regiao": [1, 0, 0, 0, 0, 0],
+            "grouping__sigla_uf": [1, 1, 0, 0, 0, 1],
+        })
+
+    def test_build_rollup_query(self):
+        query = self.qb.build_grouping_sets(
+            "indicadores", ["AVG(ideb) AS media"], [["regiao", "sigla_uf"]], rollup=True
+        )
+        assert "GROUPING(sigla_uf) AS grouping__sigla_uf" in query
+        assert query.endswith("GROUP BY ROLLUP (regiao, sigla_uf)")
+
+    def test_build_grouping_sets_query(self):
+        query = self.qb.build_grouping_sets(
+            "indicadores", ["AVG(ideb) AS media"], [[], ["regiao"], ["sigla_uf"]]
+        )
+        assert query.endswith("GROUP BY GROUPING SETS ((), (regiao), (sigla_uf))")
+
+    def test_split_levels(self):
+        levels = split_grouping_sets(self.result(), rollup_levels(["regiao", "sigla_uf"]))
+        assert list(levels) == [(), ("regiao",), ("regiao", "sigla_uf")]
+        assert levels[()]["media"].tolist() == [5.0]
+        assert levels[("regiao",)]["regiao"].iloc[0] == "Sul"
+        assert levels[("regiao",)]["regiao"].isna().iloc[1]
+        assert list(levels[("regiao", "sigla_uf")].columns) == ["regiao", "sigla_uf", "media"]
+        assert len(levels[("regiao", "sigla_uf")]) == 3
+
+    def test_levels_filed_under_plain_group_by_keys(self):
+        cache = CacheManager(default_ttl=60)
+        metrics = ["AVG(ideb) AS media"]
+        levels = split_grouping_sets(self.result(), rollup_levels(["regiao", "sigla_uf"]))
+        assert file_levels_in_cache(cache, self.qb, "indicadores", metrics, levels) == 3
+
+        by_region = self.qb.build_aggregation("indicadores", metrics, ["regiao"])
+        pd.testing.assert_frame_equal(cache.get(by_region), levels[("regiao",)])
+        total = self.qb.build_aggregation("indicadores", metrics, [])
+        assert cache.get(total)["media"].iloc[0] == 5.0
+
+
+class TestApproximateMode:
+
+    def setup_method(self):
+        self.qb = QueryBuilder(dataset="educacao", project_id="teste")
+        self.spec = AggregateSpec(
+            group_by=["regiao"],
+            measures=[
+                Measure("ideb", "mean", "media"),
+                Measure("id_escola", "count_distinct", "escolas"),
+                Measure("matriculas", "sum", "total"),
+            ],
+        )
+
+    def test_exact_query_is_unchanged(self):
+        query = self.qb.build_aggregate_query("indicadores", self.spec)
+        assert "COUNT(DISTINCT id_escola) AS escolas" in query
+        assert "TABLESAMPLE" not in query
+        assert "linhas_amostra" not in query
+
+    def test_approximate_query(self):
+        mode = ApproximateMode(sample_percent=10)
+        query = self.qb.build_aggregate_query("indicadores", self.spec, approximate=mode)
+        assert "FROM `teste.educacao.indicadores` TABLESAMPLE SYSTEM (10 PERCENT)" in query
+        assert "APPROX_COUNT_DISTINCT(id_escola) AS escolas" in query
+        assert "SUM(matriculas) * 10 AS total" in query
+        assert "AVG(ideb) AS media" in query
+        assert "COUNT(*) AS linhas_amostra" in query
+
+    def test_invalid_sample_percent(self):
+        with pytest.raises(ValueError):
+            ApproximateMode(sample_percent=0)
+
+    def test_error_bound(self):
+        assert error_bound_pct(["mean"], ApproximateMode()) == 0.0
+        assert error_bound_pct(["median"], ApproximateMode()) == 1.0
+        assert error_bound_pct(["count_distinct"], ApproximateMode()) == pytest.approx(
+            0.57, abs=0.01
+        )
+        sampled = ApproximateMode(sample_percent=10)
+        assert error_bound_pct(["mean"], sampled, sample_rows=100) > error_bound_pct(
+            ["mean"], sampled, sample_rows=10_000
+        )
+        assert error_bound_pct(["mean"], sampled, sample_rows=0) == 100.0
+
+    def test_finalize_annotates_error(self):
+        df = pd.DataFrame({
+            "regiao": ["Sul", "Norte"], "media": [5.0, 4.0], "linhas_amostra": [400, 100],
+        })
+        result = self.spec.finalize_approximate(df, ApproximateMode(sample_percent=10))
+        assert "linhas_amostra" not in result.columns
+        assert approximate_error(result) == error_bound_pct(
+            ["mean", "count_distinct", "sum"], ApproximateMode(sample_percent=10), 100
+        )
+        assert approximate_badge_text(approximate_error(result)).startswith("aproximado \u00b1")
+        assert approximate_error(pd.DataFrame()) is None
+
+
+class FakeWarehouse:
+    """Cliente falso com metadados de tabela e registro das queries."""
+
+    def __init__(
+        self, df: pd.DataFrame, num_bytes: int, modified: str = "2020-01-01T00:00:00+00:00"
+    ):
+        self.df = df
+        self.metadata = {"num_rows": len(df), "num_bytes": num_bytes, "modified": modified}
+        self.queries: list[str] = []
+        self.params: list[dict | None] = []
+
+    def get_table_metadata(self, table_ref):
+        return self.metadata
+
+    def execute_query(self, query, timeout=300, params=None):
+        self.queries.append(query)
+        self.params.append(params)
+        return self.df.groupby("regiao", as_index=False).agg(media=("ideb", "mean"))
+
+
+class TestQueryPlanner:
+
+    @pytest.fixture
+    def rows(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "ano": [2022, 2023, 2023, 2023],
+            "regiao": ["Sul", "Sul", "Norte", "Norte"],
+            "sigla_uf": ["PR", "RS", "AM", "PA"],
+            "ideb": [5.0, 6.0, 4.0, 4.4],
+        })
+
+    def setup_method(self):
+        self.qb = QueryBuilder(dataset="educacao", project_id="teste")
+        self.spec = AggregateSpec(group_by=["regiao"], measures=[Measure("ideb", "mean", "media")])
+
+    def cube(self, rows) -> RollupCube:
+        cube = RollupCube(dimensions=["ano", "regiao", "sigla_uf"], measures=["ideb"])
+        cube.load_rows(rows)
+        return cube
+
+    def local(self, rows, tmp_path) -> LocalParquetBackend:
+        pytest.importorskip("duckdb")
+        rows.to_parquet(tmp_path / "indicadores.parquet")
+        backend = LocalParquetBackend(tmp_path)
+        assert backend.connect()
+        return backend
+
+    def test_bigquery_when_nothing_else(self, rows):
+        client = FakeWarehouse(rows, num_bytes=10 ** 9)
+        planner = QueryPlanner(self.qb, client=client, cache=CacheManager(default_ttl=60))
+        request = QueryRequest("indicadores", self.spec)
+        plan = planner.plan(request)
+        assert plan.chosen.source == "bigquery"
+        assert plan.rejected["cache"] == "resultado fora do cache"
+
+        result = planner.execute(request)
+        assert len(client.queries) == 1
+        assert planner.plan(request).chosen.source == "cache"
+        pd.testing.assert_frame_equal(planner.execute(request), result)
+        assert len(client.queries) == 1
+
+    def test_cube_preferred_and_answers_filters(self, rows):
+        client = FakeWarehouse(rows, num_bytes=10 ** 9)
+        planner = QueryPlanner(self.qb, client=client, cubes={"indicadores": self.cube(rows)})
+        request = filter_request("indicadores", self.spec, FilterState())
+        request.predicates = {"ano": Predicate(low=2023)}
+        assert planner.plan(request).chosen.source == "cubo"
+
+        result = planner.execute(request).set_index("regiao")["media"]
+        assert result["Sul"] == pytest.approx(6.0)
+        assert result["Norte"] == pytest.approx(4.2)
+        assert client.queries == []
+
+    def test_stale_cube_and_unsupported_measure_rejected(self, rows):
+        cube = self.cube(rows)
+        cube.built_at = 0
+        client = FakeWarehouse(rows, num_bytes=10 ** 9)
+        planner = QueryPlanner(self.qb, client=client, cubes={"indicadores": cube})
+        plan = planner.plan(QueryRequest("indicadores", self.spec))
+        assert plan.chosen.source == "bigquery"
+        assert "anterior" in plan.rejected["cubo"]
+
+        median = AggregateSpec(group_by=["regiao"], measures=[Measure("ideb", "median")])
+        plan = QueryPlanner(self.qb, client=client, cubes={"indicadores": self.cube(rows)}).plan(
+            QueryRequest("indicadores", median)
+        )
+        assert "cubo" in plan.rejected
+
+    def test_local_extract_with_literal_filters(self, rows, tmp_path):
+        client = FakeWarehouse(rows, num_bytes=10 ** 9)
+        planner = QueryPlanner(self.qb, client=client, local=self.local(rows, tmp_path))
+        state = FilterState()
+        state.estados = ["PR", "RS"]
+        request = filter_request("indicadores", self.spec, state)
+        plan = planner.plan(request)
+        assert plan.chosen.source == "local"
+        assert "sigla_uf IN ('PR', 'RS')" in plan.chosen.query
+        assert "UNNEST(@estados)" in plan.cache_query
+
+        result = planner.execute(request)
+        assert result["regiao"].tolist() == ["Sul"]
+        assert result["media"].iloc[0] == pytest.approx(5.5)
+        assert client.queries == []
+
+    def test_small_table_goes_to_cheapest_source(self, rows, tmp_path):
+        client = FakeWarehouse(rows, num_bytes=10 ** 3)
+        local = self.local(rows, tmp_path)
+        local_plan = QueryPlanner(self.qb, client=client, local=local).plan(
+            QueryRequest("indicadores", self.spec)
+        )
+        costs = {c.source: c.cost_ms for c in local_plan.candidates}
+        assert costs["local"] < costs["bigquery"]
+
+        client.metadata["modified"] = "2999-01-01T00:00:00+00:00"
+        plan = QueryPlanner(self.qb, client=client, local=local).plan(
+            QueryRequest("indicadores", self.spec)
+        )
+        assert plan.chosen.source == "bigquery"
+        assert "anterior" in plan.rejected["local"]
+
+    def test_falls_back_when_source_fails(self, rows, tmp_path):
+        client = FakeWarehouse(rows, num_bytes=10 ** 9)
+        local = LocalParquetBackend(tmp_path)
+        rows.to_parquet(tmp_path / "indicadores.parquet")
+        planner = QueryPlanner(self.qb, client=client, local=local)
+        result = planner.execute(QueryRequest("indicadores", self.spec))
+        assert result is not None
+        assert len(client.queries) == 1
+
+    def test_bigquery_receives_predicates_as_params(self, rows):
+        client = FakeWarehouse(rows, num_bytes=10 ** 9)
+        planner = QueryPlanner(self.qb, client=client)
+        request = QueryRequest("indicadores", self.spec, predicates={
+            "regiao": Predicate(values=frozenset({"Centro-Oeste's", "Sul"})),
+            "ano": Predicate(low=2023),
+        })
+        plan = planner.plan(request)
+        assert "regiao IN UNNEST(@regiao)" in plan.cache_query
+        assert "ano >= @ano_min" in plan.cache_query
+        assert "Centro-Oeste" not in plan.cache_query
+
+        planner.execute(request)
+        assert client.params == [{"ano_min": 2023, "regiao": ["Centro-Oeste's", "Sul"]}]
+
+    def test_where_without_predicates_only_cache_or_bigquery(self, rows):
+        planner = QueryPlanner(self.qb, client=FakeWarehouse(rows, 10 ** 9),
+                               cubes={"indicadores": self.cube(rows)})
+        request = QueryRequest("indicadores", self.spec, where="ano >= @ano", params={"ano": 2023})
+        plan = planner.plan(request)
+        assert plan.chosen.source == "bigquery"
+        assert plan.rejected["cubo"] == "filtro sem predicados por coluna"
+
+
+class TestLocalParquetBackend:
+
+    @pytest.fixture
+    def backend(self, tmp_path):
+        pytest.importorskip("duckdb")
+        pd.DataFrame({
+            "ano": [2021, 2022, 2023, 2023],
+            "sigla_uf": ["SP", "SP", "SP", "RJ"],
+            "taxa_aprovacao": [90.0, 91.0, 92.0, 89.0],
+        }).to_parquet(tmp_path / "indicadores.parquet")
+        backend = LocalParquetBackend(tmp_path)
+        assert backend.connect()
+        yield backend
+        backend.close()
+
+    def test_implements_protocol(self, backend):
+        assert isinstance(backend, QueryBackend)
+        assert isinstance(BigQueryClient("fake.json", "projeto-teste"), QueryBackend)
+
+    def test_query_builder_maps_local_tables(self, backend):
+        qb = QueryBuilder("educacao", "projeto-teste", local_tables=backend.table_paths())
+        query = qb.build_education_query("indicadores", estado="SP", ano_inicio=2022)
+        assert "read_parquet" in query
+        df = backend.execute_query(query)
+        assert list(df["ano"]) == [2023, 2022]
+
+    def test_query_by_view_name(self, backend):
+        df = backend.execute_query("SELECT COUNT(*) AS n FROM indicadores")
+        assert df["n"].iloc[0] == 4
+
+    def test_table_metadata(self, backend):
+        meta = backend.get_table_metadata("`projeto-teste.educacao.indicadores`")
+        assert meta["num_rows"] == 4
+        assert meta["num_bytes"] > 0
+        assert meta["modified"] is not None
+
+    def test_invalid_query_returns_none(self, backend):
+        assert backend.execute_query("SELECT * FROM inexistente") is None
+
+
 class TestCSVProcessor:
 
     def test_format_date_iso(self):
@@ -156,6 +2194,47 @@ class TestFilterState:
         assert "BA" in REGIOES_BR["Nordeste"]
         assert len(ESTADOS_BR) == 27
 
+    def test_compile_filters_parameterized(self):
+        state = FilterState()
+        state.regioes = ["Sul"]
+        state.etapas = ["Ensino Medio"]
+        state.ano_inicio = 2015
+        where, params = compile_filters(state)
+        assert where == (
+            "sigla_uf IN UNNEST(@estados) AND etapa_ensino IN UNNEST(@etapas) "
+            "AND ano >= @ano_inicio"
+        )
+        assert params == {"estados": ["PR", "RS", "SC"], "etapas": ["Ensino Medio"],
+                          "ano_inicio": 2015}
+
+    def test_compile_filters_text_stable_across_values(self):
+        first, second = FilterState(), FilterState()
+        first.estados, second.estados = ["SP"], ["RJ", "MG"]
+        assert compile_filters(first)[0] == compile_filters(second)[0]
+        assert compile_filters(FilterState()) == (None, {})
+
+    def test_compile_filters_order_independent(self):
+        first, second = FilterState(), FilterState()
+        first.estados, second.estados = ["SP", "RJ"], ["RJ", "SP"]
+        first.etapas, second.etapas = ["Ensino Medio", "Creche"], ["Creche", "Ensino Medio"]
+        assert compile_filters(first) == compile_filters(second)
+        assert compile_filters(first)[1]["estados"] == ["RJ", "SP"]
+
+    def test_explicit_estados_restricted_to_regioes(self):
+        state = FilterState()
+        state.regioes = ["Sudeste"]
+        state.estados = ["SP", "BA"]
+        assert compile_filters(state)[1]["estados"] == ["SP"]
+        df = pd.DataFrame({"sigla_uf": ["SP", "BA", "RJ"]})
+        assert list(apply_filters(df, state)["sigla_uf"]) == ["SP"]
+
+    def test_build_query_parameters(self):
+        params = build_query_parameters({"estados": ["SP", "RJ"], "ano_inicio": 2015, "vazio": []})
+        estados, ano, vazio = params
+        assert estados.array_type == "STRING" and estados.values == ["SP", "RJ"]
+        assert ano.type_ == "INT64" and ano.value == 2015
+        assert vazio.array_type == "STRING"
+
 
 class TestCacheEntry:
 
@@ -15,7 +15,12 @@ from src.analytics.data_quality import DataQualityChecker
 from src.analytics.forecasting import linear_forecast, moving_average_forecast
 from src.analytics.period_comparison import compare_periods
 from src.pages.cohort import build_cohort_matrix
-from src.pages.funnel import calculate_funnel_rates
+from src.pages.kpis import KPI_DEFINITIONS, build_kpis_query, reshape_kpi_batch
+from src.pages.funnel import calculate_funnel_rates, funnel_spec, funnel_values
+from src.pages.segmentation import (
+    build_segmentation_query, compute_segment_stats, segment_stats_spec, segmentation_levels,
+)
+from src.core.grouping_sets import file_levels_in_cache
 from src.pages.retention import calculate_retention_rate
 
 
@@ -238,6 +243,81 @@ class TestFunnelCalculation:
         assert rates[-1]["taxa_inicio"] == 72.0
 
 
+class TestAggregationPushdown:
+
+    def test_segment_stats_same_from_rows_or_aggregate(self):
+        rows = pd.DataFrame({
+            "regiao": ["Sul", "Sul", "Norte", "Norte", "Norte"],
+            "ideb": [5.0, 6.0, 4.0, 5.0, 9.0],
+        })
+        from_rows = compute_segment_stats(rows, "regiao", "ideb")
+        aggregated = segment_stats_spec("regiao", "ideb").aggregate(rows)
+        pd.testing.assert_frame_equal(
+            compute_segment_stats(aggregated, "regiao", "ideb"), from_rows
+        )
+        assert list(from_rows.columns) == [
+            "Media", "Mediana", "Desvio Padrao", "Minimo", "Maximo", "Contagem",
+        ]
+        assert list(from_rows.index) == ["Norte", "Sul"]
+
+    def test_funnel_from_aggregate_row(self):
+        rows = pd.DataFrame({"matriculas_iniciais": [60, 40], "aprovados": [50, 30]})
+        aggregated = funnel_spec().aggregate(rows.assign(
+            frequencia_regular=0, progresso_etapa=0, conclusao=0,
+        ))
+        assert len(aggregated) == 1
+        assert funnel_values(rows) == [100.0, 80.0]
+        assert funnel_values(aggregated)[0] == 100.0
+
+    def test_cohort_matrix_from_aggregate(self):
+        rows = pd.DataFrame({
+            "ano_ingresso": [2020, 2020, 2020, 2021],
+            "ano": [2020, 2020, 2021, 2021],
+            "total_matriculas": [60, 40, 90, 50],
+        })
+        matrix = build_cohort_matrix(rows)
+        assert matrix.loc[2020, 1] == 90.0
+
+
+class TestSegmentationDrillDown:
+
+    def test_every_dimension_cached_from_one_query(self):
+        qb = QueryBuilder(dataset="educacao", project_id="teste")
+        query = build_segmentation_query(qb, "indicadores", "ideb")
+        assert query.count("FROM") == 1
+        assert "GROUPING SETS ((regiao), (sigla_uf)" in query
+
+        cache = CacheManager(default_ttl=60)
+        metrics = segment_stats_spec("regiao", "ideb").metric_expressions()
+        levels = {level: pd.DataFrame({level[0]: ["a"], "media": [1.0]})
+                  for level in segmentation_levels()}
+        file_levels_in_cache(cache, qb, "indicadores", metrics, levels)
+
+        for (dim,) in segmentation_levels():
+            page_query = qb.build_aggregate_query("indicadores", segment_stats_spec(dim, "ideb"))
+            assert cache.get(page_query) is not None
+
+
+class TestKpiBatch:
+
+    def test_batch_query_reshaped_for_cards(self):
+        qb = QueryBuilder(dataset="educacao", project_id="teste")
+        query = build_kpis_query(qb, "indicadores", 2023)
+        assert query.count("AS ") == len(KPI_DEFINITIONS) * 2
+
+        row = pd.DataFrame([{
+            "taxa_aprovacao__2022": 91.0, "taxa_aprovacao__2023": 92.5,
+            "ideb__2022": 5.2, "ideb__2023": 5.4,
+        }])
+        tidy = reshape_kpi_batch(row)
+        assert list(tidy["ano"]) == [2022, 2023]
+        assert tidy["taxa_aprovacao"].iloc[-1] == 92.5
+        assert tidy["ideb"].iloc[-2] == 5.2
+
+    def test_reshape_empty(self):
+        assert reshape_kpi_batch(pd.DataFrame()).empty
+
+
 class TestRetentionCalculation:
 
     def test_retention_rate(self):